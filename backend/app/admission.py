@@ -0,0 +1,340 @@
+"""
+admission.py — Admission control and per-client rate limiting
+
+Expensive routes are grouped into route classes.  Each class has its own
+limits, checked by AdmissionMiddleware before the request reaches a handler:
+
+  1. token buckets per client → 429 + Retry-After when the client is over rate
+  2. concurrency cap          → at most `concurrency` requests of the class run
+                                at once; the rest wait in a FIFO queue
+  3. queue-time shedding      → a request that cannot start within `queue_ms`
+                                (or would not, judging by the current queue and
+                                recent service times) gets 503 + Retry-After
+
+Everything else — booking reads and writes, static data — bypasses the layer
+entirely, so a chat surge cannot starve it of DB connections.
+
+The client is the address the trusted proxy saw: the X-Forwarded-For hop
+TRUSTED_PROXY_HOPS from the end (Cloud Run appends the caller as the last
+hop), or the transport peer.  Hops further left, like the chat `session_id`
+in the body, are written by the client and never replace that key.  A chat
+session gets its own bucket nested under its address, and the address a
+bucket `sessions` times larger, so front desks behind one NAT keep separate
+budgets while inventing session ids only spends the shared one.  The
+address bucket is checked before the body is touched, and at most 64 KiB of
+it is read looking for the session; a larger body counts as no session.
+
+Route classes:
+  chat        : POST /api/chat                   (LLM + DB)
+  slots_wide  : GET /api/slots with days_ahead > SLOTS_WIDE_DAYS
+
+Environment variables (per class, comma-separated key=value, or "off"):
+  ADMISSION_CHAT       : default rate=0.5,burst=10,concurrency=8,queue_ms=3000,sessions=4
+  ADMISSION_SLOTS_WIDE : default rate=2,burst=10,concurrency=4,queue_ms=1000,sessions=1
+  SLOTS_WIDE_DAYS      : days_ahead above which /api/slots is "wide" (default: 14)
+  TRUSTED_PROXY_HOPS   : proxies appending to X-Forwarded-For; 0 uses the peer (default: 1)
+
+`rate` is tokens per second per session, `burst` the bucket size; one
+address gets `sessions` times both.
+Counters are exported on /metrics as admission_*.
+"""
+
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Callable
+from urllib.parse import parse_qs
+
+from app.metrics import registry
+
+SLOTS_WIDE_DAYS    = int(os.getenv("SLOTS_WIDE_DAYS", "14"))
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+_MAX_CLIENTS = 50_000        # buckets kept per class; least recently seen evicted first
+_MAX_BODY    = 64 * 1024     # only small JSON bodies are inspected for session_id
+
+DECISIONS  = registry.counter("admission_decisions_total", "Admission decisions by route class", ("route_class", "outcome"))
+QUEUE_WAIT = registry.histogram("admission_queue_wait_seconds", "Time spent queued before admission", ("route_class",))
+
+
+@dataclass
+class Limits:
+    rate        : float = 1.0       # tokens / second / client
+    burst       : float = 10.0
+    concurrency : int   = 4
+    queue_ms    : float = 1000.0
+    sessions    : int   = 1         # an address gets this many sessions' worth of rate and burst
+
+
+def parse_limits(spec: str, default: Limits) -> Limits | None:
+    """'rate=1,burst=5,concurrency=2,queue_ms=500' → Limits; 'off' → None."""
+    spec = spec.strip()
+    if spec.lower() in ("off", "0", "false", "none"):
+        return None
+    limits = Limits(**vars(default))
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        key, _, value = part.partition("=")
+        if key not in vars(limits):
+            raise ValueError(f"unknown admission setting {key!r} in {spec!r}")
+        setattr(limits, key, type(getattr(limits, key))(float(value)))
+    return limits
+
+
+# ── Token buckets ─────────────────────────────────────────────
+
+class TokenBuckets:
+    """One token bucket per client key, bounded in number (LRU)."""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = _MAX_CLIENTS):
+        self.rate, self.burst, self.max_clients = rate, burst, max_clients
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()   # key → (tokens, stamp)
+
+    def wait(self, key: str) -> float:
+        """Seconds until `key` has a token; 0 if it has one now.  Consumes nothing."""
+        now = time.monotonic()
+        tokens, stamp = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - stamp) * self.rate)
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.rate if self.rate > 0 else 60.0
+
+    def take(self, key: str) -> None:
+        """Consume one token of a bucket wait() just found ready."""
+        tokens, stamp = self._buckets[key]
+        self._buckets[key] = (tokens - 1, stamp)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+# ── Route classes ─────────────────────────────────────────────
+
+class Shed(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+@dataclass
+class RouteClass:
+    name    : str
+    matches : Callable[[dict], bool]
+    limits  : Limits
+    buckets : TokenBuckets = field(init=False)      # per session, nested under its address
+    peers   : TokenBuckets = field(init=False)      # per address
+    running : int = 0
+    waiters : deque = field(default_factory=deque)
+    service : float = 0.5          # EWMA of handler time, seconds
+
+    def __post_init__(self):
+        self.buckets = TokenBuckets(self.limits.rate, self.limits.burst)
+        n = max(1, self.limits.sessions)
+        self.peers = TokenBuckets(self.limits.rate * n, self.limits.burst * n)
+
+    def take(self, peer: str, session: str | None) -> float:
+        """One token from the address bucket and, for a session, its own; else seconds to wait."""
+        keys = [(self.peers, peer)]
+        if session is not None:
+            keys.append((self.buckets, f"{peer}\x00{session}"))
+        wait = max(buckets.wait(key) for buckets, key in keys)
+        if wait == 0:
+            for buckets, key in keys:
+                buckets.take(key)
+        return wait
+
+    def _expected_wait(self) -> float:
+        ahead = len(self.waiters) + 1
+        return math.ceil(ahead / self.limits.concurrency) * self.service
+
+    async def acquire(self) -> float:
+        """Wait for a run slot; returns seconds queued or raises Shed."""
+        if self.running < self.limits.concurrency and not self.waiters:
+            self.running += 1
+            return 0.0
+        budget = self.limits.queue_ms / 1000
+        if self._expected_wait() > budget:
+            raise Shed(self._expected_wait())
+        started = time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, budget)
+        except asyncio.TimeoutError:
+            raise Shed(self._expected_wait()) from None
+        except BaseException:
+            # Cancelled (client went away) just after release() handed us the slot
+            if fut.done() and not fut.cancelled():
+                self.release(time.perf_counter() - started)
+            raise
+        finally:
+            if fut in self.waiters:
+                self.waiters.remove(fut)
+        # release() handed its slot to us, `running` already counts it
+        return time.perf_counter() - started
+
+    def release(self, elapsed: float) -> None:
+        self.service = 0.8 * self.service + 0.2 * elapsed
+        while self.waiters:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.running -= 1
+
+
+def _is_chat(scope: dict) -> bool:
+    return scope["method"] == "POST" and scope["path"].rstrip("/") == "/api/chat"
+
+
+def _is_wide_slot_search(scope: dict) -> bool:
+    if scope["method"] != "GET" or scope["path"].rstrip("/") != "/api/slots":
+        return False
+    days = parse_qs(scope.get("query_string", b"").decode()).get("days_ahead", ["14"])[0]
+    try:
+        return int(days) > SLOTS_WIDE_DAYS
+    except ValueError:
+        return False
+
+
+def _configured() -> list[RouteClass]:
+    classes = []
+    for name, matches, env, default in (
+        ("chat",       _is_chat,             "ADMISSION_CHAT",       Limits(0.5, 10, 8, 3000, 4)),
+        ("slots_wide", _is_wide_slot_search, "ADMISSION_SLOTS_WIDE", Limits(2, 10, 4, 1000, 1)),
+    ):
+        limits = parse_limits(os.getenv(env, ""), default)
+        if limits is not None:
+            classes.append(RouteClass(name, matches, limits))
+    return classes
+
+
+ROUTE_CLASSES = _configured()
+
+
+def _collect():
+    rows = []
+    for rc in ROUTE_CLASSES:
+        labels = {"route_class": rc.name}
+        rows += [
+            ("admission_running",  "gauge", "Requests of the class currently running", labels, rc.running),
+            ("admission_queued",   "gauge", "Requests of the class waiting for a slot", labels, len(rc.waiters)),
+            ("admission_clients",  "gauge", "Addresses with a live token bucket",       labels, len(rc.peers)),
+            ("admission_sessions", "gauge", "Sessions with a live token bucket",        labels, len(rc.buckets)),
+            ("admission_concurrency_limit", "gauge", "Configured concurrency cap",       labels, rc.limits.concurrency),
+        ]
+    return rows
+
+
+registry.register_collector(_collect)
+
+
+# ── ASGI middleware ───────────────────────────────────────────
+
+def _peer(scope: dict, hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """The caller as seen by the outermost trusted proxy; never a client-written hop."""
+    if hops > 0:
+        forwarded = [h.strip() for name, value in scope.get("headers", []) if name == b"x-forwarded-for"
+                     for h in value.decode("latin-1").split(",") if h.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _content_length(scope: dict) -> int:
+    """Declared body size; 0 when absent (chunked) or unparseable, which _read_body still caps."""
+    for name, value in scope.get("headers", []):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return 0
+    return 0
+
+
+async def _read_body(receive, limit: int = _MAX_BODY) -> list[dict]:
+    """Messages up to the end of the body or the first one past `limit` bytes; the rest stays unread."""
+    messages, size = [], 0
+    while True:
+        message = await receive()
+        messages.append(message)
+        size += len(message.get("body", b""))
+        if message["type"] != "http.request" or not message.get("more_body") or size > limit:
+            return messages
+
+
+def _session_id(messages: list[dict]) -> str | None:
+    if messages[-1]["type"] != "http.request" or messages[-1].get("more_body"):
+        return None               # disconnected, or cut short at _MAX_BODY
+    body = b"".join(m.get("body", b"") for m in messages)
+    if not body or len(body) > _MAX_BODY:
+        return None
+    try:
+        session = json.loads(body).get("session_id")
+    except (ValueError, AttributeError):
+        return None
+    return str(session) if session else None
+
+
+async def _reject(send, status: int, detail: str, retry_after: float) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, classes: list[RouteClass] | None = None):
+        self.app = app
+        self.classes = ROUTE_CLASSES if classes is None else classes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rc = next((c for c in self.classes if c.matches(scope)), None)
+        if rc is None:
+            return await self.app(scope, receive, send)
+
+        # An address over its budget is refused before its body is read
+        peer, session = _peer(scope), None
+        wait = rc.peers.wait(peer)
+        if wait == 0 and scope["method"] == "POST" and _content_length(scope) <= _MAX_BODY:
+            # Buffer the head of the body to find the chat session, then replay it
+            buffered = await _read_body(receive)
+            session = _session_id(buffered)
+            pending, upstream = deque(buffered), receive
+
+            async def replay():
+                return pending.popleft() if pending else await upstream()
+            receive = replay
+
+        if wait == 0:
+            wait = rc.take(peer, session)
+        if wait > 0:
+            DECISIONS.labels(rc.name, "rate_limited").value += 1
+            return await _reject(send, 429, "Too many requests, slow down", wait)
+        try:
+            queued = await rc.acquire()
+        except Shed as e:
+            DECISIONS.labels(rc.name, "shed").value += 1
+            return await _reject(send, 503, "Server busy, try again shortly", e.retry_after)
+
+        DECISIONS.labels(rc.name, "admitted").value += 1
+        QUEUE_WAIT.labels(rc.name).observe(queued)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            rc.release(time.perf_counter() - started)
@@ -0,0 +1,256 @@
+"""
+booking.py — Conflict-checked, batched appointment inserts
+
+book_appointments() validates a batch of new appointments against the
+existing (clinic, date) books and against each other, then inserts the whole
+batch with one multi-row INSERT ... RETURNING.  Either every row is committed
+or nothing is and BookingConflict names the offending item.
+book_sharded() does the same for a batch whose clinics live on different
+shards (see app.shards).
+"""
+
+import json
+from datetime import date, timedelta
+from typing import Callable
+
+from sqlalchemy import select, insert, delete, and_, or_, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Appointment
+from app.data_model import get_doctor
+from app.invalidation import keys_for
+from app.shards import session_for, shard_for
+from app.routers.slots import _doctor_slots, _has_conflict, mins_to_time, time_to_mins
+
+
+class BookingConflict(Exception):
+    def __init__(self, index: int, item: dict):
+        self.index = index
+        self.item = item
+        super().__init__(
+            f"Appointment {index} clashes with another booking: "
+            f"{item['clinic_id']} {item['room_id']} {item['date']} {item['start_time']}"
+        )
+
+    @property
+    def detail(self) -> dict:
+        fields = ("procedure_id", "clinic_id", "room_id", "date", "start_time",
+                  "duration_mins", "primary_doctor_id")
+        return {
+            "message": str(self),
+            "index": self.index,
+            "appointment": {k: self.item.get(k) for k in fields},
+        }
+
+
+async def stage_refresh(db: AsyncSession, appts) -> None:
+    """Recompute free_slots (app.free_slots) for the clinic-days of `appts` in db's transaction."""
+    from app.free_slots import refresh_in
+    keys = keys_for(appts)
+    if keys:
+        await refresh_in(db, keys)
+
+
+async def lock_days(db: AsyncSession, keys: list[tuple[str, str]]) -> None:
+    """
+    Serialise concurrent writes to the same clinic-days (Postgres only).
+    Take it before stamping any row: updated_at must be close to commit time
+    for the change feed (see routers.appointments).
+    """
+    if db.bind.dialect.name != "postgresql":
+        return
+    # One round trip for every day; sorted input is a fixed order, which avoids deadlocks
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(k)) FROM unnest(CAST(:keys AS text[])) AS k"),
+        {"keys": [f"{clinic_id}:{dt}" for clinic_id, dt in sorted(keys)]},
+    )
+
+
+async def load_booked(db: AsyncSession, keys: list[tuple[str, str]]) -> dict[tuple[str, str], list[dict]]:
+    """Live bookings for each (clinic_id, date) in one query, served by ix_appointments_clinic_date."""
+    booked: dict[tuple[str, str], list[dict]] = {k: [] for k in keys}
+    if not keys:
+        return booked
+    dates_by_clinic: dict[str, set[str]] = {}
+    for c, d in keys:
+        dates_by_clinic.setdefault(c, set()).add(d)
+    rows = await db.execute(
+        select(
+            Appointment.clinic_id, Appointment.room_id, Appointment.date,
+            Appointment.start_time, Appointment.duration_mins, Appointment.doctor_ids,
+        )
+        .where(
+            or_(*(and_(Appointment.clinic_id == c, Appointment.date.in_(sorted(ds)))
+                  for c, ds in dates_by_clinic.items())),
+            Appointment.status != "cancelled",
+        )
+    )
+    for r in rows.mappings():
+        booked[(r["clinic_id"], r["date"])].append(dict(r))
+    return booked
+
+
+def first_conflict(items: list[dict], booked: dict[tuple[str, str], list[dict]]) -> int | None:
+    """Index of the first item clashing with `booked` or an earlier item; `booked` is extended in place."""
+    for i, item in enumerate(items):
+        day_booked = booked.setdefault((item["clinic_id"], item["date"]), [])
+        doctor_ids = item["doctor_ids"]
+        if isinstance(doctor_ids, str):
+            doctor_ids = json.loads(doctor_ids)
+        if _has_conflict(time_to_mins(item["start_time"]), item["duration_mins"],
+                         item["clinic_id"], item["room_id"], doctor_ids, day_booked):
+            return i
+        day_booked.append(item)
+    return None
+
+
+async def book_appointments(
+    db: AsyncSession,
+    items: list[dict],
+    before_commit: Callable[[list[Appointment]], None] | None = None,
+    resolve: Callable[[list[dict], dict], list[dict]] | None = None,
+) -> list[Appointment]:
+    """
+    Insert `items` (Appointment column dicts, doctor_ids JSON-encoded) in one
+    transaction.  Raises BookingConflict and rolls back on any clash.
+    `before_commit` may stage related changes in the same transaction.
+    `resolve(items, booked)` replaces the plain conflict check: it returns the
+    items to insert (possibly moved or dropped) or raises BookingConflict.
+    """
+    keys = list({(i["clinic_id"], i["date"]) for i in items})
+    try:
+        await lock_days(db, keys)
+        booked = await load_booked(db, keys)
+        if resolve is not None:
+            items = resolve(items, booked)
+        else:
+            clash = first_conflict(items, booked)
+            if clash is not None:
+                raise BookingConflict(clash, items[clash])
+        created = (await db.scalars(
+            insert(Appointment).returning(Appointment, sort_by_parameter_order=True), items
+        )).all() if items else []
+        await stage_refresh(db, created)
+        if before_commit is not None:
+            before_commit(list(created))
+        await db.commit()
+    except BaseException:
+        await db.rollback()
+        raise
+    return list(created)
+
+
+async def book_sharded(items: list[dict]) -> list[Appointment]:
+    """
+    book_appointments() for a batch that may span shards, in item order.
+    Shards commit their part one after another; a clash on a later shard
+    deletes what earlier shards committed, so the batch stays all-or-nothing.
+    """
+    groups: dict[str, list[int]] = {}
+    for i, item in enumerate(items):
+        groups.setdefault(shard_for(item["clinic_id"]).name, []).append(i)
+    created: dict[int, Appointment] = {}
+    done: list[tuple[str, list[str]]] = []
+    try:
+        for idxs in groups.values():
+            clinic_id = items[idxs[0]]["clinic_id"]
+            async with session_for(clinic_id) as db:
+                try:
+                    rows = await book_appointments(db, [items[i] for i in idxs])
+                except BookingConflict as e:
+                    raise BookingConflict(idxs[e.index], e.item) from None
+            created.update(zip(idxs, rows))
+            done.append((clinic_id, [a.id for a in rows]))
+    except BaseException:
+        for clinic_id, ids in done:
+            async with session_for(clinic_id) as db:
+                await db.execute(delete(Appointment).where(Appointment.id.in_(ids)))
+                await stage_refresh(db, [items[i] for i in groups[shard_for(clinic_id).name]])
+                await db.commit()
+        raise
+    return [created[i] for i in range(len(items))]
+
+
+# ── Recurring series ──────────────────────────────────────────
+
+MAX_OCCURRENCES = 366
+
+
+def expand_recurrence(first: date, freq: str, interval: int = 1,
+                      count: int | None = None, until: date | None = None) -> list[date]:
+    """Occurrence dates for a daily/weekly/monthly rule; monthly skips months without that day."""
+    limit = min(count or MAX_OCCURRENCES, MAX_OCCURRENCES)
+    dates: list[date] = []
+    step = 0
+    while len(dates) < limit:
+        if freq == "daily":
+            d = first + timedelta(days=step * interval)
+        elif freq == "weekly":
+            d = first + timedelta(weeks=step * interval)
+        elif freq == "monthly":
+            month = first.month - 1 + step * interval
+            try:
+                d = first.replace(year=first.year + month // 12, month=month % 12 + 1)
+            except ValueError:          # e.g. the 31st in a 30-day month
+                step += 1
+                continue
+        else:
+            raise ValueError(f"Unknown frequency: {freq}")
+        if until is not None and d > until:
+            break
+        dates.append(d)
+        step += 1
+    return dates
+
+
+def _free_starts(clinic_id: str, day: str, doctor_ids: list[str], duration: int) -> list[int]:
+    """Start minutes at which every doctor is rostered for the whole duration."""
+    our_dow = (date.fromisoformat(day).weekday() + 1) % 7
+    common = None
+    for doc_id in doctor_ids:
+        doc = get_doctor(doc_id)
+        slots = _doctor_slots(doc, clinic_id, our_dow) if doc else set()
+        common = slots if common is None else common & slots
+    common = common or set()
+    return sorted(s for s in common if all(s + off in common for off in range(0, duration, 15)))
+
+
+def place_series(items: list[dict], booked: dict, on_conflict: str = "fail",
+                 window_mins: int = 120) -> tuple[list[dict], list[dict]]:
+    """
+    One in-memory pass over a series against the preloaded `booked` days.
+    Clashing occurrences are moved to the nearest free start on the same day
+    within `window_mins` ("shift"), dropped ("skip") or reject the series
+    ("fail", and "shift" when nothing nearby is free).  Returns the items to
+    insert and a list of adjustments.
+    """
+    placed, adjusted = [], []
+    for i, item in enumerate(items):
+        day_booked = booked.setdefault((item["clinic_id"], item["date"]), [])
+        doctor_ids = json.loads(item["doctor_ids"])
+        start = time_to_mins(item["start_time"])
+        args = (item["duration_mins"], item["clinic_id"], item["room_id"], doctor_ids, day_booked)
+        if not _has_conflict(start, *args):
+            day_booked.append(item)
+            placed.append(item)
+            continue
+        if on_conflict == "skip":
+            adjusted.append({"index": i, "date": item["date"], "requested": item["start_time"],
+                             "start_time": None, "action": "skipped"})
+            continue
+        if on_conflict == "shift":
+            candidates = sorted(
+                (s for s in _free_starts(item["clinic_id"], item["date"], doctor_ids, item["duration_mins"])
+                 if abs(s - start) <= window_mins),
+                key=lambda s: (abs(s - start), s),
+            )
+            alt = next((s for s in candidates if not _has_conflict(s, *args)), None)
+            if alt is not None:
+                moved = {**item, "start_time": mins_to_time(alt)}
+                day_booked.append(moved)
+                placed.append(moved)
+                adjusted.append({"index": i, "date": item["date"], "requested": item["start_time"],
+                                 "start_time": moved["start_time"], "action": "shifted"})
+                continue
+        raise BookingConflict(i, item)
+    return placed, adjusted
@@ -0,0 +1,105 @@
+"""
+chat_store.py — Persistence for chat turns
+
+A chat turn (optional new session + user message + assistant reply) is written
+in a single transaction once the model has answered.  Optionally, inserts can be
+routed through a write-behind buffer that flushes every CHAT_WRITE_BEHIND_MS
+milliseconds in one bulk statement.
+
+Environment variables:
+  CHAT_WRITE_BEHIND_MS   : flush interval; 0 disables the buffer   (default: 0)
+  CHAT_WRITE_BEHIND_MAX  : max buffered messages before dropping   (default: 10000)
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+from app.models import ChatSession, ChatMessage
+
+log = logging.getLogger(__name__)
+
+WRITE_BEHIND_MS  = int(os.getenv("CHAT_WRITE_BEHIND_MS", "0"))
+WRITE_BEHIND_MAX = int(os.getenv("CHAT_WRITE_BEHIND_MAX", "10000"))
+
+
+async def save_turn(db: AsyncSession, session_id: str, messages: list[tuple[str, str]]) -> None:
+    """Create the session if needed and append `messages` ([(role, content)]) — one commit."""
+    if not await db.get(ChatSession, session_id):
+        db.add(ChatSession(id=session_id))
+    for role, content in messages:
+        db.add(ChatMessage(session_id=session_id, role=role, content=content))
+    await db.commit()
+
+
+class ChatWriteBuffer:
+    """Collects chat messages in memory and flushes them in bulk on a timer."""
+
+    def __init__(self, interval_ms: int, max_pending: int):
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+        self._pending: list[dict] = []
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def enqueue(self, session_id: str, messages: list[tuple[str, str]]) -> None:
+        if len(self._pending) >= self.max_pending:
+            log.warning("chat write buffer full (%d) — dropping %d messages",
+                        len(self._pending), len(messages))
+            return
+        now = datetime.utcnow()
+        self._pending.extend(
+            {"session_id": session_id, "role": role, "content": content, "created_at": now}
+            for role, content in messages
+        )
+
+    async def flush(self) -> int:
+        batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        try:
+            async with AsyncSessionLocal() as db:
+                session_ids = {m["session_id"] for m in batch}
+                existing = set((await db.execute(
+                    select(ChatSession.id).where(ChatSession.id.in_(session_ids))
+                )).scalars().all())
+                missing = session_ids - existing
+                if missing:
+                    await db.execute(insert(ChatSession), [{"id": sid} for sid in missing])
+                await db.execute(insert(ChatMessage), batch)
+                await db.commit()
+        except Exception:
+            log.exception("chat write buffer flush failed — requeueing %d messages", len(batch))
+            self._pending[:0] = batch[: max(0, self.max_pending - len(self._pending))]
+            return 0
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+write_buffer = ChatWriteBuffer(WRITE_BEHIND_MS, WRITE_BEHIND_MAX)
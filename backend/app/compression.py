@@ -0,0 +1,116 @@
+"""
+compression.py — Negotiated response compression
+
+CompressionMiddleware encodes HTTP responses with the best encoding the
+client accepts: brotli ("br", when the brotli package is installed), then
+gzip.  A single-message body smaller than COMPRESS_MIN_BYTES goes out as is;
+streamed bodies are compressed chunk by chunk.  Responses that already carry
+a Content-Encoding, Server-Sent Events and non-text media types pass
+through untouched, as do WebSockets.
+
+Environment variables:
+  COMPRESS_MIN_BYTES      : smallest body worth compressing; 0 disables  (default: 1024)
+  COMPRESS_GZIP_LEVEL     : zlib level 1-9                              (default: 6)
+  COMPRESS_BROTLI_QUALITY : brotli quality 0-11                         (default: 4)
+"""
+
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:         # optional: gzip only
+    brotli = None
+
+MIN_BYTES      = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL     = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+_COMPRESSIBLE = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """"br", "gzip" or None for an Accept-Encoding header, honouring q=0."""
+    offered: dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    wildcard = offered.get("*", 0.0)
+    for enc in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if offered.get(enc, wildcard) > 0:
+            return enc
+    return None
+
+
+class _Encoder:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._flush = self._c.flush
+            self._finish = self._c.finish
+            self._feed = self._c.process
+        else:
+            self._c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)   # 31: gzip container
+            self._flush = lambda: self._c.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = self._c.flush
+            self._feed = self._c.compress
+
+    def chunk(self, data: bytes, last: bool) -> bytes:
+        out = self._feed(data)
+        return out + (self._finish() if last else self._flush())
+
+
+class CompressionMiddleware:
+    def __init__(self, app, min_bytes: int = MIN_BYTES):
+        self.app = app
+        self.min_bytes = min_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.min_bytes <= 0:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start: dict | None = None
+        encoder: _Encoder | None = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if encoder is None:
+                resp_headers = {k.lower(): v for k, v in start["headers"]}
+                ctype = resp_headers.get(b"content-type", b"").decode("latin-1")
+                if (b"content-encoding" in resp_headers
+                        or not ctype.startswith(_COMPRESSIBLE)
+                        or ctype.startswith("text/event-stream")
+                        or (not more and len(body) < self.min_bytes)):
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+                encoder = _Encoder(encoding)
+                out_headers = [(k, v) for k, v in start["headers"] if k.lower() != b"content-length"]
+                out_headers += [(b"content-encoding", encoding.encode()), (b"vary", b"Accept-Encoding")]
+                data = encoder.chunk(body, not more)
+                if not more:
+                    out_headers.append((b"content-length", str(len(data)).encode()))
+                await send({**start, "headers": out_headers})
+                return await send({"type": "http.response.body", "body": data, "more_body": more})
+            await send({"type": "http.response.body", "body": encoder.chunk(body, not more), "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,337 @@
+"""
+datagen.py — Scale-test data generator
+
+Synthesizes realistic, conflict-free appointment books from the data_model
+catalogue, plus chat sessions and messages, and bulk-loads them: COPY on
+Postgres (asyncpg copy_records_to_table), large executemany transactions on
+SQLite.  Rows are generated and written in chunks, so memory stays flat for
+multi-million-row datasets.  With DB_SHARDS set, each appointment goes to
+its clinic's shard (see app.shards); chat data stays on the default one.
+
+Clinics and doctors scale by replicating the catalogue.  Replica 0 keeps the
+real ids (downtown, dr_chen, …) so the slot finder and chat see that data;
+replica k > 0 uses "downtown-k", "dr_chen-k" and only adds volume to listing,
+stats and analytics queries.  Each day, every rostered doctor's hours are
+walked in 15-minute steps and filled up to --fill with procedures they can
+perform, in a room with the right capabilities — rooms, doctors and the
+surgeon/anesthetist pair are tracked in per-day occupancy maps, so no two
+live bookings clash.  The same --seed always produces the same data.
+
+  python -m app.datagen --clinics 20 --patients 200000 --past-days 730 --future-days 90
+  python -m app.datagen --chat-sessions 100000 --truncate
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from contextlib import AsyncExitStack
+from datetime import date, datetime, timedelta
+from typing import Iterator
+
+from sqlalchemy import delete, insert, text
+
+from app.database import engine
+from app.models import Appointment, ChatSession, ChatMessage, FreeSlot, FreeSlotDay
+from app.shards import DEFAULT, SHARDS, all_engines, shard_for
+from app.data_model import CLINICS, DOCTORS, PROCEDURES
+from app.migrations import migrate
+
+CHUNK = 20_000
+STEP  = 15
+
+_FIRST = ["Olivia", "Liam", "Emma", "Noah", "Ava", "Mateo", "Sofia", "Lucas", "Amara", "Kenji",
+          "Priya", "Omar", "Zara", "Diego", "Mei", "Tomasz", "Ines", "Kwame", "Leila", "Ravi"]
+_LAST  = ["Smith", "Garcia", "Kim", "Okafor", "Novak", "Rossi", "Nguyen", "Patel", "Haddad",
+          "Silva", "Johnson", "Kowalski", "Tanaka", "Mensah", "Dubois", "Cohen", "Ali", "Berg"]
+_NOTES = [None, None, None, "Routine recall", "Sensitivity on cold", "Follow-up", "Referred by GP",
+          "Prefers mornings", "Anxious patient", "Broken filling"]
+_CHAT  = [
+    ("user", "Hi, I'd like to book a checkup"),
+    ("assistant", "Of course! Which clinic is most convenient for you, Downtown or Westside?"),
+    ("user", "Downtown, ideally in the morning"),
+    ("assistant", "I have openings at 9:00 and 10:30 on Tuesday. Would either work?"),
+    ("user", "I have a toothache on the lower left side"),
+    ("assistant", "I'm sorry to hear that. An emergency triage slot can be arranged today."),
+    ("user", "Can I reschedule my appointment?"),
+    ("assistant", "Sure — could you give me your name and the current appointment date?"),
+    ("user", "Yes, please confirm"),
+    ("assistant", "Great, you're booked. You'll receive a confirmation shortly."),
+]
+
+
+# ── Catalogue replication ─────────────────────────────────────
+
+def _suffix(base: str, replica: int) -> str:
+    return base if replica == 0 else f"{base}-{replica}"
+
+
+def build_catalogue(n_clinics: int, n_doctors: int | None) -> tuple[list[dict], list[dict]]:
+    """Clinics and doctors for the dataset, replicating the catalogue as needed."""
+    clinics, doctors = [], []
+    replica = 0
+    while len(clinics) < n_clinics:
+        members = set()
+        for c in CLINICS:
+            if len(clinics) == n_clinics:
+                break
+            clinics.append({**c, "id": _suffix(c["id"], replica)})
+            members.add(c["id"])
+        for d in DOCTORS:
+            avail = [{**a, "clinic_id": _suffix(a["clinic_id"], replica)}
+                     for a in d["availability"] if a["clinic_id"] in members]
+            if avail:
+                doctors.append({**d, "id": _suffix(d["id"], replica), "availability": avail})
+        replica += 1
+    if n_doctors is not None:
+        doctors = doctors[:n_doctors]
+    return clinics, doctors
+
+
+# ── Appointment books ─────────────────────────────────────────
+
+class BookGenerator:
+    def __init__(self, clinics: list[dict], doctors: list[dict], n_patients: int,
+                 fill: float, seed: int):
+        self.rng = random.Random(seed)
+        self.clinics = clinics
+        self.fill = fill
+        self.patients = [self._patient(i) for i in range(n_patients)]
+        self.today = date.today()
+        self.now = datetime.utcnow()
+        # (clinic_id, our_dow) → [(doctor, start_min, end_min)]
+        self.roster: dict[tuple[str, int], list[tuple[dict, int, int]]] = {}
+        for d in doctors:
+            for a in d["availability"]:
+                for dow in a["days"]:
+                    self.roster.setdefault((a["clinic_id"], dow), []).append(
+                        (d, a["start_hour"] * 60, a["end_hour"] * 60))
+
+    def _patient(self, i: int) -> tuple[str, str, str]:
+        first, last = self.rng.choice(_FIRST), self.rng.choice(_LAST)
+        return (f"{first} {last}", f"+1-555-{i % 10_000_000:07d}",
+                f"{first.lower()}.{last.lower()}{i}@example.com")
+
+    def _status(self, day: date) -> str:
+        r = self.rng.random()
+        if r < 0.07:
+            return "cancelled"
+        if day < self.today:
+            return "completed" if r < 0.95 else "confirmed"
+        return "confirmed"
+
+    def day(self, clinic: dict, day: date) -> Iterator[dict]:
+        """Conflict-free bookings for one clinic-day."""
+        our_dow = (day.weekday() + 1) % 7
+        rostered = self.roster.get((clinic["id"], our_dow), [])
+        if not rostered:
+            return
+        room_busy = {r["id"]: set() for r in clinic["rooms"]}
+        doc_busy: dict[str, set[int]] = {d["id"]: set() for d, _, _ in rostered}
+        hours = {d["id"]: (lo, hi) for d, lo, hi in rostered}
+        anesthetists = [d for d, _, _ in rostered if "anesthesiology" in d["specializations"]]
+        ds = str(day)
+
+        def free(busy: set, start: int, dur: int) -> bool:
+            return all(m not in busy for m in range(start, start + dur, STEP))
+
+        for doc, lo, hi in rostered:
+            if "anesthesiology" in doc["specializations"]:
+                continue
+            procs = [p for p in PROCEDURES if p["required_specs"][0] in doc["specializations"]]
+            t = lo
+            while t < hi:
+                if t in doc_busy[doc["id"]] or self.rng.random() > self.fill:
+                    t += STEP
+                    continue
+                proc = self.rng.choice(procs)
+                dur = proc["duration"]
+                team = [doc]
+                if proc["requires_anesthetist"]:
+                    anes = next((a for a in anesthetists
+                                 if hours[a["id"]][0] <= t and t + dur <= hours[a["id"]][1]
+                                 and free(doc_busy[a["id"]], t, dur)), None)
+                    if anes is None:
+                        t += STEP
+                        continue
+                    team.append(anes)
+                room = next((r for r in clinic["rooms"]
+                             if all(c in r["capabilities"] for c in proc["required_capabilities"])
+                             and free(room_busy[r["id"]], t, dur)), None)
+                if room is None or t + dur > hi or not free(doc_busy[doc["id"]], t, dur):
+                    t += STEP
+                    continue
+                for m in range(t, t + dur, STEP):
+                    room_busy[room["id"]].add(m)
+                    for member in team:
+                        doc_busy[member["id"]].add(m)
+                name, phone, email = self.rng.choice(self.patients)
+                created = datetime.combine(day, datetime.min.time()) - timedelta(
+                    days=self.rng.randint(1, 60), minutes=self.rng.randint(0, 1439))
+                created = min(created, self.now)     # future visits were booked no later than today
+                yield {
+                    "id": str(uuid.UUID(int=self.rng.getrandbits(128), version=4)),
+                    "procedure_id": proc["id"],
+                    "patient_name": name,
+                    "patient_phone": phone,
+                    "patient_email": email,
+                    "clinic_id": clinic["id"],
+                    "room_id": room["id"],
+                    "date": ds,
+                    "start_time": f"{t // 60:02d}:{t % 60:02d}",
+                    "duration_mins": dur,
+                    "doctor_ids": json.dumps([m["id"] for m in team]),
+                    "primary_doctor_id": doc["id"],
+                    "notes": self.rng.choice(_NOTES),
+                    "status": self._status(day),
+                    "created_at": created,
+                    "updated_at": created,
+                }
+                t += dur
+
+    def rows(self, first: date, n_days: int) -> Iterator[dict]:
+        for i in range(n_days):
+            day = first + timedelta(days=i)
+            for clinic in self.clinics:
+                yield from self.day(clinic, day)
+
+
+# ── Chat history ──────────────────────────────────────────────
+
+def chat_rows(n_sessions: int, first: date, now: datetime, seed: int) -> Iterator[tuple[dict, list[dict]]]:
+    """Chat sessions spread over [first, now); a session that would run past now is moved back."""
+    rng = random.Random(seed + 1)
+    origin = datetime.combine(first, datetime.min.time())
+    span = max(1, int((now - origin).total_seconds()))
+    for _ in range(n_sessions):
+        sid = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        started = origin + timedelta(seconds=rng.randrange(span))
+        turns = rng.randint(1, 6)
+        messages, t = [], started
+        for k in range(turns):
+            pair = rng.randrange(0, len(_CHAT), 2)
+            for role, content in _CHAT[pair: pair + 2]:
+                t += timedelta(seconds=rng.randint(3, 90))
+                messages.append({"session_id": sid, "role": role, "content": content, "created_at": t})
+        if t > now:
+            shift = t - now
+            started, t = started - shift, now
+            for m in messages:
+                m["created_at"] -= shift
+        session = {"id": sid, "patient_name": f"{rng.choice(_FIRST)} {rng.choice(_LAST)}",
+                   "started_at": started, "ended_at": t, "meta_json": None}
+        yield session, messages
+
+
+# ── Bulk loading ──────────────────────────────────────────────
+
+def _chunks(rows: Iterator, size: int = CHUNK) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Loader:
+    """COPY into Postgres, executemany into SQLite; one connection for the whole load."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pg = conn.dialect.name == "postgresql"
+
+    async def write(self, table, rows: list[dict]) -> None:
+        if not rows:
+            return
+        if self.pg:
+            raw = (await self.conn.get_raw_connection()).driver_connection
+            columns = list(rows[0])
+            await raw.copy_records_to_table(
+                table.name, records=[tuple(r[c] for c in columns) for r in rows], columns=columns)
+        else:
+            await self.conn.execute(insert(table), rows)
+
+
+async def generate(args) -> None:
+    await migrate()
+    first = date.today() - timedelta(days=args.past_days)
+    n_days = args.past_days + args.future_days
+    clinics, doctors = build_catalogue(args.clinics, args.doctors)
+    gen = BookGenerator(clinics, doctors, args.patients, args.fill, args.seed)
+    print(f"{len(clinics)} clinics, {len(doctors)} doctors, {args.patients} patients, "
+          f"{n_days} days from {first}")
+
+    t0 = time.perf_counter()
+    async with AsyncExitStack() as stack:
+        loaders: dict[str, Loader] = {}
+        for shard in SHARDS.values():
+            conn = await stack.enter_async_context(shard.engine.begin())
+            if conn.dialect.name == "sqlite":
+                await conn.execute(text("PRAGMA synchronous=OFF"))
+            if args.truncate:
+                tables = (ChatMessage.__table__, ChatSession.__table__) if shard.name == DEFAULT else ()
+                for table in (*tables, Appointment.__table__):
+                    await conn.execute(delete(table))
+            # Materialized free slots no longer match; searches rebuild them on demand
+            await conn.execute(delete(FreeSlotDay.__table__))
+            await conn.execute(delete(FreeSlot.__table__))
+            loaders[shard.name] = Loader(conn)
+        loader = loaders[DEFAULT]
+
+        n_appts = 0
+        for chunk in _chunks(gen.rows(first, n_days)):
+            by_shard: dict[str, list[dict]] = {}
+            for row in chunk:
+                by_shard.setdefault(shard_for(row["clinic_id"]).name, []).append(row)
+            for name, rows in by_shard.items():
+                await loaders[name].write(Appointment.__table__, rows)
+            n_appts += len(chunk)
+            print(f"\r  appointments: {n_appts:,}", end="", flush=True)
+        print()
+
+        n_sessions = n_messages = 0
+        for chunk in _chunks(chat_rows(args.chat_sessions, first, gen.now, args.seed), CHUNK // 8):
+            await loader.write(ChatSession.__table__, [s for s, _ in chunk])
+            msgs = [m for _, ms in chunk for m in ms]
+            await loader.write(ChatMessage.__table__, msgs)
+            n_sessions += len(chunk)
+            n_messages += len(msgs)
+            print(f"\r  chat sessions: {n_sessions:,}  messages: {n_messages:,}", end="", flush=True)
+        if args.chat_sessions:
+            print()
+
+    for eng in all_engines():
+        if eng.dialect.name == "postgresql":
+            async with eng.connect() as conn:
+                await conn.execute(text("ANALYZE appointments"))
+                if eng is engine:
+                    await conn.execute(text("ANALYZE chat_sessions"))
+                    await conn.execute(text("ANALYZE chat_messages"))
+    elapsed = time.perf_counter() - t0
+    total = n_appts + n_sessions + n_messages
+    print(f"loaded {total:,} rows in {elapsed:.1f} s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+    for eng in all_engines():
+        await eng.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a scale-test dataset")
+    parser.add_argument("--clinics", type=int, default=len(CLINICS), help="clinics (catalogue is replicated)")
+    parser.add_argument("--doctors", type=int, default=None, help="cap on doctors (default: full roster per replica)")
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--past-days", type=int, default=365)
+    parser.add_argument("--future-days", type=int, default=90)
+    parser.add_argument("--fill", type=float, default=0.75, help="chance a free 15-min step gets a booking")
+    parser.add_argument("--chat-sessions", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="delete existing appointments and chats first")
+    asyncio.run(generate(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+export.py — Columnar export of appointment history for analytics
+
+Streams appointments into Parquet (or Arrow IPC) files so reporting reads
+files instead of the production database:
+
+  EXPORT_DIR/appointments/month=YYYY-MM/clinic_id=<id>/part-<run>.parquet
+
+The layout is Hive-style, so pyarrow.dataset, DuckDB, Spark or BigQuery
+external tables pick up month and clinic_id as partition columns.  Keep
+one format per EXPORT_DIR.
+
+Each run is incremental: every shard is read with a server-side cursor in
+(updated_at, id) order from the watermark the previous run left in
+EXPORT_DIR/appointments/_watermark.json, EXPORT_CHUNK_ROWS at a time.  A
+chunk spreads over many partitions, so each chunk is converted to Arrow
+per partition right away and buffered there until EXPORT_ROW_GROUP_ROWS
+have gathered for one row group; when EXPORT_BUFFER_ROWS are buffered in
+total the largest partition is written early.  At most EXPORT_MAX_OPEN_FILES
+writers stay open: the least recently used one is finished and its
+partition continues in a new part file.  A row changed after it was
+exported appears again in a later part; readers take the latest updated_at
+per id.
+
+Like the change feed, a run stops CHANGES_SETTLE_MS behind now and the next
+run re-reads the last CHANGES_OVERLAP_MS before that horizon, so writes that
+commit late are still exported; the watermark lists the (id, updated_at)
+pairs already exported inside that overlap so they are not written twice.
+Files are written under a hidden "_" name and renamed, and the watermark
+moves only after every file of the run is in place.
+
+Encoding and file writes run in a worker thread.  POST /api/analytics/export
+only queues an "export.appointments" job (see app.jobs) on the default shard
+and returns 202; the job runs the export.
+
+pyarrow is imported on first use; without it the export is unavailable.
+
+Environment variables:
+  EXPORT_DIR            : output root                            (default: ./exports)
+  EXPORT_CHUNK_ROWS     : rows fetched per cursor chunk          (default: 10000)
+  EXPORT_ROW_GROUP_ROWS : rows per Parquet row group / IPC batch (default: 100000)
+  EXPORT_BUFFER_ROWS    : Arrow rows buffered across partitions  (default: 200000)
+  EXPORT_MAX_OPEN_FILES : part files open at once                (default: 32)
+
+  python -m app.export                   # incremental Parquet export
+  python -m app.export --format arrow    # Arrow IPC files instead
+  python -m app.export --full            # ignore the watermark
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import select
+
+from app.jobs import register
+from app.models import Appointment
+from app.shards import SHARDS, Shard, owns
+
+EXPORT_DIR     = Path(os.getenv("EXPORT_DIR", "./exports"))
+CHUNK_ROWS     = int(os.getenv("EXPORT_CHUNK_ROWS", "10000"))
+ROW_GROUP_ROWS = int(os.getenv("EXPORT_ROW_GROUP_ROWS", "100000"))
+BUFFER_ROWS    = int(os.getenv("EXPORT_BUFFER_ROWS", "200000"))
+MAX_OPEN_FILES = int(os.getenv("EXPORT_MAX_OPEN_FILES", "32"))
+SETTLE         = timedelta(milliseconds=int(os.getenv("CHANGES_SETTLE_MS", "2000")))
+OVERLAP        = timedelta(milliseconds=int(os.getenv("CHANGES_OVERLAP_MS", "30000")))
+
+log = logging.getLogger(__name__)
+
+_COLUMNS = [c.name for c in Appointment.__table__.columns]
+_lock = asyncio.Lock()
+
+
+class ExportUnavailable(RuntimeError):
+    pass
+
+
+def load_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportUnavailable("pyarrow is not installed") from None
+    return pa, pq
+
+
+def _schema(pa):
+    fields = []
+    for col in Appointment.__table__.columns:
+        if col.name == "doctor_ids":
+            fields.append(pa.field(col.name, pa.list_(pa.string())))
+        elif col.name in ("created_at", "updated_at"):
+            fields.append(pa.field(col.name, pa.timestamp("us")))
+        elif col.name == "duration_mins":
+            fields.append(pa.field(col.name, pa.int32()))
+        else:
+            fields.append(pa.field(col.name, pa.string()))
+    return pa.schema(fields)
+
+
+# ── Watermark ─────────────────────────────────────────────────
+
+def _watermark_path(root: Path) -> Path:
+    return root / "appointments" / "_watermark.json"
+
+
+def load_watermarks(root: Path = EXPORT_DIR) -> dict[str, dict]:
+    """{shard: {"horizon": iso, "recent": [[id, updated_at iso], ...]}} from the last successful run."""
+    try:
+        return json.loads(_watermark_path(root).read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def horizons(marks: dict[str, dict]) -> dict[str, str]:
+    """{shard: iso} — where each shard's next run resumes, minus the overlap."""
+    # marks written before the overlap re-read kept the last exported row instead
+    return {shard: m.get("horizon") or m["updated_at"] for shard, m in marks.items()}
+
+
+def _save_watermarks(root: Path, marks: dict[str, dict]) -> None:
+    path = _watermark_path(root)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(marks, indent=2))
+    tmp.replace(path)
+
+
+# ── Writers ───────────────────────────────────────────────────
+
+class _Partitions:
+    """Arrow buffers and a bounded set of open part-file writers per (month, clinic) partition."""
+
+    def __init__(self, root: Path, fmt: str, run_id: str, pa, pq, row_group: int = ROW_GROUP_ROWS,
+                 max_buffered: int = BUFFER_ROWS, max_open: int = MAX_OPEN_FILES):
+        self.root, self.fmt, self.run_id = root, fmt, run_id
+        self.pa, self.pq = pa, pq
+        self.row_group, self.max_buffered, self.max_open = row_group, max_buffered, max(1, max_open)
+        self.schema = _schema(pa)
+        self.writers: OrderedDict[tuple[str, str], tuple[Path, object]] = OrderedDict()   # LRU first
+        self.finished: list[Path] = []
+        self.parts: dict[tuple[str, str], int] = {}
+        self.buffers: dict[tuple[str, str], list] = {}    # key → [pa.Table, ...]
+        self.sizes: dict[tuple[str, str], int] = {}
+        self.buffered = 0
+
+    def _writer(self, key: tuple[str, str]):
+        if key in self.writers:
+            self.writers.move_to_end(key)
+            return self.writers[key][1]
+        if len(self.writers) >= self.max_open:
+            _, (path, writer) = self.writers.popitem(last=False)
+            writer.close()
+            self.finished.append(path)
+        month, clinic_id = key
+        folder = self.root / "appointments" / f"month={month}" / f"clinic_id={clinic_id}"
+        folder.mkdir(parents=True, exist_ok=True)
+        seq = self.parts[key] = self.parts.get(key, -1) + 1
+        # "_" hides it from dataset readers until the run commits
+        path = folder / f"_part-{self.run_id}-{seq}.{self.fmt}"
+        if self.fmt == "parquet":
+            writer = self.pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            writer = self.pa.ipc.new_file(str(path), self.schema)
+        self.writers[key] = (path, writer)
+        return writer
+
+    def _flush(self, key: tuple[str, str]) -> None:
+        tables = self.buffers.pop(key, [])
+        if not tables:
+            return
+        self.buffered -= self.sizes.pop(key)
+        table = self.pa.concat_tables(tables)
+        writer = self._writer(key)
+        if self.fmt == "parquet":
+            writer.write_table(table, row_group_size=self.row_group)
+        else:
+            writer.write_table(table)
+
+    def write(self, rows: list) -> None:
+        """Convert `rows` to Arrow per partition; write full row groups, or the largest buffer when over budget."""
+        groups: dict[tuple[str, str], list] = {}
+        for r in rows:
+            groups.setdefault((r.date[:7], r.clinic_id), []).append(r)
+        for key, part in groups.items():
+            data = {name: [getattr(r, name) for r in part] for name in _COLUMNS}
+            data["doctor_ids"] = [json.loads(d or "[]") for d in data["doctor_ids"]]
+            self.buffers.setdefault(key, []).append(self.pa.Table.from_pydict(data, schema=self.schema))
+            self.sizes[key] = self.sizes.get(key, 0) + len(part)
+            self.buffered += len(part)
+            if self.sizes[key] >= self.row_group:
+                self._flush(key)
+        while self.buffered > self.max_buffered:
+            self._flush(max(self.sizes, key=self.sizes.get))
+
+    def close(self, commit: bool) -> list[Path]:
+        if commit:
+            for key in list(self.buffers):
+                self._flush(key)
+        for path, writer in self.writers.values():
+            writer.close()
+            self.finished.append(path)
+        self.writers.clear()
+        done = []
+        for tmp in self.finished:
+            if commit:
+                final = tmp.with_name(tmp.name[1:])
+                tmp.replace(final)
+                done.append(final)
+            else:
+                tmp.unlink(missing_ok=True)
+        return done
+
+
+# ── Export ────────────────────────────────────────────────────
+
+async def _export_shard(shard: Shard, parts: _Partitions, mark: Optional[dict], horizon: datetime) -> tuple[int, dict]:
+    query = select(*Appointment.__table__.columns).where(Appointment.updated_at < horizon)
+    seen: set[tuple[str, str]] = set()
+    if mark:
+        # Re-read the previous run's overlap for writes that committed after it
+        since = datetime.fromisoformat(horizons({"": mark})[""]) - OVERLAP
+        query = query.where(Appointment.updated_at >= since)
+        seen = {tuple(p) for p in mark.get("recent", [])}
+    query = query.order_by(Appointment.updated_at, Appointment.id).execution_options(yield_per=CHUNK_ROWS)
+
+    n, recent, overlap_from = 0, [], horizon - OVERLAP
+    async with shard.session() as db:
+        result = await db.stream(query)
+        async for chunk in result.partitions(CHUNK_ROWS):
+            rows = []
+            for r in chunk:
+                stamp = r.updated_at.isoformat()
+                if r.updated_at >= overlap_from:
+                    recent.append([r.id, stamp])
+                if owns(shard, r.clinic_id) and (r.id, stamp) not in seen:
+                    rows.append(r)
+            await asyncio.to_thread(parts.write, rows)
+            n += len(rows)
+    return n, {"horizon": horizon.isoformat(), "recent": recent}
+
+
+async def export(root: Path = EXPORT_DIR, fmt: str = "parquet", full: bool = False) -> dict:
+    """Incremental export of every shard; returns rows, files and the new watermarks."""
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError(f"unknown export format: {fmt}")
+    pa, pq = load_pyarrow()
+    async with _lock:
+        t0 = time.perf_counter()
+        root.mkdir(parents=True, exist_ok=True)
+        (root / "appointments").mkdir(exist_ok=True)
+        marks = {} if full else load_watermarks(root)
+        horizon = datetime.utcnow() - SETTLE
+        parts = _Partitions(root, fmt, horizon.strftime("%Y%m%dT%H%M%S%f"), pa, pq)
+        rows, new_marks = 0, dict(marks)
+        try:
+            for shard in SHARDS.values():
+                n, new_marks[shard.name] = await _export_shard(shard, parts, marks.get(shard.name), horizon)
+                rows += n
+        except BaseException:
+            await asyncio.to_thread(parts.close, False)
+            raise
+        files = await asyncio.to_thread(parts.close, True)
+        _save_watermarks(root, new_marks)
+        return {
+            "rows": rows,
+            "files": [str(p.relative_to(root)) for p in files],
+            "watermarks": horizons(new_marks),
+            "seconds": round(time.perf_counter() - t0, 3),
+        }
+
+
+async def _export_job(payload: dict) -> None:
+    summary = await export(fmt=payload.get("format", "parquet"))
+    log.info("exported %d rows into %d files in %s s",
+             summary["rows"], len(summary["files"]), summary["seconds"])
+
+
+register("export.appointments", _export_job)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export appointments to Parquet / Arrow files")
+    parser.add_argument("--dir", type=Path, default=EXPORT_DIR)
+    parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+    parser.add_argument("--full", action="store_true", help="ignore the watermark and export everything")
+    args = parser.parse_args()
+
+    async def _main():
+        from app.shards import all_engines
+        try:
+            summary = await export(args.dir, args.format, args.full)
+            print(f"exported {summary['rows']:,} rows into {len(summary['files'])} files "
+                  f"in {summary['seconds']} s")
+        finally:
+            for e in all_engines():
+                await e.dispose()
+
+    asyncio.run(_main())
@@ -0,0 +1,261 @@
+"""
+free_slots.py — Materialized free-slot table
+
+free_slots holds every bookable start per (procedure, clinic, room, doctor
+set, date), so "what is free?" is an indexed SELECT shared by every
+instance and by ad-hoc SQL rather than a recomputation inside each API
+process.  free_slot_days records which clinic-days are materialized (a
+fully booked day has a marker but no rows).  Both tables live on the
+clinic's shard next to its appointments.
+
+A clinic-day is recomputed as a unit — delete, reload its bookings,
+insert — under the same advisory lock bookings take:
+  - by every appointment write, inside its own transaction (refresh_in via
+    booking.stage_refresh), so a search never offers a start that was
+    just booked;
+  - on demand, when a search reaches a day that is not materialized yet;
+  - by the horizon job, which drops past days and re-sweeps any day in
+    the next FREE_SLOTS_HORIZON_DAYS not refreshed within the interval.
+
+Environment variables:
+  FREE_SLOTS_HORIZON_DAYS : days ahead kept materialized  (default: 60)
+  FREE_SLOTS_INTERVAL_S   : horizon job period            (default: 3600)
+
+  python -m app.free_slots            # sweep the horizon once
+  python -m app.free_slots --rebuild  # recompute every day in the horizon
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import select, insert, delete, func, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import FreeSlot, FreeSlotDay
+from app.data_model import CLINICS, DOCTORS, PROCEDURES, find_room_for_procedure
+from app.booking import _free_starts, load_booked, lock_days
+from app.invalidation import Key
+from app.routers.slots import _has_conflict, mins_to_time
+from app.shards import SHARDS, owns, scatter, shard_for, shards_for
+
+log = logging.getLogger(__name__)
+
+HORIZON_DAYS = int(os.getenv("FREE_SLOTS_HORIZON_DAYS", "60"))
+INTERVAL_S   = float(os.getenv("FREE_SLOTS_INTERVAL_S", "3600"))
+_BATCH_DAYS  = 64
+
+
+def teams_for(proc: dict) -> list[list[str]]:
+    """Doctor sets that may perform `proc`, in DOCTORS order; IV sedation needs surgeon + anesthetist."""
+    if proc.get("requires_anesthetist"):
+        surgeons     = [d["id"] for d in DOCTORS if "oral_surgery"   in d["specializations"]]
+        anesthetists = [d["id"] for d in DOCTORS if "anesthesiology" in d["specializations"]]
+        return [[s, a] for s in surgeons for a in anesthetists]
+    return [[d["id"]] for d in DOCTORS if proc["required_specs"][0] in d["specializations"]]
+
+
+def day_slots(clinic_id: str, day: str, day_booked: list[dict]) -> list[dict]:
+    """Every bookable start on one clinic-day, as free_slots rows."""
+    rows = []
+    for proc in PROCEDURES:
+        room = find_room_for_procedure(clinic_id, proc["id"])
+        if not room:
+            continue
+        dur = proc["duration"]
+        for team in teams_for(proc):
+            doctor_ids = json.dumps(team)
+            for start in _free_starts(clinic_id, day, team, dur):
+                if _has_conflict(start, dur, clinic_id, room["id"], team, day_booked):
+                    continue
+                rows.append(dict(
+                    procedure_id=proc["id"], date=day, clinic_id=clinic_id,
+                    start_time=mins_to_time(start), doctor_ids=doctor_ids,
+                    room_id=room["id"], duration_mins=dur, primary_doctor_id=team[0],
+                ))
+    return rows
+
+
+def _day_filter(model, keys: list[Key]):
+    by_clinic: dict[str, list[str]] = {}
+    for c, d in keys:
+        by_clinic.setdefault(c, []).append(d)
+    return or_(*(and_(model.clinic_id == c, model.date.in_(ds)) for c, ds in by_clinic.items()))
+
+
+async def refresh_in(db: AsyncSession, keys: list[Key]) -> int:
+    """Recompute these clinic-days in db's transaction; the caller commits.  Past days are skipped."""
+    today = str(date.today())
+    keys = [k for k in keys if k[1] >= today]
+    if not keys:
+        return 0
+    await lock_days(db, keys)
+    booked = await load_booked(db, keys)
+    rows = [r for key in keys for r in day_slots(*key, booked[key])]
+    await db.execute(delete(FreeSlot).where(_day_filter(FreeSlot, keys)))
+    await db.execute(delete(FreeSlotDay).where(_day_filter(FreeSlotDay, keys)))
+    if rows:
+        await db.execute(insert(FreeSlot), rows)
+    now = datetime.utcnow()
+    await db.execute(insert(FreeSlotDay), [{"clinic_id": c, "date": d, "refreshed_at": now} for c, d in keys])
+    return len(rows)
+
+
+async def refresh(keys: Iterable[Key]) -> int:
+    """Recompute free_slots for these (clinic_id, date) keys; past days are skipped."""
+    today = str(date.today())
+    by_shard: dict[str, list[Key]] = {}
+    for key in sorted(set(keys)):
+        if key[1] >= today:
+            by_shard.setdefault(shard_for(key[0]).name, []).append(key)
+    total = 0
+    for name, shard_keys in by_shard.items():
+        for i in range(0, len(shard_keys), _BATCH_DAYS):
+            async with SHARDS[name].session() as db:
+                total += await refresh_in(db, shard_keys[i:i + _BATCH_DAYS])
+                await db.commit()
+    return total
+
+
+async def stale(keys: list[Key], older_than: Optional[datetime] = None) -> list[Key]:
+    """Keys with no marker (or one refreshed before `older_than`) on their own shard."""
+    if not keys:
+        return []
+    clinic_ids = sorted({c for c, _ in keys})
+
+    async def markers(db: AsyncSession) -> list:
+        query = select(FreeSlotDay.clinic_id, FreeSlotDay.date).where(_day_filter(FreeSlotDay, keys))
+        if older_than is not None:
+            query = query.where(FreeSlotDay.refreshed_at >= older_than)
+        return list((await db.execute(query)).all())
+
+    fresh = {
+        (c, d) for shard, part in zip(shards_for(clinic_ids), await scatter(markers, clinic_ids))
+        for c, d in part if owns(shard, c)
+    }
+    return [k for k in keys if k not in fresh]
+
+
+async def ensure(keys: list[Key]) -> None:
+    """Materialize any of these clinic-days that are missing (first search of a new day)."""
+    missing = await stale(keys)
+    if missing:
+        await refresh(missing)
+
+
+async def _gather(query, clinic_ids: list[str]) -> list[dict]:
+    async def fetch(db: AsyncSession) -> list[dict]:
+        return [dict(r) for r in (await db.execute(query)).mappings()]
+
+    return [
+        r for shard, part in zip(shards_for(clinic_ids), await scatter(fetch, clinic_ids))
+        for r in part if owns(shard, r["clinic_id"])
+    ]
+
+
+def _in_range(procedure_id: str, clinic_ids: list[str], first: date, days: int) -> list:
+    return [
+        FreeSlot.procedure_id == procedure_id,
+        FreeSlot.date >= str(first),
+        FreeSlot.date <= str(first + timedelta(days=days - 1)),
+        FreeSlot.clinic_id.in_(clinic_ids),
+    ]
+
+
+async def first_free(procedure_id: str, clinic_ids: list[str], first: date, days: int) -> list[dict]:
+    """Earliest free start per (date, clinic, doctor set), via the free_slots primary key."""
+    await ensure([(c, str(first + timedelta(days=i))) for i in range(days) for c in clinic_ids])
+    query = (
+        select(
+            FreeSlot.date, FreeSlot.clinic_id, FreeSlot.room_id, FreeSlot.doctor_ids,
+            FreeSlot.primary_doctor_id, FreeSlot.duration_mins,
+            func.min(FreeSlot.start_time).label("start_time"),
+        )
+        .where(*_in_range(procedure_id, clinic_ids, first, days))
+        .group_by(FreeSlot.date, FreeSlot.clinic_id, FreeSlot.room_id, FreeSlot.doctor_ids,
+                  FreeSlot.primary_doctor_id, FreeSlot.duration_mins)
+    )
+    return await _gather(query, clinic_ids)
+
+
+async def free_starts(procedure_id: str, clinic_ids: list[str], first: date, days: int) -> list[dict]:
+    """Every free start for `procedure_id` in the date range."""
+    await ensure([(c, str(first + timedelta(days=i))) for i in range(days) for c in clinic_ids])
+    query = select(*FreeSlot.__table__.columns).where(*_in_range(procedure_id, clinic_ids, first, days))
+    return await _gather(query, clinic_ids)
+
+
+# ── Keeping the table current ─────────────────────────────────
+
+def _horizon(days: int) -> list[Key]:
+    today = date.today()
+    return [(c["id"], str(today + timedelta(days=i))) for i in range(days) for c in CLINICS]
+
+
+async def sweep(days: int = HORIZON_DAYS, max_age_s: Optional[float] = INTERVAL_S) -> int:
+    """Drop past days, then refresh horizon days that are missing or older than max_age_s."""
+    today = str(date.today())
+    for shard in SHARDS.values():
+        async with shard.session() as db:
+            await db.execute(delete(FreeSlot).where(FreeSlot.date < today))
+            await db.execute(delete(FreeSlotDay).where(FreeSlotDay.date < today))
+            await db.commit()
+    keys = _horizon(days)
+    if max_age_s is not None:
+        keys = await stale(keys, datetime.utcnow() - timedelta(seconds=max_age_s))
+    await refresh(keys)
+    return len(keys)
+
+
+class HorizonJob:
+    """Runs sweep() every INTERVAL_S seconds while the app is up."""
+
+    def __init__(self, interval_s: float):
+        self.interval = interval_s
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                n = await sweep()
+                if n:
+                    log.info("materialized free slots for %d clinic-days", n)
+            except Exception:
+                log.exception("free-slot horizon sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+horizon_job = HorizonJob(INTERVAL_S)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialize free slots for the booking horizon")
+    parser.add_argument("--days", type=int, default=HORIZON_DAYS)
+    parser.add_argument("--rebuild", action="store_true", help="recompute every day, not just stale ones")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        from app.shards import all_engines
+        print(f"refreshed {await sweep(args.days, None if args.rebuild else INTERVAL_S)} clinic-days")
+        for e in all_engines():
+            await e.dispose()
+
+    asyncio.run(_main())
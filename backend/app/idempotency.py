@@ -0,0 +1,252 @@
+"""
+idempotency.py — Idempotency-Key support for booking writes
+
+POST /api/appointments and POST /api/chat/confirm accept an
+Idempotency-Key header.  The first request with a key runs normally and
+its response is stored.  A retry with the same key and body gets that
+response back, marked Idempotent-Replayed: true, without booking again.
+
+  - completed responses : in-process TTLCache, backed by the
+                          idempotency_keys table on the default shard so
+                          every worker and instance sees them
+  - in progress         : a retry in the same worker waits for the original;
+                          one reaching another worker gets 409 + Retry-After
+  - same key, new body  : 422
+  - failed requests     : the key is released, so the client may retry
+
+The worker running a request renews its claim every IDEMPOTENCY_LEASE_S / 3,
+so a slow request is never taken over; a claim left by a worker that died
+mid-request is taken over once it is IDEMPOTENCY_LEASE_S stale.  Once the
+request has succeeded the claim is not released until its response is
+stored: a failed store is retried in the background, still renewing the
+claim, so other workers keep answering 409 instead of running it again.
+Rows older than IDEMPOTENCY_TTL_S are purged hourly.
+
+Environment variables:
+  IDEMPOTENCY_TTL_S     : how long a key is remembered    (default: 86400)
+  IDEMPOTENCY_CACHE_MAX : completed keys kept in memory   (default: 10000)
+  IDEMPOTENCY_LEASE_S   : take over claims not renewed for (default: 60)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from app.cache import TTLCache
+from app.database import AsyncSessionLocal
+from app.metrics import registry
+from app.models import IdempotencyKey
+
+log = logging.getLogger(__name__)
+
+TTL_S   = float(os.getenv("IDEMPOTENCY_TTL_S", "86400"))
+LEASE_S = float(os.getenv("IDEMPOTENCY_LEASE_S", "60"))
+_PURGE_EVERY_S = 3600
+
+_completed = TTLCache(maxsize=int(os.getenv("IDEMPOTENCY_CACHE_MAX", "10000")), ttl=TTL_S)
+_inflight: dict[tuple[str, str], asyncio.Future] = {}
+_storing: set[asyncio.Task] = set()       # responses whose first store failed
+
+REPLAYS = registry.counter("idempotent_replays_total", "Requests answered from a stored response", ("route",))
+
+
+def _replay(route: str, stored: tuple[str, int, str]) -> JSONResponse:
+    REPLAYS.labels(route).value += 1
+    _, status_code, body = stored
+    return JSONResponse(json.loads(body), status_code=status_code, headers={"Idempotent-Replayed": "true"})
+
+
+def _check(stored_hash: str, request_hash: str) -> None:
+    if stored_hash != request_hash:
+        raise HTTPException(422, "Idempotency-Key was already used with a different request body")
+
+
+async def _claim(route: str, key: str, request_hash: str) -> Optional[tuple[str, int, str]]:
+    """Insert the in-progress row; returns the stored response instead if the key already completed."""
+    async with AsyncSessionLocal() as db:
+        db.add(IdempotencyKey(route=route, key=key, request_hash=request_hash))
+        try:
+            await db.commit()
+            return None
+        except IntegrityError:
+            await db.rollback()
+        row = await db.get(IdempotencyKey, (route, key))
+        if row is None:
+            return await _claim(route, key, request_hash)    # purged in between
+        _check(row.request_hash, request_hash)
+        if row.status_code is not None:
+            return row.request_hash, row.status_code, row.response
+        if row.created_at > datetime.utcnow() - timedelta(seconds=LEASE_S):
+            raise HTTPException(409, "A request with this Idempotency-Key is still in progress",
+                                headers={"Retry-After": "1"})
+        # Not renewed: its worker died mid-request, take it over
+        row.created_at = datetime.utcnow()
+        await db.commit()
+        return None
+
+
+async def _release(route: str, key: str) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(IdempotencyKey).where(IdempotencyKey.route == route, IdempotencyKey.key == key))
+        await db.commit()
+
+
+async def _store(route: str, key: str, stored: tuple[str, int, str]) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.route == route, IdempotencyKey.key == key)
+            .values(status_code=stored[1], response=stored[2])
+        )
+        await db.commit()
+
+
+async def _renew(route: str, key: str) -> None:
+    """Keep an unfinished claim's lease fresh until cancelled."""
+    while True:
+        await asyncio.sleep(LEASE_S / 3)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.route == route, IdempotencyKey.key == key,
+                           IdempotencyKey.status_code.is_(None))
+                    .values(created_at=datetime.utcnow())
+                )
+                await db.commit()
+        except Exception:
+            log.warning("failed to renew idempotency claim %s for %s", key, route, exc_info=True)
+
+
+async def _store_until_done(route: str, key: str, stored: tuple[str, int, str], lease: asyncio.Task) -> None:
+    """Retry a failed store; the request already succeeded, so the claim must never be run again."""
+    delay = 0.5
+    try:
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await _store(route, key, stored)
+                return
+            except Exception:
+                log.exception("failed to persist idempotency key %s for %s, retrying", key, route)
+            delay = min(delay * 2, LEASE_S / 3)
+    finally:
+        lease.cancel()
+
+
+async def flush(timeout: float = 10.0) -> None:
+    """Give responses still being stored a last chance before shutdown."""
+    if _storing:
+        await asyncio.wait(set(_storing), timeout=timeout)
+
+
+async def idempotent(route: str, key: Optional[str], body: BaseModel,
+                     run: Callable[[], Awaitable[Any]], status_code: int = 201) -> Any:
+    """
+    run() once per (route, Idempotency-Key).  Without a key it simply runs.
+    `status_code` is the route's success status, stored with the response.
+    """
+    if not key:
+        return await run()
+    request_hash = hashlib.sha256(body.model_dump_json().encode()).hexdigest()
+    scope = (route, key)
+
+    stored = _completed.get(scope)
+    if stored is not None:
+        _check(stored[0], request_hash)
+        return _replay(route, stored)
+    if scope in _inflight:
+        stored = await asyncio.shield(_inflight[scope])
+        _check(stored[0], request_hash)
+        return _replay(route, stored)
+
+    fut = _inflight[scope] = asyncio.get_running_loop().create_future()
+    try:
+        stored = await _claim(route, key, request_hash)
+        if stored is not None:
+            _completed.set(scope, stored)
+            fut.set_result(stored)
+            return _replay(route, stored)
+        lease = asyncio.create_task(_renew(route, key))
+        try:
+            result = await run()
+        except BaseException:
+            lease.cancel()
+            await _release(route, key)
+            raise
+        stored = (request_hash, status_code, json.dumps(jsonable_encoder(result)))
+        try:
+            await _store(route, key, stored)
+        except Exception:
+            # The booking is committed: keep renewing the claim until the response sticks
+            log.exception("failed to persist idempotency key %s for %s", key, route)
+            task = asyncio.create_task(_store_until_done(route, key, stored, lease))
+            _storing.add(task)
+            task.add_done_callback(_storing.discard)
+        else:
+            lease.cancel()
+        _completed.set(scope, stored)
+        fut.set_result(stored)
+        return result
+    except BaseException as e:
+        if not fut.done():
+            fut.set_exception(e)
+            fut.exception()          # waiters re-raise it; don't warn when there are none
+        raise
+    finally:
+        _inflight.pop(scope, None)
+
+
+# ── Expiry ────────────────────────────────────────────────────
+
+async def purge() -> int:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.created_at < datetime.utcnow() - timedelta(seconds=TTL_S))
+        )
+        await db.commit()
+        return result.rowcount or 0
+
+
+class PurgeJob:
+    """Deletes expired idempotency keys every hour while the app is up."""
+
+    def __init__(self, interval_s: float):
+        self.interval = interval_s
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await purge()
+            except Exception:
+                log.exception("idempotency key purge failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await flush()
+
+
+purge_job = PurgeJob(_PURGE_EVERY_S)
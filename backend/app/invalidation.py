@@ -0,0 +1,187 @@
+"""
+invalidation.py — Cross-worker cache invalidation bus
+
+Appointment writes publish the (clinic_id, date) keys they touched and every
+worker's subscribers evict exactly those keys.  Subscribers in the publishing
+worker run immediately; other workers hear about it through a transport:
+
+  Postgres (asyncpg) : NOTIFY on INVALIDATION_CHANNEL over one dedicated
+                       LISTEN connection per worker
+  SQLite             : in-process only, or — when INVALIDATION_FILE is set —
+                       an append-only file every worker on the host tails
+
+A subscriber called with `None` must drop everything (used when a transport
+may have lost messages, e.g. the shared file was truncated).
+
+Environment variables:
+  INVALIDATION_CHANNEL : Postgres NOTIFY channel            (default: meddent_invalidate)
+  INVALIDATION_FILE    : shared file for SQLite multi-worker (default: unset)
+  INVALIDATION_POLL_MS : file poll interval                  (default: 50)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, Iterable, Optional
+
+from app.database import engine
+
+log = logging.getLogger(__name__)
+
+CHANNEL      = os.getenv("INVALIDATION_CHANNEL", "meddent_invalidate")
+SHARED_FILE  = os.getenv("INVALIDATION_FILE", "")
+POLL_S       = int(os.getenv("INVALIDATION_POLL_MS", "50")) / 1000
+_MAX_PAYLOAD = 7000           # pg_notify payloads must stay under 8000 bytes
+_MAX_FILE    = 1 << 20        # truncate the shared file beyond 1 MiB
+
+Key = tuple[str, str]         # (clinic_id, YYYY-MM-DD)
+Subscriber = Callable[[Optional[list[Key]]], None]
+
+
+def keys_for(appts: Iterable) -> list[Key]:
+    """Distinct (clinic_id, date) keys for Appointment rows, AppointmentOut objects or dicts."""
+    keys = set()
+    for a in appts:
+        if isinstance(a, dict):
+            keys.add((a.get("clinic_id"), a.get("date")))
+        else:
+            keys.add((a.clinic_id, a.date))
+    return sorted(k for k in keys if k[0] and k[1])
+
+
+class InvalidationBus:
+    def __init__(self):
+        self.origin = uuid.uuid4().hex[:12]
+        self._subscribers: list[Subscriber] = []
+        self._remote_subscribers: list[Subscriber] = []
+        self._local_subscribers: list[Subscriber] = []
+        self._pg_conn = None
+        self._pg_lock = asyncio.Lock()
+        self._file_task: asyncio.Task | None = None
+        self._file_offset = 0
+
+    # ── Subscribers ──────────────────────────────────────────
+
+    def subscribe(self, fn: Subscriber, remote_only: bool = False, local_only: bool = False) -> None:
+        """
+        remote_only subscribers hear only about writes made by other workers;
+        local_only ones only about this worker's, so exactly one worker acts on each write.
+        """
+        if remote_only:
+            self._remote_subscribers.append(fn)
+        elif local_only:
+            self._local_subscribers.append(fn)
+        else:
+            self._subscribers.append(fn)
+
+    def _deliver(self, keys: Optional[list[Key]], remote: bool = False) -> None:
+        extra = self._remote_subscribers if remote else self._local_subscribers
+        for fn in self._subscribers + extra:
+            try:
+                fn(keys)
+            except Exception:
+                log.exception("invalidation subscriber %r failed", fn)
+
+    # ── Publishing ───────────────────────────────────────────
+
+    async def publish(self, keys: list[Key]) -> None:
+        """Evict locally, then broadcast to the other workers.  Call after commit."""
+        if not keys:
+            return
+        self._deliver(keys)
+        try:
+            if self._pg_conn is not None:
+                async with self._pg_lock:
+                    for payload in self._payloads(keys):
+                        await self._pg_conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+            elif SHARED_FILE:
+                self._append_file(keys)
+        except Exception:
+            log.exception("failed to broadcast invalidation for %d keys", len(keys))
+
+    def _payloads(self, keys: list[Key]) -> Iterable[str]:
+        chunk: list[Key] = []
+        for key in keys:
+            chunk.append(key)
+            if len(json.dumps(chunk)) > _MAX_PAYLOAD:
+                chunk.pop()
+                yield json.dumps({"o": self.origin, "k": chunk})
+                chunk = [key]
+        if chunk:
+            yield json.dumps({"o": self.origin, "k": chunk})
+
+    def _receive(self, payload: str) -> None:
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            return
+        if msg.get("o") != self.origin:
+            self._deliver([tuple(k) for k in msg.get("k", [])], remote=True)
+
+    # ── Postgres LISTEN / NOTIFY ─────────────────────────────
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        self._receive(payload)
+
+    async def _start_pg(self) -> None:
+        # A dedicated connection outside the pool, so LISTEN never holds a pool slot
+        import asyncpg
+        args, kwargs = engine.dialect.create_connect_args(engine.url)
+        self._pg_conn = await asyncpg.connect(*args, **kwargs)
+        await self._pg_conn.add_listener(CHANNEL, self._on_notify)
+
+    # ── Shared file (SQLite, several workers on one host) ────
+
+    def _append_file(self, keys: list[Key]) -> None:
+        if os.path.exists(SHARED_FILE) and os.path.getsize(SHARED_FILE) > _MAX_FILE:
+            open(SHARED_FILE, "w").close()
+        with open(SHARED_FILE, "a") as f:
+            for payload in self._payloads(keys):
+                f.write(payload + "\n")
+
+    async def _tail_file(self) -> None:
+        while True:
+            await asyncio.sleep(POLL_S)
+            try:
+                size = os.path.getsize(SHARED_FILE)
+            except OSError:
+                continue
+            if size < self._file_offset:
+                # Truncated by a writer: we may have missed lines, drop everything
+                self._file_offset = 0
+                self._deliver(None, remote=True)
+            if size == self._file_offset:
+                continue
+            with open(SHARED_FILE, "rb") as f:
+                f.seek(self._file_offset)
+                chunk = f.read()
+            complete = chunk[: chunk.rfind(b"\n") + 1]
+            self._file_offset += len(complete)
+            for line in complete.decode().splitlines():
+                self._receive(line)
+
+    # ── Lifecycle ────────────────────────────────────────────
+
+    async def start(self) -> None:
+        if engine.dialect.name == "postgresql":
+            try:
+                await self._start_pg()
+            except Exception:
+                log.exception("LISTEN %s failed — invalidations stay in-process", CHANNEL)
+        elif SHARED_FILE:
+            open(SHARED_FILE, "a").close()
+            self._file_offset = os.path.getsize(SHARED_FILE)
+            self._file_task = asyncio.create_task(self._tail_file())
+
+    async def stop(self) -> None:
+        if self._pg_conn is not None:
+            await self._pg_conn.close()
+            self._pg_conn = None
+        if self._file_task is not None:
+            self._file_task.cancel()
+            self._file_task = None
+
+
+bus = InvalidationBus()
@@ -0,0 +1,270 @@
+"""
+jobs.py — Durable background jobs for post-booking work
+
+Follow-up work for an appointment write (offering a freed interval to the
+waitlist) is queued as a row in the jobs table of the shard being written,
+in the same transaction as the write; long tasks such as the analytics
+export are queued the same way.  The request returns as soon as it commits and a
+crash between commit and follow-up cannot lose the work.
+
+Workers claim ready jobs in batches with one statement:
+  Postgres : UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED)
+             RETURNING, so any number of workers share a queue without
+             waiting on each other's rows
+  SQLite   : the same UPDATE ... RETURNING without the lock clause; the
+             database serializes writers, so claims cannot overlap
+
+A worker wakes on every appointment write made in its process (a local bus
+subscriber) and otherwise polls every JOBS_POLL_MS.  Handlers are registered
+per kind; a batch handler gets every claimed payload of its kind in one call.
+Done jobs are deleted.  A failing job is retried with exponential backoff and
+parked as "failed" after JOBS_MAX_ATTEMPTS; one left "running" by a worker
+that died is reclaimed after JOBS_LEASE_S.  While its handlers run, a worker
+renews the lease of its claimed jobs every JOBS_LEASE_S / 3, so a long job
+such as an export is never reclaimed from a live worker.
+
+Environment variables:
+  JOBS_IN_PROCESS   : run workers inside the API process      (default: true)
+  JOBS_POLL_MS      : idle poll interval                       (default: 500)
+  JOBS_BATCH        : jobs claimed per round                   (default: 50)
+  JOBS_MAX_ATTEMPTS : attempts before a job is parked          (default: 5)
+  JOBS_RETRY_S      : first retry delay, doubled per attempt   (default: 5)
+  JOBS_LEASE_S      : reclaim running jobs locked longer ago   (default: 300)
+
+  python -m app.jobs           # standalone worker (JOBS_IN_PROCESS=false on the API)
+  python -m app.jobs --status  # job counts per shard, kind and status
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import select, update, delete, func, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Job
+from app.invalidation import bus
+from app.metrics import registry
+from app.shards import SHARDS, Shard
+
+log = logging.getLogger(__name__)
+
+IN_PROCESS   = os.getenv("JOBS_IN_PROCESS", "true").lower() == "true"
+POLL_S       = int(os.getenv("JOBS_POLL_MS", "500")) / 1000
+BATCH        = int(os.getenv("JOBS_BATCH", "50"))
+MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+RETRY_S      = float(os.getenv("JOBS_RETRY_S", "5"))
+LEASE_S      = float(os.getenv("JOBS_LEASE_S", "300"))
+
+PROCESSED = registry.counter("jobs_processed_total", "Background jobs by kind and outcome", ("kind", "outcome"))
+RUN_TIME  = registry.histogram("job_run_seconds", "Handler time per job or batch", ("kind",))
+LAG       = registry.histogram("job_queue_lag_seconds", "Time from enqueue to claim", ("kind",))
+
+# Modules that register handlers, imported when workers start
+HANDLER_MODULES = ("app.waitlist", "app.export")
+
+_handlers: dict[str, tuple[Callable[[Any], Awaitable[Any]], bool]] = {}
+
+
+def register(kind: str, fn: Callable[[Any], Awaitable[Any]], batch: bool = False) -> None:
+    """fn(payload) per job, or fn([payload, ...]) once per claimed batch when `batch`."""
+    _handlers[kind] = (fn, batch)
+
+
+def enqueue(db: AsyncSession, kind: str, payload: dict, delay_s: float = 0) -> None:
+    """Stage a job in `db`'s transaction; workers see it once the caller commits."""
+    db.add(Job(kind=kind, payload=json.dumps(payload),
+               run_after=datetime.utcnow() + timedelta(seconds=delay_s)))
+
+
+# ── Claim, run, acknowledge ───────────────────────────────────
+
+async def _claim(db: AsyncSession, limit: int) -> list:
+    now = datetime.utcnow()
+    ready = (
+        select(Job.id)
+        .where(or_(
+            and_(Job.status == "pending", Job.run_after <= now),
+            and_(Job.status == "running", Job.locked_at < now - timedelta(seconds=LEASE_S)),
+        ))
+        .order_by(Job.run_after, Job.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    rows = (await db.execute(
+        update(Job)
+        .where(Job.id.in_(ready.scalar_subquery()))
+        .values(status="running", locked_at=now, attempts=Job.attempts + 1)
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.created_at)
+        .execution_options(synchronize_session=False)
+    )).all()
+    await db.commit()
+    for r in rows:
+        LAG.labels(r.kind).observe((now - r.created_at).total_seconds())
+    return rows
+
+
+async def _call(kind: str, rows: list) -> None:
+    fn, batch = _handlers[kind]
+    payloads = [json.loads(r.payload) for r in rows]
+    if batch:
+        await fn(payloads)
+    else:
+        for payload in payloads:
+            await fn(payload)
+
+
+async def _renew(shard: Shard, ids: list[int]) -> None:
+    """Keep the lease of claimed jobs fresh until cancelled."""
+    while True:
+        await asyncio.sleep(LEASE_S / 3)
+        try:
+            async with shard.session() as db:
+                await db.execute(
+                    update(Job).where(Job.id.in_(ids), Job.status == "running")
+                    .values(locked_at=datetime.utcnow())
+                )
+                await db.commit()
+        except Exception:
+            log.warning("failed to renew the lease of %d job(s) on shard %s", len(ids), shard.name, exc_info=True)
+
+
+async def _run_batch(shard: Shard, rows: list) -> None:
+    by_kind: dict[str, list] = {}
+    for r in rows:
+        by_kind.setdefault(r.kind, []).append(r)
+    done: list[int] = []
+    failed: list[tuple[Any, str]] = []
+    lease = asyncio.create_task(_renew(shard, [r.id for r in rows]))
+    try:
+        for kind, group in by_kind.items():
+            batch = _handlers.get(kind, (None, False))[1]
+            for unit in ([group] if batch else [[r] for r in group]):
+                t0 = time.perf_counter()
+                try:
+                    await _call(kind, unit)
+                except Exception as e:
+                    log.exception("job %s failed (%d job(s))", kind, len(unit))
+                    failed.extend((r, repr(e)) for r in unit)
+                else:
+                    done.extend(r.id for r in unit)
+                    PROCESSED.labels(kind, "ok").value += len(unit)
+                RUN_TIME.labels(kind).observe(time.perf_counter() - t0)
+    finally:
+        lease.cancel()
+
+    async with shard.session() as db:
+        if done:
+            await db.execute(delete(Job).where(Job.id.in_(done)))
+        for r, error in failed:
+            parked = r.attempts >= MAX_ATTEMPTS
+            PROCESSED.labels(r.kind, "failed" if parked else "retry").value += 1
+            await db.execute(update(Job).where(Job.id == r.id).values(
+                status="failed" if parked else "pending",
+                run_after=datetime.utcnow() + timedelta(seconds=RETRY_S * 2 ** (r.attempts - 1)),
+                locked_at=None,
+                last_error=error[:2000],
+            ))
+        await db.commit()
+
+
+# ── Workers ───────────────────────────────────────────────────
+
+class JobQueue:
+    """One polling loop per shard; wake() cuts the idle wait short."""
+
+    def __init__(self, poll_s: float, batch: int):
+        self.poll_s = poll_s
+        self.batch = batch
+        self._events = {name: asyncio.Event() for name in SHARDS}
+        self._tasks: list[asyncio.Task] = []
+
+    def wake(self, _keys=None) -> None:
+        for event in self._events.values():
+            event.set()
+
+    async def run_once(self, shard: Shard) -> int:
+        """Claim and run one batch on `shard`; returns how many jobs it claimed."""
+        async with shard.session() as db:
+            rows = await _claim(db, self.batch)
+        if rows:
+            await _run_batch(shard, rows)
+        return len(rows)
+
+    async def _run(self, shard: Shard) -> None:
+        event = self._events[shard.name]
+        while True:
+            event.clear()
+            try:
+                n = await self.run_once(shard)
+            except Exception:
+                log.exception("job worker on shard %s failed", shard.name)
+                n = 0
+            if n < self.batch:
+                try:
+                    await asyncio.wait_for(event.wait(), self.poll_s)
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self) -> None:
+        for module in HANDLER_MODULES:
+            importlib.import_module(module)
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run(shard)) for shard in SHARDS.values()]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+
+job_queue = JobQueue(POLL_S, BATCH)
+# Writes stage their jobs before publishing, so a local publish means work is ready
+bus.subscribe(job_queue.wake, local_only=True)
+
+
+async def status() -> list[tuple[str, str, str, int]]:
+    out = []
+    for shard in SHARDS.values():
+        async with shard.session() as db:
+            rows = await db.execute(
+                select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status).order_by(Job.kind, Job.status)
+            )
+            out.extend((shard.name, kind, st, n) for kind, st, n in rows.all())
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run background jobs")
+    parser.add_argument("--status", action="store_true", help="only print job counts")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        from app.shards import all_engines
+        try:
+            if args.status:
+                for row in await status():
+                    print("%-10s %-22s %-8s %d" % row)
+            else:
+                job_queue.start()
+                await asyncio.gather(*job_queue._tasks)
+        finally:
+            for e in all_engines():
+                await e.dispose()
+
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
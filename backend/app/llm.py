@@ -0,0 +1,178 @@
+"""
+llm.py — Pluggable LLM backends for the chat assistant
+
+Providers take a system prompt plus a neutral message history
+([{"role": "user" | "assistant", "content": str}]) and return an LLMReply.
+
+Environment variables:
+  LLM_PROVIDER        : gemini | stub                        (default: gemini)
+  LLM_MODEL           : Gemini model name                    (default: gemini-3-flash-preview)
+  GOOGLE_API_KEY      : Gemini credentials
+  LLM_STUB_LATENCY_MS : simulated model latency for the stub (default: 300)
+  LLM_STUB_JITTER_MS  : +/- random jitter on that latency    (default: 100)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import AsyncIterator
+
+PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+MODEL    = os.getenv("LLM_MODEL", "gemini-3-flash-preview")
+
+
+class LLMNotConfigured(RuntimeError):
+    """Raised when the selected provider is missing credentials."""
+
+
+@dataclass
+class LLMReply:
+    text          : str
+    prompt_tokens : int = 0
+    output_tokens : int = 0
+    latency_ms    : float = 0.0
+
+
+class LLMProvider:
+    name = "base"
+
+    async def generate(self, system: str, messages: list[dict]) -> LLMReply:
+        raise NotImplementedError
+
+    async def stream(self, system: str, messages: list[dict]) -> AsyncIterator[str]:
+        """Yield the reply in chunks; defaults to a single chunk from generate()."""
+        reply = await self.generate(system, messages)
+        yield reply.text
+
+
+# ── Gemini ────────────────────────────────────────────────────
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model: str = MODEL, api_key: str | None = None):
+        self.model = model
+        self.api_key = api_key if api_key is not None else os.getenv("GOOGLE_API_KEY", "")
+
+    def _model(self, system: str):
+        if not self.api_key:
+            raise LLMNotConfigured("GOOGLE_API_KEY not configured")
+        import google.generativeai as genai
+        genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel(model_name=self.model, system_instruction=system)
+
+    @staticmethod
+    def _contents(messages: list[dict]) -> list[dict]:
+        return [
+            {"role": "user" if m["role"] == "user" else "model", "parts": [m["content"]]}
+            for m in messages
+        ]
+
+    async def generate(self, system: str, messages: list[dict]) -> LLMReply:
+        model = self._model(system)
+        t0 = time.perf_counter()
+        response = await model.generate_content_async(self._contents(messages))
+        usage = getattr(response, "usage_metadata", None)
+        return LLMReply(
+            text=response.text,
+            prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+            latency_ms=(time.perf_counter() - t0) * 1000,
+        )
+
+    async def stream(self, system: str, messages: list[dict]) -> AsyncIterator[str]:
+        model = self._model(system)
+        response = await model.generate_content_async(self._contents(messages), stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+# ── Deterministic local stub ──────────────────────────────────
+
+_BOOKING_TRIGGERS = ("book", "confirm", "yes")
+
+
+class StubProvider(LLMProvider):
+    """
+    Offline stand-in for load tests.  Replies are a pure function of the
+    conversation, so the same history always yields the same text.  Messages
+    containing "book", "confirm" or "yes" get a [BOOKING_REQUEST] block for a
+    general checkup on a weekday in the next two weeks.
+    """
+    name = "stub"
+
+    def __init__(self, latency_ms: float | None = None, jitter_ms: float | None = None):
+        self.latency_ms = latency_ms if latency_ms is not None else float(os.getenv("LLM_STUB_LATENCY_MS", "300"))
+        self.jitter_ms  = jitter_ms  if jitter_ms  is not None else float(os.getenv("LLM_STUB_JITTER_MS", "100"))
+
+    @staticmethod
+    def _seed(messages: list[dict]) -> int:
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def _reply_text(self, messages: list[dict]) -> str:
+        seed = self._seed(messages)
+        last = messages[-1]["content"].lower() if messages else ""
+        if not any(t in last for t in _BOOKING_TRIGGERS):
+            return ("Thanks — I can help with that. Could you tell me your full name "
+                    "and whether you prefer our Downtown or Westside clinic?")
+
+        day = date.today() + timedelta(days=1 + seed % 14)
+        while day.weekday() >= 5:
+            day += timedelta(days=1)
+        start = 9 * 60 + 15 * ((seed >> 8) % 28)   # 09:00 … 15:45, dr_chen is in 9–17
+        booking = {
+            "patient_name": f"Load Test {seed % 100000:05d}",
+            "patient_phone": f"+1-555-{seed % 10000:04d}",
+            "appointments": [{
+                "procedure_id": "general_checkup",
+                "clinic_id": "downtown",
+                "date": str(day),
+                "start_time": f"{start // 60:02d}:{start % 60:02d}",
+                "primary_doctor_id": "dr_chen",
+                "doctor_ids": ["dr_chen"],
+                "notes": "stub booking",
+            }],
+        }
+        return ("Great, here is your booking:\n\n[BOOKING_REQUEST]\n"
+                f"{json.dumps(booking, indent=2)}\n[/BOOKING_REQUEST]")
+
+    async def _sleep(self, messages: list[dict], fraction: float = 1.0) -> None:
+        jitter = random.Random(self._seed(messages)).uniform(-self.jitter_ms, self.jitter_ms)
+        await asyncio.sleep(max(0.0, self.latency_ms + jitter) * fraction / 1000)
+
+    async def generate(self, system: str, messages: list[dict]) -> LLMReply:
+        t0 = time.perf_counter()
+        await self._sleep(messages)
+        text = self._reply_text(messages)
+        return LLMReply(
+            text=text,
+            prompt_tokens=len(system.split()) + sum(len(m["content"].split()) for m in messages),
+            output_tokens=len(text.split()),
+            latency_ms=(time.perf_counter() - t0) * 1000,
+        )
+
+    async def stream(self, system: str, messages: list[dict]) -> AsyncIterator[str]:
+        tokens = self._reply_text(messages).split(" ")
+        for i, tok in enumerate(tokens):
+            await self._sleep(messages, 1 / len(tokens))
+            yield tok if i == 0 else " " + tok
+
+
+_PROVIDERS = {"gemini": GeminiProvider, "stub": StubProvider}
+_instance: LLMProvider | None = None
+
+
+def get_llm() -> LLMProvider:
+    global _instance
+    if _instance is None:
+        if PROVIDER not in _PROVIDERS:
+            raise LLMNotConfigured(f"Unknown LLM_PROVIDER: {PROVIDER}")
+        _instance = _PROVIDERS[PROVIDER]()
+    return _instance
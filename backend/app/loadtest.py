@@ -0,0 +1,128 @@
+"""
+loadtest.py — Concurrent chat-session load generator
+
+Drives N simulated patients through /api/chat (greeting, a few turns, a
+booking request) and /api/chat/confirm, then reports latency percentiles and
+throughput per endpoint.
+
+  # Against a running server (start it with LLM_PROVIDER=stub for offline runs)
+  python -m app.loadtest --url http://localhost:8000 --sessions 200 --concurrency 50
+
+  # Fully in-process: stub LLM + the app mounted on an ASGI transport
+  LLM_PROVIDER=stub DB_DRIVER=sqlite+aiosqlite python -m app.loadtest --in-process
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+_TURNS = [
+    "Hello",
+    "I have had a dull ache in my lower molar for a week.",
+    "My name is Sam, Downtown works best, mornings if possible.",
+    "Yes please, book it.",
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+
+    def add(self, endpoint: str, status: int, ms: float) -> None:
+        self.latencies[endpoint].append(ms)
+        self.statuses[endpoint][status] += 1
+
+
+async def _timed(client: httpx.AsyncClient, rec: Recorder, endpoint: str, payload: dict):
+    t0 = time.perf_counter()
+    try:
+        resp = await client.post(endpoint, json=payload)
+        status = resp.status_code
+    except httpx.HTTPError:
+        resp, status = None, 0
+    rec.add(endpoint, status, (time.perf_counter() - t0) * 1000)
+    return resp
+
+
+async def run_session(client: httpx.AsyncClient, rec: Recorder, turns: list[str]) -> None:
+    session_id = f"load-{uuid.uuid4().hex[:12]}"
+    history: list[dict] = []
+    booking = None
+    for text in turns:
+        history.append({"role": "user", "content": text})
+        resp = await _timed(client, rec, "/api/chat", {"session_id": session_id, "messages": history})
+        if resp is None or resp.status_code != 200:
+            return
+        data = resp.json()
+        history.append({"role": "assistant", "content": data["content"]})
+        booking = data.get("booking_request") or booking
+    if booking:
+        await _timed(client, rec, "/api/chat/confirm",
+                     {"session_id": session_id, "booking_request": booking})
+
+
+def _pct(sorted_ms: list[float], p: float) -> float:
+    if len(sorted_ms) == 1:
+        return sorted_ms[0]
+    return statistics.quantiles(sorted_ms, n=100, method="inclusive")[int(p) - 1]
+
+
+def report(rec: Recorder, wall_s: float) -> str:
+    lines = [f"{'endpoint':<20}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}  status"]
+    total = 0
+    for endpoint, values in sorted(rec.latencies.items()):
+        ms = sorted(values)
+        total += len(ms)
+        statuses = " ".join(f"{k}×{v}" for k, v in sorted(rec.statuses[endpoint].items()))
+        lines.append(
+            f"{endpoint:<20}{len(ms):>7}{_pct(ms, 50):>10.1f}{_pct(ms, 95):>10.1f}"
+            f"{_pct(ms, 99):>10.1f}{len(ms) / wall_s:>9.1f}  {statuses}"
+        )
+    lines.append(f"total {total} requests in {wall_s:.2f}s — {total / wall_s:.1f} req/s")
+    return "\n".join(lines)
+
+
+async def run(sessions: int, concurrency: int, client: httpx.AsyncClient) -> Recorder:
+    rec = Recorder()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await run_session(client, rec, _TURNS)
+
+    await asyncio.gather(*(one() for _ in range(sessions)))
+    return rec
+
+
+async def main(args) -> None:
+    timeout = httpx.Timeout(args.timeout)
+    t0 = time.perf_counter()
+    if args.in_process:
+        from app.main import app
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout) as client:
+                t0 = time.perf_counter()
+                rec = await run(args.sessions, args.concurrency, client)
+    else:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits) as client:
+            rec = await run(args.sessions, args.concurrency, client)
+    print(report(rec, time.perf_counter() - t0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the chat booking path")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--in-process", action="store_true",
+                        help="serve app.main:app over an ASGI transport instead of HTTP")
+    asyncio.run(main(parser.parse_args()))
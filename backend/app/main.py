@@ -3,24 +3,65 @@ main.py — MedDent FastAPI Backend
 Runs on Cloud Run, connects to Cloud SQL PostgreSQL via Unix socket or TCP.
 """
 
+import logging
 import os
+import time
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from app.database import engine, Base
-from app.routers import appointments, chat, data, slots
+from app.shards import all_engines
+from app.chat_store import write_buffer
+from app.retention import compaction_job
+from app.free_slots import horizon_job
+from app.jobs import IN_PROCESS as JOBS_IN_PROCESS, job_queue
+from app.idempotency import purge_job
+from app.invalidation import bus
+from app.admission import AdmissionMiddleware
+from app.compression import CompressionMiddleware
+from app.metrics import MetricsMiddleware, instrument_engine, registry, profiler
+from app.routers import analytics, appointments, calendar, chat, data, optimizer, schedule_ws, slots, waitlist
+from app import schedule_optimizer
+from app.migrations import ensure_schema, migrate
 from app.seed import seed_if_empty
 
 
+# dev  : apply migrations (creates every table) + demo seed, for local work
+# prod : one schema-version read; migrates only when behind, never seeds
+STARTUP_MODE = os.getenv("STARTUP_MODE", "prod").lower()
+
+log = logging.getLogger("app.startup")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Create tables on startup
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    # Seed demo data if the DB is empty
-    await seed_if_empty()
+    t0 = time.perf_counter()
+    if STARTUP_MODE == "dev":
+        await migrate()
+        # Seed demo data if the DB is empty
+        await seed_if_empty()
+    else:
+        await ensure_schema()
+    log.info("startup (%s) ready in %.0f ms", STARTUP_MODE, (time.perf_counter() - t0) * 1000)
+    await bus.start()
+    write_buffer.start()
+    compaction_job.start()
+    horizon_job.start()
+    purge_job.start()
+    if JOBS_IN_PROCESS:
+        job_queue.start()
+    if profiler is not None:
+        profiler.start()
     yield
+    await compaction_job.stop()
+    await horizon_job.stop()
+    await purge_job.stop()
+    await job_queue.stop()
+    schedule_optimizer.shutdown()
+    # Flush any buffered chat messages before the instance goes away
+    await write_buffer.stop()
+    await bus.stop()
 
 
 app = FastAPI(
@@ -30,6 +71,10 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# ── Admission control (expensive route classes only) ──────────
+# Added before CORS so CORS wraps it and 429/503 carry CORS headers
+app.add_middleware(AdmissionMiddleware)
+
 # ── CORS ──────────────────────────────────────────────────────
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
 app.add_middleware(
@@ -40,11 +85,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ── Metrics ───────────────────────────────────────────────────
+for _engine in all_engines():
+    instrument_engine(_engine)
+app.add_middleware(MetricsMiddleware)
+
+# ── Compression (outermost, so it sees final headers) ─────────
+app.add_middleware(CompressionMiddleware)
+
 # ── Routers ───────────────────────────────────────────────────
 app.include_router(data.router,         prefix="/api/data",         tags=["Static Data"])
 app.include_router(appointments.router, prefix="/api/appointments",  tags=["Appointments"])
 app.include_router(slots.router,        prefix="/api/slots",         tags=["Slot Finder"])
 app.include_router(chat.router,         prefix="/api/chat",          tags=["AI Chat"])
+app.include_router(waitlist.router,     prefix="/api/waitlist",      tags=["Waitlist"])
+app.include_router(analytics.router,    prefix="/api/analytics",     tags=["Analytics"])
+app.include_router(calendar.router,     prefix="/api/calendar",      tags=["Calendar"])
+app.include_router(optimizer.router,    prefix="/api/optimizer",     tags=["Optimizer"])
+app.include_router(schedule_ws.router)
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/health")
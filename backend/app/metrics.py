@@ -0,0 +1,280 @@
+"""
+metrics.py — Per-route latency, DB and LLM metrics in Prometheus text format
+
+MetricsMiddleware times every HTTP request under its route template and keeps
+an in-flight gauge.  SQLAlchemy cursor events add each query's duration to
+the current request's RequestStats (carried in a contextvar), and the chat
+router reports LLM latency and token counts via record_llm().  GET /metrics
+renders everything with registry.render().
+
+Environment variables:
+  PROFILE_SLOW_MS     : enable the sampling profiler; requests slower than this
+                        are logged with their hottest stacks       (default: off)
+  PROFILE_INTERVAL_MS : stack sampling interval                     (default: 5)
+"""
+
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+log = logging.getLogger(__name__)
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# ── Primitive metric types ────────────────────────────────────
+
+class Histogram:
+    def __init__(self, buckets: tuple = _BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Family:
+    """A named metric with one child per label-value tuple."""
+
+    def __init__(self, name: str, kind: str, help: str, label_names: tuple[str, ...], factory: Callable):
+        self.name, self.kind, self.help, self.label_names = name, kind, help, label_names
+        self.factory = factory
+        self.children: dict[tuple, object] = {}
+
+    def labels(self, *values) -> object:
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.factory()
+        return child
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Registry:
+    def __init__(self):
+        self.families: dict[str, Family] = {}
+        self.collectors: list[Callable[[], list[tuple[str, str, str, dict, float]]]] = []
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = _BUCKETS) -> Family:
+        return self.families.setdefault(name, Family(name, "histogram", help, labels, lambda: Histogram(buckets)))
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Family:
+        return self.families.setdefault(name, Family(name, "counter", help, labels, _Value))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Family:
+        return self.families.setdefault(name, Family(name, "gauge", help, labels, _Value))
+
+    def register_collector(self, fn: Callable) -> None:
+        """fn() -> [(name, kind, help, {label: value}, sample)] evaluated on every scrape."""
+        self.collectors.append(fn)
+
+    def render(self) -> str:
+        out: list[str] = []
+        for fam in self.families.values():
+            out.append(f"# HELP {fam.name} {fam.help}")
+            out.append(f"# TYPE {fam.name} {fam.kind}")
+            for values, child in sorted(fam.children.items()):
+                labels = _fmt_labels(fam.label_names, values)
+                if isinstance(child, Histogram):
+                    cumulative = 0
+                    for bound, n in zip(child.buckets, child.counts):
+                        cumulative += n
+                        le = _fmt_labels(fam.label_names, values, 'le="%s"' % bound)
+                        out.append(f"{fam.name}_bucket{le} {cumulative}")
+                    le = _fmt_labels(fam.label_names, values, 'le="+Inf"')
+                    out.append(f"{fam.name}_bucket{le} {child.count}")
+                    out.append(f"{fam.name}_sum{labels} {child.sum:.6f}")
+                    out.append(f"{fam.name}_count{labels} {child.count}")
+                else:
+                    out.append(f"{fam.name}{labels} {child.value:g}")
+        seen: set[str] = set()
+        for collect in self.collectors:
+            for name, kind, help, labels, value in collect():
+                if name not in seen:
+                    out.append(f"# HELP {name} {help}")
+                    out.append(f"# TYPE {name} {kind}")
+                    seen.add(name)
+                out.append(f"{name}{_fmt_labels(tuple(labels), tuple(labels.values()))} {value:g}")
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+IN_FLIGHT       = registry.gauge("http_requests_in_flight", "Requests currently being served", ("route",))
+DB_TIME         = registry.histogram("db_time_per_request_seconds", "Total DB time spent inside one request", ("route",))
+DB_QUERIES      = registry.counter("db_queries_total", "SQL statements executed", ("route",))
+LLM_LATENCY     = registry.histogram("llm_request_duration_seconds", "LLM call latency", ("provider",))
+LLM_TOKENS      = registry.counter("llm_tokens_total", "LLM tokens consumed", ("provider", "kind"))
+
+
+# ── Per-request accounting ────────────────────────────────────
+
+@dataclass
+class RequestStats:
+    route      : str = ""
+    db_seconds : float = 0.0
+    db_queries : int = 0
+    llm_seconds: float = 0.0
+
+
+_current: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("request_stats", default=None)
+
+
+def current_stats() -> RequestStats | None:
+    return _current.get()
+
+
+def instrument_engine(engine) -> None:
+    """Attribute every statement on `engine` to the request that issued it."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.db_seconds += elapsed
+            stats.db_queries += 1
+
+
+def record_llm(provider: str, latency_ms: float, prompt_tokens: int, output_tokens: int) -> None:
+    LLM_LATENCY.labels(provider).observe(latency_ms / 1000)
+    LLM_TOKENS.labels(provider, "prompt").value += prompt_tokens
+    LLM_TOKENS.labels(provider, "output").value += output_tokens
+    stats = _current.get()
+    if stats is not None:
+        stats.llm_seconds += latency_ms / 1000
+
+
+# ── Sampling profiler for slow requests ───────────────────────
+
+class SlowRequestProfiler:
+    """
+    Samples the event-loop thread's stack every `interval_ms` from a daemon
+    thread.  When a request exceeds `threshold_ms`, the samples taken during
+    its lifetime are aggregated and passed to every hook (default: a log line).
+    """
+
+    def __init__(self, threshold_ms: float, interval_ms: float = 5.0, history: int = 20000):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.samples: deque[tuple[float, tuple]] = deque(maxlen=history)
+        self.hooks: list[Callable[[str, float, Counter], None]] = [self._log]
+        self._thread: threading.Thread | None = None
+        self._target: int | None = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._target = threading.get_ident()
+            self._thread = threading.Thread(target=self._sample, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+
+    def _sample(self) -> None:
+        while True:
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                stack = tuple(f"{fs.filename.rsplit('/', 1)[-1]}:{fs.lineno} {fs.name}"
+                              for fs in traceback.extract_stack(frame, limit=12))
+                self.samples.append((time.perf_counter(), stack))
+            time.sleep(self.interval)
+
+    def finish(self, route: str, started: float, ended: float) -> None:
+        if ended - started < self.threshold:
+            return
+        hot = Counter(stack for t, stack in list(self.samples) if started <= t <= ended)
+        for hook in self.hooks:
+            hook(route, (ended - started) * 1000, hot)
+
+    @staticmethod
+    def _log(route: str, elapsed_ms: float, hot: Counter) -> None:
+        lines = [f"slow request {route} took {elapsed_ms:.0f} ms ({sum(hot.values())} samples)"]
+        for stack, n in hot.most_common(5):
+            lines.append(f"  {n:>4}× " + " <- ".join(reversed(stack[-4:])))
+        log.warning("\n".join(lines))
+
+
+_slow_ms = os.getenv("PROFILE_SLOW_MS")
+profiler = SlowRequestProfiler(float(_slow_ms), float(os.getenv("PROFILE_INTERVAL_MS", "5"))) if _slow_ms else None
+
+
+def add_slow_request_hook(fn: Callable[[str, float, Counter], None]) -> None:
+    """Register fn(route, elapsed_ms, Counter[stack]) to receive slow-request profiles."""
+    if profiler is not None:
+        profiler.hooks.append(fn)
+
+
+# ── ASGI middleware ───────────────────────────────────────────
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    def _route(self, scope) -> str:
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", scope["path"])
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(route=self._route(scope))
+        token = _current.set(stats)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(stats.route)
+        in_flight.value += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            ended = time.perf_counter()
+            in_flight.value -= 1
+            _current.reset(token)
+            REQUEST_LATENCY.labels(scope["method"], stats.route, str(status)).observe(ended - started)
+            DB_TIME.labels(stats.route).observe(stats.db_seconds)
+            DB_QUERIES.labels(stats.route).value += stats.db_queries
+            if profiler is not None:
+                profiler.finish(stats.route, started, ended)
@@ -0,0 +1,152 @@
+"""
+migrations.py — Versioned schema migrations
+
+Each entry in MIGRATIONS upgrades the schema by one version and is recorded
+in the schema_migrations table.  Startup only has to read the recorded
+version (one indexed query) instead of running Base.metadata.create_all.
+When the database is behind, pending steps run under an advisory lock so
+that instances starting at the same time do not race each other.
+
+  python -m app.migrations           # apply pending migrations
+  python -m app.migrations --status  # print current / target version
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Callable
+
+from sqlalchemy import inspect, select, func, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+from app.database import Base
+from app.models import SchemaMigration
+from app.patient_search import install as install_patient_search, rekey as rekey_patient_search
+from app.shards import SHARDS, all_engines
+
+log = logging.getLogger(__name__)
+
+
+# ── Helpers ───────────────────────────────────────────────────
+
+def sync_tables(conn: Connection, names: list[str], skip_indexes: frozenset[str] = frozenset()) -> None:
+    """
+    Bring the listed tables in line with the ORM models: create missing
+    tables, add missing (nullable) columns and create missing indexes other
+    than `skip_indexes`.
+    """
+    insp = inspect(conn)
+    for name in names:
+        table = Base.metadata.tables[name]
+        if not insp.has_table(name):
+            conn.execute(CreateTable(table))
+            indexes = set()
+        else:
+            existing = {c["name"] for c in insp.get_columns(name)}
+            for col in table.columns:
+                if col.name not in existing:
+                    ddl = CreateColumn(col).compile(dialect=conn.dialect)
+                    conn.execute(text(f"ALTER TABLE {name} ADD COLUMN {ddl}"))
+            indexes = {i["name"] for i in insp.get_indexes(name)}
+        for index in table.indexes:
+            if index.name not in indexes and index.name not in skip_indexes:
+                index.create(conn)
+
+
+# The schema versioning started from; what later steps add to these tables
+# is left to those steps
+_BASELINE_TABLES = ["appointments", "chat_sessions", "chat_messages",
+                    "chat_sessions_archive", "chat_messages_archive"]
+_ADDED_LATER     = frozenset({"ix_appointments_updated",       # migration 3
+                              "ix_appointments_doctor_date"})  # migration 8
+
+
+def _baseline(conn: Connection) -> None:
+    # Tables that predate versioning may exist without the newer indexes
+    sync_tables(conn, _BASELINE_TABLES, skip_indexes=_ADDED_LATER)
+
+
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline schema, clinic/date and chat history indexes", _baseline),
+    (2, "waitlist", lambda conn: sync_tables(conn, ["waitlist"])),
+    (3, "appointments (updated_at, id) index for the change feed", lambda conn: sync_tables(conn, ["appointments"])),
+    (4, "materialized free slots", lambda conn: sync_tables(conn, ["free_slots", "free_slot_days"])),
+    (5, "background job queue", lambda conn: sync_tables(conn, ["jobs"])),
+    (6, "patient search: pg_trgm indexes / FTS5 table", install_patient_search),
+    (7, "idempotency keys", lambda conn: sync_tables(conn, ["idempotency_keys"])),
+    (8, "appointments (primary_doctor_id, date) index for doctor calendar feeds",
+        lambda conn: sync_tables(conn, ["appointments"])),
+    (9, "patient search: FTS5 rows keyed by appointment id", rekey_patient_search),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# ── Runner ────────────────────────────────────────────────────
+
+def _recorded_version(conn: Connection) -> int:
+    return conn.execute(select(func.max(SchemaMigration.version))).scalar() or 0
+
+
+def _upgrade(conn: Connection) -> int:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('meddent_schema'))"))
+    SchemaMigration.__table__.create(conn, checkfirst=True)
+    current = _recorded_version(conn)
+    for version, description, step in MIGRATIONS:
+        if version > current:
+            log.info("applying migration %d: %s", version, description)
+            step(conn)
+            conn.execute(SchemaMigration.__table__.insert().values(version=version, description=description))
+    return max(current, SCHEMA_VERSION)
+
+
+async def current_version() -> int:
+    """Lowest recorded schema version across shards; 0 for a database that predates versioning."""
+    versions = []
+    for shard in SHARDS.values():
+        try:
+            async with shard.engine.connect() as conn:
+                versions.append(await conn.run_sync(_recorded_version))
+        except DBAPIError:
+            versions.append(0)
+    return min(versions)
+
+
+async def migrate() -> int:
+    """Apply pending migrations on every shard; returns the resulting schema version."""
+    version = SCHEMA_VERSION
+    for shard in SHARDS.values():
+        async with shard.engine.begin() as conn:
+            if shard.schema:
+                await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{shard.schema}"'))
+            version = min(version, await conn.run_sync(_upgrade))
+    return version
+
+
+async def ensure_schema() -> int:
+    """Startup check: a single version read, upgrading only when behind."""
+    version = await current_version()
+    if version < SCHEMA_VERSION:
+        log.info("schema at version %d, target %d — migrating", version, SCHEMA_VERSION)
+        version = await migrate()
+    return version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument("--status", action="store_true", help="only print versions")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        if args.status:
+            print(f"current={await current_version()} target={SCHEMA_VERSION}")
+        else:
+            print(f"schema version {await migrate()}")
+        for e in all_engines():
+            await e.dispose()
+
+    asyncio.run(_main())
@@ -5,7 +5,7 @@ models.py — SQLAlchemy ORM models
 import uuid
 from datetime import datetime
 from sqlalchemy import (
-    String, Integer, Text, DateTime, ForeignKey, ARRAY
+    String, Integer, Text, DateTime, ForeignKey, ARRAY, Index
 )
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID, ARRAY as PG_ARRAY
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -37,13 +37,22 @@ class Appointment(Base):
     created_at         : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at         : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # Clash checks look up one clinic-day at a time
+        Index("ix_appointments_clinic_date", "clinic_id", "date"),
+        # Keyset scans for GET /api/appointments/changes
+        Index("ix_appointments_updated", "updated_at", "id"),
+        # Doctor calendar feeds read one doctor's range of days
+        Index("ix_appointments_doctor_date", "primary_doctor_id", "date"),
+    )
+
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
 
     id           : Mapped[str]      = mapped_column(String(64), primary_key=True, default=new_uuid)
     patient_name : Mapped[str | None] = mapped_column(String(256))
-    started_at   : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at   : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
     ended_at     : Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     meta_json    : Mapped[str | None] = mapped_column(Text)
 
@@ -62,3 +71,134 @@ class ChatMessage(Base):
     created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     session: Mapped["ChatSession"] = relationship("ChatSession", back_populates="messages")
+
+    __table_args__ = (
+        # Ordered history reads and the retention job's "recent activity" probe
+        Index("ix_chat_messages_session_created", "session_id", "created_at"),
+    )
+
+
+# ── Chat history archive (filled by app.retention) ────────────
+
+class ChatSessionArchive(Base):
+    __tablename__ = "chat_sessions_archive"
+
+    id              : Mapped[str]      = mapped_column(String(64), primary_key=True)
+    patient_name    : Mapped[str | None] = mapped_column(String(256))
+    started_at      : Mapped[datetime | None] = mapped_column(DateTime)
+    ended_at        : Mapped[datetime | None] = mapped_column(DateTime)
+    message_count   : Mapped[int]      = mapped_column(Integer, default=0)
+    last_message_at : Mapped[datetime | None] = mapped_column(DateTime)
+    meta_json       : Mapped[str | None] = mapped_column(Text)
+    archived_at     : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ChatMessageArchive(Base):
+    __tablename__ = "chat_messages_archive"
+
+    id         : Mapped[int]      = mapped_column(Integer, primary_key=True, autoincrement=False)
+    session_id : Mapped[str]      = mapped_column(String(64), nullable=False, index=True)
+    role       : Mapped[str]      = mapped_column(String(16), nullable=False)
+    content    : Mapped[str]      = mapped_column(Text, nullable=False)
+    created_at : Mapped[datetime | None] = mapped_column(DateTime)
+
+
+# ── Waitlist (filled by app.waitlist on cancellations) ────────
+
+class WaitlistEntry(Base):
+    __tablename__ = "waitlist"
+
+    id                  : Mapped[str] = mapped_column(String(64), primary_key=True, default=new_uuid)
+    procedure_id        : Mapped[str] = mapped_column(String(64), nullable=False)
+    patient_name        : Mapped[str] = mapped_column(String(256), nullable=False)
+    patient_phone       : Mapped[str | None] = mapped_column(String(64))
+    patient_email       : Mapped[str | None] = mapped_column(String(256))
+    preferred_clinic_id : Mapped[str | None] = mapped_column(String(64))         # None = any clinic
+    earliest_date       : Mapped[str] = mapped_column(String(10), nullable=False)  # YYYY-MM-DD
+    latest_date         : Mapped[str] = mapped_column(String(10), nullable=False)
+    earliest_time       : Mapped[str] = mapped_column(String(5), default="00:00")  # HH:MM
+    latest_time         : Mapped[str] = mapped_column(String(5), default="23:59")
+    notes               : Mapped[str | None] = mapped_column(Text)
+    status              : Mapped[str] = mapped_column(String(32), default="waiting")  # waiting | offered | removed
+    appointment_id      : Mapped[str | None] = mapped_column(String(64))            # the held appointment
+    created_at          : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at          : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Freed slots are matched by procedure and date, oldest request first
+        Index("ix_waitlist_match", "procedure_id", "status", "earliest_date", "latest_date"),
+    )
+
+
+# ── Materialized free slots (maintained by app.free_slots) ───
+
+class FreeSlot(Base):
+    __tablename__ = "free_slots"
+
+    # Primary key order serves "procedure X between these dates" lookups
+    procedure_id      : Mapped[str] = mapped_column(String(64), primary_key=True)
+    date              : Mapped[str] = mapped_column(String(10), primary_key=True)   # YYYY-MM-DD
+    clinic_id         : Mapped[str] = mapped_column(String(64), primary_key=True)
+    start_time        : Mapped[str] = mapped_column(String(5),  primary_key=True)   # HH:MM
+    doctor_ids        : Mapped[str] = mapped_column(String(256), primary_key=True)  # JSON array stored as text
+    room_id           : Mapped[str] = mapped_column(String(16), nullable=False)
+    duration_mins     : Mapped[int] = mapped_column(Integer,    nullable=False)
+    primary_doctor_id : Mapped[str] = mapped_column(String(64), nullable=False)
+
+    __table_args__ = (
+        # Refreshes replace one clinic-day at a time
+        Index("ix_free_slots_clinic_date", "clinic_id", "date"),
+    )
+
+
+class FreeSlotDay(Base):
+    """A clinic-day whose free_slots rows are materialized (it may have none)."""
+    __tablename__ = "free_slot_days"
+
+    clinic_id    : Mapped[str]      = mapped_column(String(64), primary_key=True)
+    date         : Mapped[str]      = mapped_column(String(10), primary_key=True)
+    refreshed_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+# ── Background jobs (queued with the write, run by app.jobs) ──
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id         : Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind       : Mapped[str] = mapped_column(String(64), nullable=False)
+    payload    : Mapped[str] = mapped_column(Text, nullable=False)                # JSON
+    status     : Mapped[str] = mapped_column(String(16), default="pending")       # pending | running | failed
+    attempts   : Mapped[int] = mapped_column(Integer, default=0)
+    run_after  : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    locked_at  : Mapped[datetime | None] = mapped_column(DateTime)
+    last_error : Mapped[str | None] = mapped_column(Text)
+    created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Workers claim the oldest ready jobs; done jobs are deleted
+        Index("ix_jobs_ready", "status", "run_after"),
+    )
+
+
+# ── Idempotency keys for booking writes (see app.idempotency) ─
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    route        : Mapped[str] = mapped_column(String(64),  primary_key=True)
+    key          : Mapped[str] = mapped_column(String(128), primary_key=True)
+    request_hash : Mapped[str] = mapped_column(String(64),  nullable=False)   # sha256 of the body
+    status_code  : Mapped[int | None] = mapped_column(Integer)                # None while in progress
+    response     : Mapped[str | None] = mapped_column(Text)                   # JSON body
+    created_at   : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+
+# ── Schema versioning (see app.migrations) ────────────────────
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    version     : Mapped[int]      = mapped_column(Integer, primary_key=True, autoincrement=False)
+    description : Mapped[str]      = mapped_column(String(256), nullable=False)
+    applied_at  : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
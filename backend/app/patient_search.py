@@ -0,0 +1,215 @@
+"""
+patient_search.py — Indexed patient lookup by name or phone
+
+Backs GET /api/appointments/search so the front desk never has to pull the
+whole appointments table:
+
+  Postgres : pg_trgm GIN indexes on lower(patient_name) and on the phone
+             reduced to its digits; substring and word-prefix matches are
+             LIKE, misspellings fall back to word similarity (<%)
+  SQLite   : appointments_fts, an FTS5 table with the trigram tokenizer kept
+             in sync by triggers; substring matches only.  Its rows are found
+             by appointment id through appointments_fts_keys, never by
+             appointments.rowid, which VACUUM may renumber
+
+A query of phone characters with at least 3 digits searches phones; anything
+else searches names, every word having to appear.  Results rank word-prefix
+matches first, then substrings, then fuzzy matches (by similarity), newest
+appointment first within a rank.  Without pg_trgm or FTS5 trigram
+(SQLite < 3.34) the same query runs unindexed and without fuzzy matches.
+
+  python -m app.patient_search   # refill appointments_fts on SQLite shards
+"""
+
+import argparse
+import asyncio
+import logging
+import re
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import select, case, literal, literal_column, and_, or_, func, text, table, column, Float
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Appointment
+from app.shards import SHARDS, owns, scatter, shards_for
+
+log = logging.getLogger(__name__)
+
+_PG_DIGITS = "regexp_replace(coalesce(patient_phone, ''), '[^0-9]', '', 'g')"
+
+
+def _sqlite_digits(col: str) -> str:
+    expr = f"coalesce({col}, '')"
+    for ch in " -()+./":
+        expr = f"replace({expr}, '{ch}', '')"
+    return expr
+
+
+_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS appointments_fts "
+    "USING fts5(id UNINDEXED, patient_name, phone_digits, tokenize='trigram')",
+    # id → FTS rowid, so triggers find their row without scanning the
+    # UNINDEXED id column; an INTEGER PRIMARY KEY survives VACUUM, where the
+    # appointments rowid does not
+    "CREATE TABLE IF NOT EXISTS appointments_fts_keys "
+    "(fts_rowid INTEGER PRIMARY KEY, id VARCHAR(64) NOT NULL UNIQUE)",
+    f"""CREATE TRIGGER IF NOT EXISTS appointments_fts_ai AFTER INSERT ON appointments BEGIN
+          INSERT INTO appointments_fts_keys (id) VALUES (new.id);
+          INSERT INTO appointments_fts (rowid, id, patient_name, phone_digits)
+          VALUES ((SELECT fts_rowid FROM appointments_fts_keys WHERE id = new.id),
+                  new.id, new.patient_name, {_sqlite_digits('new.patient_phone')});
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS appointments_fts_ad AFTER DELETE ON appointments BEGIN
+          DELETE FROM appointments_fts
+          WHERE rowid = (SELECT fts_rowid FROM appointments_fts_keys WHERE id = old.id);
+          DELETE FROM appointments_fts_keys WHERE id = old.id;
+        END""",
+    f"""CREATE TRIGGER IF NOT EXISTS appointments_fts_au AFTER UPDATE OF patient_name, patient_phone ON appointments BEGIN
+          UPDATE appointments_fts SET patient_name = new.patient_name,
+                 phone_digits = {_sqlite_digits('new.patient_phone')}
+          WHERE rowid = (SELECT fts_rowid FROM appointments_fts_keys WHERE id = old.id);
+        END""",
+]
+
+_FTS_FILL = [
+    "INSERT INTO appointments_fts_keys (id) SELECT id FROM appointments",
+    "INSERT INTO appointments_fts (rowid, id, patient_name, phone_digits) "
+    f"SELECT k.fts_rowid, a.id, a.patient_name, {_sqlite_digits('a.patient_phone')} "
+    "FROM appointments a JOIN appointments_fts_keys k ON k.id = a.id",
+]
+
+
+# ── Indexes (migrations 6 and 9) ──────────────────────────────
+
+def install(conn: Connection) -> None:
+    """Create the search indexes for this shard's dialect; skipped when the extension/module is missing."""
+    if conn.dialect.name == "postgresql":
+        if not conn.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar():
+            log.warning("pg_trgm is not available — patient search runs unindexed")
+            return
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_appointments_name_trgm "
+                          "ON appointments USING gin (lower(patient_name) gin_trgm_ops)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_appointments_phone_trgm "
+                          f"ON appointments USING gin (({_PG_DIGITS}) gin_trgm_ops)"))
+    elif conn.dialect.name == "sqlite":
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'appointments_fts'")).scalar():
+            return
+        try:
+            conn.execute(text(_FTS_DDL[0]))
+        except Exception:
+            log.warning("FTS5 trigram tokenizer unavailable — patient search runs unindexed")
+            return
+        for sql in _FTS_DDL[1:] + _FTS_FILL:
+            conn.execute(text(sql))
+
+
+def rekey(conn: Connection) -> None:
+    """Migration 9: rebuild an appointments_fts whose triggers matched on appointments.rowid."""
+    if conn.dialect.name != "sqlite":
+        return
+    exists = "SELECT 1 FROM sqlite_master WHERE name = :name"
+    if (not conn.execute(text(exists), {"name": "appointments_fts"}).scalar()
+            or conn.execute(text(exists), {"name": "appointments_fts_keys"}).scalar()):
+        return
+    for trigger in ("appointments_fts_ai", "appointments_fts_ad", "appointments_fts_au"):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+    conn.execute(text("DROP TABLE appointments_fts"))
+    install(conn)
+
+
+# ── Search ────────────────────────────────────────────────────
+
+_fts = table("appointments_fts", column("id"), column("patient_name"), column("phone_digits"))
+_PHONE_QUERY = re.compile(r"^[\d\s()+./\-]+$")
+_indexed: dict[str, bool] = {}     # engine URL → pg_trgm installed / appointments_fts present
+
+
+async def _has_index(db: AsyncSession) -> bool:
+    bind = db.get_bind()
+    key = str(bind.url)
+    if key not in _indexed:
+        probe = ("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'" if bind.dialect.name == "postgresql"
+                 else "SELECT 1 FROM sqlite_master WHERE name = 'appointments_fts'")
+        _indexed[key] = bool(await db.scalar(text(probe)))
+    return _indexed[key]
+
+
+async def _shard_query(db: AsyncSession, q: str, filters: list, limit: int):
+    pg = db.get_bind().dialect.name == "postgresql"
+    indexed = await _has_index(db)
+    query = select(Appointment)
+    if not pg and indexed:
+        query = query.join(_fts, _fts.c.id == Appointment.id)
+        name, digits = _fts.c.patient_name, _fts.c.phone_digits
+    else:
+        name = func.lower(Appointment.patient_name)
+        digits = literal_column(_PG_DIGITS if pg else _sqlite_digits("appointments.patient_phone"))
+    score = literal(0.0, Float)
+
+    phone = re.sub(r"\D", "", q)
+    if _PHONE_QUERY.match(q) and len(phone) >= 3:
+        match = digits.like(f"%{phone}%")
+        rank = case((digits.like(f"{phone}%"), 0), else_=1)
+    else:
+        # % and _ are never part of a name; dropping them keeps LIKE patterns literal
+        words = re.findall(r"[^\s%_\\]+", q.lower())
+        if not words:
+            return None
+        match = and_(*(name.like(f"%{w}%") for w in words))
+        rank = case((or_(name.like(f"{words[0]}%"), name.like(f"% {words[0]}%")), 0), (match, 1), else_=2)
+        if pg and indexed:
+            phrase = " ".join(words)
+            match = or_(match, literal(phrase).op("<%")(name))
+            score = func.word_similarity(phrase, name)
+
+    return (
+        query.add_columns(rank.label("rank"), score.label("score"))
+        .where(match, *filters)
+        .order_by(rank, score.desc(), Appointment.date.desc(), Appointment.id)
+        .limit(limit)
+    )
+
+
+async def search(q: str, clinic_id: Optional[str] = None, status: Optional[str] = None,
+                 limit: int = 20, offset: int = 0) -> tuple[list[Appointment], bool]:
+    """One page of appointments matching `q`, and whether there are more."""
+    filters = []
+    if clinic_id:
+        filters.append(Appointment.clinic_id == clinic_id)
+    if status:
+        filters.append(Appointment.status == status)
+    clinic_ids = [clinic_id] if clinic_id else None
+
+    async def run(db: AsyncSession) -> list:
+        query = await _shard_query(db, q.strip(), filters, offset + limit + 1)
+        return list((await db.execute(query)).all()) if query is not None else []
+
+    rows = [r for shard, part in zip(shards_for(clinic_ids), await scatter(run, clinic_ids))
+            for r in part if owns(shard, r[0].clinic_id)]
+    rows.sort(key=lambda r: (r.rank, -r.score, -date.fromisoformat(r[0].date).toordinal(), r[0].id))
+    page = rows[offset:offset + limit]
+    return [r[0] for r in page], len(rows) > offset + limit
+
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description="Refill appointments_fts on SQLite shards").parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        from app.shards import all_engines
+        for shard in SHARDS.values():
+            if shard.engine.dialect.name != "sqlite":
+                continue
+            async with shard.engine.begin() as conn:
+                await conn.execute(text("DELETE FROM appointments_fts"))
+                await conn.execute(text("DELETE FROM appointments_fts_keys"))
+                for sql in _FTS_FILL:
+                    await conn.execute(text(sql))
+            print(f"rebuilt appointments_fts on {shard.name}")
+        for e in all_engines():
+            await e.dispose()
+
+    asyncio.run(_main())
@@ -0,0 +1,137 @@
+"""
+retention.py — Archival and compaction of chat history
+
+Sessions with no activity for CHAT_RETENTION_DAYS are moved out of the hot
+chat_sessions / chat_messages tables in batches: a one-row summary goes to
+chat_sessions_archive, the messages are copied to chat_messages_archive
+(unless CHAT_ARCHIVE_MODE=summary) and the originals are deleted.
+
+Environment variables:
+  CHAT_RETENTION_DAYS        : inactivity age before archival; 0 disables  (default: 0)
+  CHAT_ARCHIVE_MODE          : archive | summary                           (default: archive)
+  CHAT_COMPACTION_BATCH      : sessions per transaction                    (default: 500)
+  CHAT_COMPACTION_INTERVAL_S : seconds between background runs             (default: 3600)
+
+  python -m app.retention --days 90        # one-off run
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, delete, func, exists, and_, literal, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+from app.models import ChatSession, ChatMessage, ChatSessionArchive, ChatMessageArchive
+
+log = logging.getLogger(__name__)
+
+RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", "0"))
+ARCHIVE_MODE   = os.getenv("CHAT_ARCHIVE_MODE", "archive").lower()
+BATCH_SIZE     = int(os.getenv("CHAT_COMPACTION_BATCH", "500"))
+INTERVAL_S     = float(os.getenv("CHAT_COMPACTION_INTERVAL_S", "3600"))
+
+
+async def _compact_batch(db: AsyncSession, cutoff: datetime, batch_size: int, keep_messages: bool) -> int:
+    recent = exists().where(and_(
+        ChatMessage.session_id == ChatSession.id,
+        ChatMessage.created_at >= cutoff,
+    ))
+    ids = (await db.execute(
+        select(ChatSession.id)
+        .where(ChatSession.started_at < cutoff, ~recent)
+        .limit(batch_size)
+    )).scalars().all()
+    if not ids:
+        return 0
+
+    stats = select(
+        ChatMessage.session_id,
+        func.count().label("n"),
+        func.max(ChatMessage.created_at).label("last_at"),
+    ).where(ChatMessage.session_id.in_(ids)).group_by(ChatMessage.session_id).subquery()
+
+    await db.execute(insert(ChatSessionArchive).from_select(
+        ["id", "patient_name", "started_at", "ended_at", "message_count", "last_message_at", "meta_json", "archived_at"],
+        select(
+            ChatSession.id, ChatSession.patient_name, ChatSession.started_at, ChatSession.ended_at,
+            func.coalesce(stats.c.n, 0), stats.c.last_at, ChatSession.meta_json,
+            literal(datetime.utcnow(), DateTime),
+        )
+        .outerjoin(stats, stats.c.session_id == ChatSession.id)
+        .where(ChatSession.id.in_(ids))
+    ))
+    if keep_messages:
+        await db.execute(insert(ChatMessageArchive).from_select(
+            ["id", "session_id", "role", "content", "created_at"],
+            select(ChatMessage.id, ChatMessage.session_id, ChatMessage.role,
+                   ChatMessage.content, ChatMessage.created_at)
+            .where(ChatMessage.session_id.in_(ids))
+        ))
+    await db.execute(delete(ChatMessage).where(ChatMessage.session_id.in_(ids)))
+    await db.execute(delete(ChatSession).where(ChatSession.id.in_(ids)))
+    await db.commit()
+    return len(ids)
+
+
+async def compact_chat_history(days: int = RETENTION_DAYS, batch_size: int = BATCH_SIZE,
+                               mode: str = ARCHIVE_MODE) -> int:
+    """Archive every session idle for `days`; returns the number of sessions moved."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            n = await _compact_batch(db, cutoff, batch_size, keep_messages=(mode != "summary"))
+        total += n
+        if n < batch_size:
+            break
+        await asyncio.sleep(0)   # let request handlers in between batches
+    if total:
+        log.info("archived %d chat sessions idle since %s", total, cutoff.isoformat())
+    return total
+
+
+class CompactionJob:
+    """Runs compact_chat_history every INTERVAL_S seconds while the app is up."""
+
+    def __init__(self, days: int, interval_s: float):
+        self.days = days
+        self.interval = interval_s
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await compact_chat_history(self.days)
+            except Exception:
+                log.exception("chat history compaction failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.days > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+compaction_job = CompactionJob(RETENTION_DAYS, INTERVAL_S)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive idle chat sessions")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS or 90)
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--mode", choices=["archive", "summary"], default=ARCHIVE_MODE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(compact_chat_history(args.days, args.batch, args.mode)))
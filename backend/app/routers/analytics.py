@@ -0,0 +1,194 @@
+"""routers/analytics.py — Capacity and utilization heatmaps (NumPy)"""
+
+import json
+from datetime import date, timedelta
+from typing import TYPE_CHECKING, Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
+
+from app.models import Appointment, Job
+from app.schemas import ExportQueued
+from app.data_model import CLINICS, DOCTORS
+from app.shards import owns, scatter, session_for, shards_for
+
+if TYPE_CHECKING:
+    import numpy as np
+
+router = APIRouter()
+
+BUCKET_MINS = 15
+DAY_START   = min(a["start_hour"] for d in DOCTORS for a in d["availability"]) * 60
+DAY_END     = max(a["end_hour"]   for d in DOCTORS for a in d["availability"]) * 60
+N_BUCKETS   = (DAY_END - DAY_START) // BUCKET_MINS
+
+
+def _resources(clinic_ids: list[str]) -> tuple[list[dict], "np.ndarray"]:
+    """
+    Resource list (rooms, doctors, clinics) and their weekly capacity
+    templates, shape (R, 7, N_BUCKETS) indexed by our day-of-week (0=Sun).
+    Rooms are open whenever a doctor is rostered at their clinic; a clinic's
+    capacity is the sum of its rooms'.
+    """
+    import numpy as np
+    staffed = {cid: np.zeros((7, N_BUCKETS), dtype=np.int16) for cid in clinic_ids}
+    doctors = []
+    for doc in DOCTORS:
+        tmpl = np.zeros((7, N_BUCKETS), dtype=np.int16)
+        for a in doc["availability"]:
+            if a["clinic_id"] not in staffed:
+                continue
+            lo = (a["start_hour"] * 60 - DAY_START) // BUCKET_MINS
+            hi = (a["end_hour"]   * 60 - DAY_START) // BUCKET_MINS
+            tmpl[a["days"], lo:hi] = 1
+            staffed[a["clinic_id"]][a["days"], lo:hi] = 1
+        if tmpl.any():
+            doctors.append(({"id": doc["id"], "kind": "doctor", "clinic_id": None}, tmpl))
+
+    rooms, clinics = [], []
+    for clinic in CLINICS:
+        if clinic["id"] not in staffed:
+            continue
+        for room in clinic["rooms"]:
+            rooms.append(({"id": f"{clinic['id']}:{room['id']}", "kind": "room",
+                           "clinic_id": clinic["id"]}, staffed[clinic["id"]]))
+        clinics.append(({"id": clinic["id"], "kind": "clinic", "clinic_id": clinic["id"]},
+                        staffed[clinic["id"]] * len(clinic["rooms"])))
+
+    entries = rooms + doctors + clinics
+    return [e[0] for e in entries], np.stack([e[1] for e in entries])
+
+
+def build_utilization(rows: list, start: date, n_days: int, clinic_ids: list[str]) -> dict:
+    """Occupancy/capacity matrices (resource × day × 15-min bucket) reduced to a heatmap payload."""
+    import numpy as np     # only on first use: keeps it off the cold-start path
+    resources, templates = _resources(clinic_ids)
+    index = {(r["kind"], r["id"]): i for i, r in enumerate(resources)}
+    days = [start + timedelta(days=i) for i in range(n_days)]
+    dows = np.array([(d.weekday() + 1) % 7 for d in days])
+    capacity = templates[:, dows, :].astype(np.int32)                # (R, D, B)
+
+    # One (resource, day, first bucket, last bucket) span per resource touched by a booking
+    res_i, day_i, lo_i, hi_i = [], [], [], []
+    doctor_cache: dict[str, list] = {}
+    for r in rows:
+        d = (date.fromisoformat(r.date) - start).days
+        start_m = int(r.start_time[:2]) * 60 + int(r.start_time[3:5])
+        lo = max(0, (start_m - DAY_START) // BUCKET_MINS)
+        hi = min(N_BUCKETS, -(-(start_m + r.duration_mins - DAY_START) // BUCKET_MINS))
+        if not 0 <= d < n_days or hi <= lo:
+            continue
+        docs = doctor_cache.get(r.doctor_ids)
+        if docs is None:
+            docs = doctor_cache[r.doctor_ids] = json.loads(r.doctor_ids)
+        keys = [("room", f"{r.clinic_id}:{r.room_id}"), ("clinic", r.clinic_id)] + [("doctor", x) for x in docs]
+        for key in keys:
+            i = index.get(key)
+            if i is not None:
+                res_i.append(i); day_i.append(d); lo_i.append(lo); hi_i.append(hi)
+
+    # Difference array + cumulative sum paints every span in one vectorized pass
+    diff = np.zeros((len(resources), n_days, N_BUCKETS + 1), dtype=np.int32)
+    if res_i:
+        r_a, d_a = np.array(res_i), np.array(day_i)
+        np.add.at(diff, (r_a, d_a, np.array(lo_i)), 1)
+        np.add.at(diff, (r_a, d_a, np.array(hi_i)), -1)
+    occupancy = np.minimum(np.cumsum(diff, axis=2)[:, :, :N_BUCKETS], capacity)
+
+    cap_day = capacity.sum(axis=2) * BUCKET_MINS                     # (R, D) minutes
+    occ_day = occupancy.sum(axis=2) * BUCKET_MINS
+    per_hour = 60 // BUCKET_MINS
+    cap_hour = capacity.reshape(len(resources), n_days, -1, per_hour).sum(axis=3)
+    occ_hour = occupancy.reshape(len(resources), n_days, -1, per_hour).sum(axis=3)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        daily  = np.where(cap_day > 0, occ_day / cap_day, np.nan)
+        hourly = np.where(cap_hour.sum(axis=1) > 0, occ_hour.sum(axis=1) / cap_hour.sum(axis=1), np.nan)
+        util_hd = np.where(cap_hour > 0, occ_hour / cap_hour, -1.0)
+
+    flat = util_hd.reshape(len(resources), -1)
+    peak_idx = flat.argmax(axis=1)
+    peak_day, peak_hour = np.divmod(peak_idx, util_hd.shape[2])
+    cap_total, occ_total = cap_day.sum(axis=1), occ_day.sum(axis=1)
+
+    def _rounded(a: np.ndarray) -> list:
+        return np.where(np.isnan(a), None, np.round(a, 3)).tolist()
+
+    return {
+        "start"            : str(start),
+        "days"             : [str(d) for d in days],
+        "hours"            : [f"{(DAY_START // 60) + h:02d}:00" for h in range(N_BUCKETS // per_hour)],
+        "resources"        : resources,
+        "daily_utilization": _rounded(daily),            # [resource][day]
+        "hourly_profile"   : _rounded(hourly),           # [resource][hour of day], averaged over days
+        "capacity_minutes" : cap_total.tolist(),
+        "booked_minutes"   : occ_total.tolist(),
+        "idle_minutes"     : (cap_total - occ_total).tolist(),
+        "utilization"      : _rounded(np.where(cap_total > 0, occ_total / np.maximum(cap_total, 1), np.nan)),
+        "peak"             : [
+            {"date": str(days[pd]), "hour": f"{(DAY_START // 60) + ph:02d}:00", "utilization": round(float(flat[i, p]), 3)}
+            if flat[i, p] >= 0 else None
+            for i, (pd, ph, p) in enumerate(zip(peak_day.tolist(), peak_hour.tolist(), peak_idx.tolist()))
+        ],
+    }
+
+
+@router.get("/utilization")
+async def utilization(
+    start:     Optional[str] = Query(None, description="YYYY-MM-DD, default today"),
+    days:      int           = Query(90, ge=1, le=366),
+    clinic_id: Optional[str] = Query(None),
+):
+    try:
+        first = date.fromisoformat(start) if start else date.today()
+    except ValueError:
+        raise HTTPException(400, f"Invalid start date: {start}")
+    clinic_ids = [c["id"] for c in CLINICS if not clinic_id or c["id"] == clinic_id]
+    if not clinic_ids:
+        raise HTTPException(404, f"Unknown clinic: {clinic_id}")
+    last = first + timedelta(days=days - 1)
+
+    query = (
+        select(
+            Appointment.date, Appointment.start_time, Appointment.duration_mins,
+            Appointment.clinic_id, Appointment.room_id, Appointment.doctor_ids,
+        )
+        .where(
+            Appointment.date >= str(first),
+            Appointment.date <= str(last),
+            Appointment.clinic_id.in_(clinic_ids),
+            Appointment.status != "cancelled",
+        )
+    )
+
+    async def fetch(db: AsyncSession) -> list:
+        return list((await db.execute(query)).all())
+
+    parts = await scatter(fetch, clinic_ids)
+    rows = [r for shard, part in zip(shards_for(clinic_ids), parts) for r in part if owns(shard, r.clinic_id)]
+    return build_utilization(rows, first, days, clinic_ids)
+
+
+@router.post("/export", response_model=ExportQueued, status_code=202)
+async def export_appointments(
+    fmt: Literal["parquet", "arrow"] = Query("parquet", alias="format"),
+):
+    """Queue an incremental Parquet / Arrow export into EXPORT_DIR; a job worker runs it (see app.export)."""
+    from app import export
+    from app.jobs import enqueue, job_queue
+    try:
+        export.load_pyarrow()
+    except export.ExportUnavailable as e:
+        raise HTTPException(503, str(e))
+    async with session_for(None) as db:
+        queued = await db.scalar(
+            select(func.count()).select_from(Job)
+            .where(Job.kind == "export.appointments", Job.status.in_(("pending", "running")))
+        )
+        if not queued:
+            enqueue(db, "export.appointments", {"format": fmt})
+            await db.commit()
+    job_queue.wake()
+    return ExportQueued(status="already_queued" if queued else "queued", format=fmt,
+                        watermarks=export.horizons(export.load_watermarks()))
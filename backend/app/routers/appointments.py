@@ -2,24 +2,42 @@
 routers/appointments.py — CRUD for appointments with Cloud SQL
 """
 
+import base64
 import json
-from datetime import date, timedelta
-from typing import List, Optional
+import os
+from datetime import date, datetime, timedelta
+from typing import List, Literal, Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
+from sqlalchemy import select, func, and_, or_
 
-from app.database import get_db
 from app.models import Appointment
 from app.schemas import (
     AppointmentCreate, AppointmentOut, AppointmentStats,
-    AppointmentStatusUpdate,
+    AppointmentStatusUpdate, AppointmentSeriesCreate, AppointmentSeriesOut,
+    AppointmentChange, AppointmentChanges, AppointmentSearchOut, ColumnarAppointments,
 )
 from app.data_model import get_procedure, find_room_for_procedure
+from app.invalidation import bus, keys_for
+from app.schedule_hub import hub
+from app.booking import BookingConflict, book_appointments, expand_recurrence, lock_days, place_series, stage_refresh
+from app.jobs import enqueue
+from app.idempotency import idempotent
+from app.shards import SHARDED, owns, scatter, session_for, shard_for, shards_for
 
 router = APIRouter()
 
+# The change feed stops this far behind "now" so that transactions which
+# stamped updated_at but have not committed yet are rarely skipped, and a
+# caught-up cursor re-reads the last CHANGES_OVERLAP_MS so that the ones
+# which commit later still are not.  Writes lock their clinic-days before
+# stamping, so the stamp-to-commit gap is the transaction's own work; a
+# write that commits more than SETTLE + OVERLAP after its stamp is missed.
+CHANGES_SETTLE  = timedelta(milliseconds=int(os.getenv("CHANGES_SETTLE_MS", "2000")))
+CHANGES_OVERLAP = timedelta(milliseconds=int(os.getenv("CHANGES_OVERLAP_MS", "30000")))
+
 
 def model_to_out(appt: Appointment) -> AppointmentOut:
     d = {c.name: getattr(appt, c.name) for c in appt.__table__.columns}
@@ -27,44 +45,102 @@ def model_to_out(appt: Appointment) -> AppointmentOut:
     return AppointmentOut(**d)
 
 
+_PLAIN_COLUMNS = ("id", "patient_name", "patient_phone", "patient_email", "room_id",
+                  "date", "start_time", "duration_mins", "notes", "status")
+
+
+def to_columns(rows: list[Appointment]) -> dict:
+    """
+    ?format=columnar body (ColumnarAppointments): one array per field.  clinic_id, procedure_id and
+    doctor ids are indexes into `dicts`, so repeated values are sent once, and
+    doctor_ids is decoded once per distinct team instead of once per row.
+    """
+    dicts: dict[str, dict[str, int]] = {"clinic_id": {}, "procedure_id": {}, "doctor_id": {}}
+    teams: dict[str, list[int]] = {}
+    cols: dict[str, list] = {name: [] for name in _PLAIN_COLUMNS}
+    clinic, procedure, doctors, primary, created = [], [], [], [], []
+
+    def code(kind: str, value: str) -> int:
+        d = dicts[kind]
+        return d.setdefault(value, len(d))
+
+    for a in rows:
+        for name in _PLAIN_COLUMNS:
+            cols[name].append(getattr(a, name))
+        clinic.append(code("clinic_id", a.clinic_id))
+        procedure.append(code("procedure_id", a.procedure_id))
+        team = teams.get(a.doctor_ids)
+        if team is None:
+            team = teams[a.doctor_ids] = [code("doctor_id", d) for d in json.loads(a.doctor_ids or "[]")]
+        doctors.append(team)
+        primary.append(code("doctor_id", a.primary_doctor_id))
+        created.append(a.created_at.isoformat() if a.created_at else None)
+    cols.update(clinic_id=clinic, procedure_id=procedure, doctor_ids=doctors,
+                primary_doctor_id=primary, created_at=created)
+    return {"count": len(rows), "dicts": {k: list(d) for k, d in dicts.items()}, "columns": cols}
+
+
+async def gather_appointments(query, clinic_ids: Optional[list[str]] = None) -> list[Appointment]:
+    """Run an Appointment query on every shard (scatter-gather) and merge by date and time."""
+    async def run(db: AsyncSession) -> list[Appointment]:
+        return list((await db.execute(query)).scalars().all())
+
+    parts = await scatter(run, clinic_ids)
+    if not SHARDED:
+        return parts[0]
+    return sorted(
+        (a for shard, part in zip(shards_for(clinic_ids), parts) for a in part if owns(shard, a.clinic_id)),
+        key=lambda a: (a.date, a.start_time),
+    )
+
+
 @router.get("", response_model=List[AppointmentOut])
 async def list_appointments(
     status: str = Query("confirmed"),
-    db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(
+    rows = await gather_appointments(
         select(Appointment)
         .where(Appointment.status == status)
         .order_by(Appointment.date, Appointment.start_time)
     )
-    return [model_to_out(a) for a in result.scalars().all()]
+    return [model_to_out(a) for a in rows]
 
 
 @router.get("/stats", response_model=AppointmentStats)
-async def appointment_stats(db: AsyncSession = Depends(get_db)):
+async def appointment_stats():
     today     = str(date.today())
     week_start = str(date.today() - timedelta(days=date.today().weekday()))
     week_end   = str(date.today() + timedelta(days=6 - date.today().weekday()))
-
-    total     = (await db.execute(select(func.count()).select_from(Appointment).where(Appointment.status == "confirmed"))).scalar()
-    today_n   = (await db.execute(select(func.count()).select_from(Appointment).where(and_(Appointment.status == "confirmed", Appointment.date == today)))).scalar()
-    week_n    = (await db.execute(select(func.count()).select_from(Appointment).where(and_(Appointment.status == "confirmed", Appointment.date >= week_start, Appointment.date <= week_end)))).scalar()
-    completed = (await db.execute(select(func.count()).select_from(Appointment).where(Appointment.status == "completed"))).scalar()
-    cancelled = (await db.execute(select(func.count()).select_from(Appointment).where(Appointment.status == "cancelled"))).scalar()
-
+    confirmed = Appointment.status == "confirmed"
+
+    async def counts(db: AsyncSession) -> list:
+        # One pass per shard with filtered aggregates
+        return list((await db.execute(select(
+            Appointment.clinic_id,
+            func.count().filter(confirmed),
+            func.count().filter(and_(confirmed, Appointment.date == today)),
+            func.count().filter(and_(confirmed, Appointment.date >= week_start, Appointment.date <= week_end)),
+            func.count().filter(Appointment.status == "completed"),
+            func.count().filter(Appointment.status == "cancelled"),
+        ).group_by(Appointment.clinic_id))).all())
+
+    rows = [r[1:] for shard, part in zip(shards_for(), await scatter(counts))
+            for r in part if owns(shard, r[0])]
+    total, today_n, week_n, completed, cancelled = (sum(col) for col in zip(*rows)) if rows else (0,) * 5
     return AppointmentStats(
-        total=total or 0, today=today_n or 0, this_week=week_n or 0,
-        completed=completed or 0, cancelled=cancelled or 0,
+        total=total, today=today_n, this_week=week_n,
+        completed=completed, cancelled=cancelled,
     )
 
 
-@router.get("/week", response_model=List[AppointmentOut])
+@router.get("/week", response_model=Union[List[AppointmentOut], ColumnarAppointments])
 async def appointments_for_week(
     week_start: str = Query(...),
     week_end:   str = Query(...),
-    db: AsyncSession = Depends(get_db),
+    fmt:        Literal["rows", "columnar"] = Query("rows", alias="format"),
 ):
-    result = await db.execute(
+    """format=columnar returns to_columns() (ColumnarAppointments) instead of one object per appointment."""
+    rows = await gather_appointments(
         select(Appointment)
         .where(
             Appointment.date >= week_start,
@@ -73,21 +149,109 @@ async def appointments_for_week(
         )
         .order_by(Appointment.date, Appointment.start_time)
     )
-    return [model_to_out(a) for a in result.scalars().all()]
+    if fmt == "columnar":
+        return JSONResponse(to_columns(rows))
+    return [model_to_out(a) for a in rows]
+
+
+def _encode_cursor(updated_at: datetime, appt_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{updated_at.isoformat()}|{appt_id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        stamp, _, appt_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        return datetime.fromisoformat(stamp), appt_id
+    except ValueError:
+        raise HTTPException(400, "Invalid change cursor")
+
+
+@router.get("/changes", response_model=AppointmentChanges)
+async def appointment_changes(
+    since:     Optional[str] = Query(None, description="cursor from the previous call; omit to start"),
+    clinic_id: Optional[str] = Query(None),
+    limit:     int           = Query(500, ge=1, le=5000),
+):
+    """
+    Rows created, updated or cancelled after `since`, oldest first, keyset-
+    paginated on (updated_at, id) via ix_appointments_updated; each shard
+    returns its first limit+1 and the merge keeps the overall first.  Without
+    `since` no rows are returned, only a starting cursor: take it before the
+    initial full load, then poll with it.  Once caught up the cursor trails by
+    CHANGES_OVERLAP_MS, so a change can be delivered more than once: apply
+    changes keyed by (id, updated_at).
+    """
+    horizon = datetime.utcnow() - CHANGES_SETTLE
+    if since is None:
+        return AppointmentChanges(changes=[], cursor=_encode_cursor(horizon, ""), has_more=False)
+    after, after_id = _decode_cursor(since)
+
+    query = (
+        select(Appointment)
+        .where(
+            or_(Appointment.updated_at > after,
+                and_(Appointment.updated_at == after, Appointment.id > after_id)),
+            Appointment.updated_at < horizon,
+        )
+        .order_by(Appointment.updated_at, Appointment.id)
+        .limit(limit + 1)
+    )
+    if clinic_id:
+        query = query.where(Appointment.clinic_id == clinic_id)
+    rows = await gather_appointments(query, [clinic_id] if clinic_id else None)
+    rows.sort(key=lambda a: (a.updated_at, a.id))
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changes = []
+    for a in rows:
+        if a.status == "cancelled":
+            kind = "cancelled"
+        elif a.created_at is not None and a.created_at > after:
+            kind = "created"
+        else:
+            kind = "updated"
+        changes.append(AppointmentChange(**model_to_out(a).model_dump(), change=kind, updated_at=a.updated_at))
+    # Caught up: re-read the overlap next time for writes that commit late
+    cursor = _encode_cursor(rows[-1].updated_at, rows[-1].id) if has_more else \
+        _encode_cursor(horizon - CHANGES_OVERLAP, "")
+    return AppointmentChanges(changes=changes, cursor=cursor, has_more=has_more)
+
+
+@router.get("/search", response_model=AppointmentSearchOut)
+async def search_appointments(
+    q:         str           = Query(..., min_length=2, description="patient name words or phone digits"),
+    clinic_id: Optional[str] = Query(None),
+    status:    Optional[str] = Query(None),
+    limit:     int           = Query(20, ge=1, le=100),
+    offset:    int           = Query(0, ge=0, le=1000),
+):
+    """Patient lookup by name or phone through the search indexes (see app.patient_search)."""
+    from app.patient_search import search
+    rows, has_more = await search(q, clinic_id, status, limit, offset)
+    return AppointmentSearchOut(results=[model_to_out(a) for a in rows], has_more=has_more)
 
 
 @router.get("/date/{dt}", response_model=List[AppointmentOut])
-async def appointments_for_date(dt: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
+async def appointments_for_date(dt: str):
+    rows = await gather_appointments(
         select(Appointment)
         .where(Appointment.date == dt, Appointment.status != "cancelled")
         .order_by(Appointment.start_time)
     )
-    return [model_to_out(a) for a in result.scalars().all()]
+    return [model_to_out(a) for a in rows]
 
 
 @router.post("", response_model=AppointmentOut, status_code=201)
-async def create_appointment(body: AppointmentCreate, db: AsyncSession = Depends(get_db)):
+async def create_appointment(
+    body: AppointmentCreate,
+    idempotency_key: Optional[str] = Header(None, max_length=128),
+):
+    """A retry carrying the same Idempotency-Key gets the original response back (see app.idempotency)."""
+    return await idempotent("appointments.create", idempotency_key, body, lambda: _create_appointment(body))
+
+
+async def _create_appointment(body: AppointmentCreate) -> AppointmentOut:
     proc = get_procedure(body.procedure_id)
     if not proc:
         raise HTTPException(400, f"Unknown procedure: {body.procedure_id}")
@@ -110,43 +274,165 @@ async def create_appointment(body: AppointmentCreate, db: AsyncSession = Depends
         notes=body.notes,
         status=body.status or "confirmed",
     )
-    db.add(appt)
-    await db.commit()
-    await db.refresh(appt)
+    async with session_for(body.clinic_id) as db:
+        await lock_days(db, [(body.clinic_id, body.date)])
+        db.add(appt)
+        await stage_refresh(db, [appt])
+        await db.commit()
+        await db.refresh(appt)
+    await bus.publish(keys_for([appt]))
+    hub.publish([appt])
     return model_to_out(appt)
 
 
+@router.post("/series", response_model=AppointmentSeriesOut, status_code=201)
+async def create_series(body: AppointmentSeriesCreate):
+    """
+    Book every occurrence of a recurrence rule in one transaction: one query
+    loads the affected clinic-days, clashes are resolved in memory per
+    `on_conflict` and the series is inserted with a single multi-row INSERT.
+    """
+    proc = get_procedure(body.procedure_id)
+    if not proc:
+        raise HTTPException(400, f"Unknown procedure: {body.procedure_id}")
+    room = find_room_for_procedure(body.clinic_id, body.procedure_id)
+    if not room:
+        raise HTTPException(400, f"Clinic {body.clinic_id} cannot handle {body.procedure_id}")
+    rule = body.recurrence
+    if not rule.count and not rule.until:
+        raise HTTPException(400, "Recurrence needs count or until")
+    try:
+        first = date.fromisoformat(body.date)
+        until = date.fromisoformat(rule.until) if rule.until else None
+    except ValueError:
+        raise HTTPException(400, "Dates must be YYYY-MM-DD")
+
+    items = [
+        dict(
+            procedure_id=body.procedure_id,
+            patient_name=body.patient_name,
+            patient_phone=body.patient_phone,
+            patient_email=body.patient_email,
+            clinic_id=body.clinic_id,
+            room_id=room["id"],
+            date=str(d),
+            start_time=body.start_time,
+            duration_mins=proc["duration"],
+            doctor_ids=json.dumps(body.doctor_ids),
+            primary_doctor_id=body.primary_doctor_id,
+            notes=body.notes,
+            status=body.status or "confirmed",
+        )
+        for d in expand_recurrence(first, rule.freq, rule.interval, rule.count, until)
+    ]
+    if not items:
+        raise HTTPException(400, "Recurrence produces no occurrences")
+
+    adjusted: list[dict] = []
+
+    def resolve(items: list[dict], booked: dict) -> list[dict]:
+        placed, changes = place_series(items, booked, body.on_conflict, body.shift_window_mins)
+        adjusted.extend(changes)
+        return placed
+
+    try:
+        async with session_for(body.clinic_id) as db:
+            created = await book_appointments(db, items, resolve=resolve)
+    except BookingConflict as e:
+        raise HTTPException(409, e.detail)
+    await bus.publish(keys_for(created))
+    hub.publish(created)
+    return AppointmentSeriesOut(appointments=[model_to_out(a) for a in created], adjusted=adjusted)
+
+
+async def _appointment_shard_session(appt_id: str) -> AsyncSession:
+    """A session on the shard holding `appt_id`, or 404.  Ids carry no clinic, so ask every shard."""
+    if not SHARDED:
+        return session_for(None)      # the caller's own lookup 404s
+
+    async def owner(db: AsyncSession) -> Optional[str]:
+        return await db.scalar(select(Appointment.clinic_id).where(Appointment.id == appt_id))
+
+    clinic_id = next((c for shard, c in zip(shards_for(), await scatter(owner))
+                      if c is not None and owns(shard, c)), None)
+    if clinic_id is None:
+        raise HTTPException(404, "Appointment not found")
+    return session_for(clinic_id)
+
+
+def freed_slot(appt: Appointment, was_held: bool = False) -> dict:
+    return {
+        "clinic_id": appt.clinic_id, "room_id": appt.room_id, "date": appt.date,
+        "start_time": appt.start_time, "duration_mins": appt.duration_mins,
+        "doctor_ids": json.loads(appt.doctor_ids),
+        "held_appointment_id": appt.id if was_held else None,
+    }
+
+
 @router.patch("/{appt_id}/status", response_model=AppointmentOut)
 async def update_status(
     appt_id: str,
     body: AppointmentStatusUpdate,
-    db: AsyncSession = Depends(get_db),
 ):
-    appt = await db.get(Appointment, appt_id)
-    if not appt:
-        raise HTTPException(404, "Appointment not found")
-    appt.status = body.status
-    await db.commit()
-    await db.refresh(appt)
+    async with await _appointment_shard_session(appt_id) as db:
+        appt = await db.get(Appointment, appt_id, with_for_update=True)
+        if not appt:
+            raise HTTPException(404, "Appointment not found")
+        await lock_days(db, keys_for([appt]))
+        was_live, was_held = appt.status != "cancelled", appt.status == "held"
+        appt.status = body.status
+        await stage_refresh(db, [appt])
+        if was_live and appt.status == "cancelled":
+            enqueue(db, "waitlist.fill", freed_slot(appt, was_held))
+        await db.commit()
+        await db.refresh(appt)
+    await bus.publish(keys_for([appt]))
+    hub.publish([appt])
     return model_to_out(appt)
 
 
 @router.delete("/{appt_id}")
-async def cancel_appointment(appt_id: str, db: AsyncSession = Depends(get_db)):
-    appt = await db.get(Appointment, appt_id)
-    if not appt:
-        raise HTTPException(404, "Appointment not found")
-    appt.status = "cancelled"
-    await db.commit()
+async def cancel_appointment(appt_id: str):
+    async with await _appointment_shard_session(appt_id) as db:
+        appt = await db.get(Appointment, appt_id, with_for_update=True)
+        if not appt:
+            raise HTTPException(404, "Appointment not found")
+        await lock_days(db, keys_for([appt]))
+        was_live, was_held = appt.status != "cancelled", appt.status == "held"
+        appt.status = "cancelled"
+        await stage_refresh(db, [appt])
+        if was_live:
+            # Offer the freed interval to the waitlist once the cancellation commits
+            enqueue(db, "waitlist.fill", freed_slot(appt, was_held))
+        await db.commit()
+    await bus.publish(keys_for([appt]))
+    hub.publish([appt])
     return {"ok": True}
 
 
 @router.post("/bulk", response_model=dict, status_code=201)
-async def bulk_import_appointments(body: List[dict], db: AsyncSession = Depends(get_db)):
-    from datetime import datetime
+async def bulk_import_appointments(body: List[dict]):
+    # Each shard imports its own clinics' rows in its own transaction
+    by_shard: dict[str, list[dict]] = {}
+    for item in body:
+        by_shard.setdefault(shard_for(item.get("clinic_id")).name, []).append(item)
+    imported = skipped = 0
+    added: list[Appointment] = []
+    for items in by_shard.values():
+        async with session_for(items[0].get("clinic_id")) as db:
+            i, s, a = await _bulk_import(db, items)
+        imported, skipped = imported + i, skipped + s
+        added.extend(a)
+    await bus.publish(keys_for(added))
+    hub.publish(added)
+    return {"ok": True, "imported": imported, "skipped": skipped}
+
+
+async def _bulk_import(db: AsyncSession, body: List[dict]) -> tuple[int, int, list[Appointment]]:
     from app.routers.slots import _has_conflict, time_to_mins
     
-    # Pre-fetch existing bookings for collision detection
+    # Lock the days before any row is added (and stamped), then pre-fetch existing bookings for collision detection
+    await lock_days(db, keys_for(body))
     dates = list(set([item.get("date") for item in body if item.get("date")]))
     if dates:
         existing_rows = await db.execute(
@@ -168,6 +454,7 @@ async def bulk_import_appointments(body: List[dict], db: AsyncSession = Depends(
 
     imported = 0
     skipped = 0
+    added = []
     
     for item in body:
         item_id = item.get("id")
@@ -232,9 +519,11 @@ async def bulk_import_appointments(body: List[dict], db: AsyncSession = Depends(
         })
 
         db.add(appt)
+        added.append(appt)
         imported += 1
     
+    await stage_refresh(db, added)
     await db.commit()
-    return {"ok": True, "imported": imported, "skipped": skipped}
+    return imported, skipped, added
 
 
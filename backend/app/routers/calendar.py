@@ -0,0 +1,222 @@
+"""
+routers/calendar.py — Streaming iCalendar feeds per doctor, room and clinic
+
+  GET /api/calendar/doctor/{doctor_id}.ics
+  GET /api/calendar/room/{clinic_id}:{room_id}.ics
+  GET /api/calendar/clinic/{clinic_id}.ics
+
+Events are read through a server-side cursor (yield_per) in a session owned
+by the response generator and written out in ~64 KB chunks, so memory stays
+constant however many years the feed covers.  Last-Modified is the newest
+updated_at in the feed and If-Modified-Since short-circuits to 304 with a
+single aggregate query.  Cancelled appointments are kept as
+STATUS:CANCELLED so subscribed calendars drop them.  Times are floating
+(clinic-local), as stored.  Room and clinic feeds read only their clinic's
+shard; a doctor feed walks the shards one after another.
+
+A doctor feed is an index range on (primary_doctor_id, date).  An
+anesthetist is never the primary doctor, so their feed reads the ranges of
+the surgeons they can be paired with and keeps the rows whose doctor_ids
+name them.
+"""
+
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterator, Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, or_
+
+from app.models import Appointment
+from app.data_model import PROCEDURES, get_clinic, get_doctor, get_procedure
+from app.shards import Shard, owns, scatter, shards_for
+
+router = APIRouter()
+
+_YIELD_PER = 1000
+_FLUSH     = 64 * 1024
+_PRODID    = "-//MedDent//Booking API 2.0//EN"
+
+
+def _escape(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace(";", "\\;")
+                 .replace(",", "\\,").replace("\n", "\\n"))
+
+
+def _fold(line: str) -> str:
+    """RFC 5545 line folding at 75 octets."""
+    raw = line.encode()
+    if len(raw) <= 75:
+        return line + "\r\n"
+    parts, start = [], 0
+    while start < len(raw):
+        end = min(start + (75 if not parts else 74), len(raw))
+        while end < len(raw) and (raw[end] & 0xC0) == 0x80:   # never split a UTF-8 sequence
+            end -= 1
+        parts.append(raw[start:end].decode())
+        start = end
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _stamp(dt: Optional[datetime]) -> str:
+    return (dt or datetime.utcnow()).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _vevent(row) -> str:
+    y, m, d = row.date.split("-")
+    h, mi = row.start_time.split(":")
+    start = int(h) * 60 + int(mi)
+    end = start + row.duration_mins
+    proc = get_procedure(row.procedure_id)
+    clinic = get_clinic(row.clinic_id)
+    doctor = get_doctor(row.primary_doctor_id)
+    summary = f"{proc['name'] if proc else row.procedure_id} — {row.patient_name}"
+    description = f"{doctor['name'] if doctor else row.primary_doctor_id}"
+    if row.notes:
+        description += f"\n{row.notes}"
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{row.id}@meddent",
+        f"DTSTAMP:{_stamp(row.updated_at)}",
+        f"LAST-MODIFIED:{_stamp(row.updated_at)}",
+        f"DTSTART:{y}{m}{d}T{start // 60:02d}{start % 60:02d}00",
+        f"DTEND:{y}{m}{d}T{end // 60:02d}{end % 60:02d}00",
+        f"SUMMARY:{_escape(summary)}",
+        f"LOCATION:{_escape((clinic['name'] if clinic else row.clinic_id) + ' ' + row.room_id)}",
+        f"DESCRIPTION:{_escape(description)}",
+        f"STATUS:{'CANCELLED' if row.status == 'cancelled' else 'CONFIRMED'}",
+        "END:VEVENT",
+    ]
+    return "".join(_fold(line) for line in lines)
+
+
+def _leads(doctor_id: str) -> list[str]:
+    """Primary doctors of the appointments `doctor_id` can take part in: itself and whoever it assists."""
+    from app.free_slots import teams_for
+    leads = {doctor_id}
+    for proc in PROCEDURES:
+        leads.update(team[0] for team in teams_for(proc) if doctor_id in team[1:])
+    return sorted(leads)
+
+
+def _feed_filter(kind: str, ident: str) -> tuple[list, str, Optional[list[str]]]:
+    """WHERE clauses, calendar name and clinic ids (None = every shard) for a feed, or 404."""
+    if kind == "doctor":
+        doctor = get_doctor(ident)
+        if not doctor:
+            raise HTTPException(404, f"Unknown doctor: {ident}")
+        leads = _leads(ident)
+        if leads == [ident]:
+            return [Appointment.primary_doctor_id == ident], doctor["name"], None
+        # Residual check inside the indexed ranges of the surgeons it assists
+        return [Appointment.primary_doctor_id.in_(leads),
+                or_(Appointment.primary_doctor_id == ident,
+                    Appointment.doctor_ids.like(f'%"{ident}"%'))], doctor["name"], None
+    if kind == "room":
+        clinic_id, _, room_id = ident.partition(":")
+        clinic = get_clinic(clinic_id)
+        if not clinic or not any(r["id"] == room_id for r in clinic["rooms"]):
+            raise HTTPException(404, f"Unknown room: {ident} (expected clinic_id:room_id)")
+        return [Appointment.clinic_id == clinic_id, Appointment.room_id == room_id], \
+            f"{clinic['short_name']} {room_id}", [clinic_id]
+    clinic = get_clinic(ident)
+    if not clinic:
+        raise HTTPException(404, f"Unknown clinic: {ident}")
+    return [Appointment.clinic_id == ident], clinic["name"], [ident]
+
+
+async def _events(where: list, calname: str, shards: list[Shard]) -> AsyncIterator[bytes]:
+    # The request's sessions are closed before the body streams, so the
+    # generator owns its own session and cursor per shard for the whole response.
+    head = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{_PRODID}", "CALSCALE:GREGORIAN",
+            "METHOD:PUBLISH", f"X-WR-CALNAME:{_escape(calname)}"]
+    parts, size = [_fold(line) for line in head], 0
+    for shard in shards:
+        async with shard.session() as db:
+            result = await db.stream(
+                select(
+                    Appointment.id, Appointment.procedure_id, Appointment.patient_name,
+                    Appointment.clinic_id, Appointment.room_id, Appointment.date,
+                    Appointment.start_time, Appointment.duration_mins,
+                    Appointment.primary_doctor_id, Appointment.notes,
+                    Appointment.status, Appointment.updated_at,
+                )
+                .where(*where)
+                .order_by(Appointment.date, Appointment.start_time)
+                .execution_options(yield_per=_YIELD_PER)
+            )
+            async for row in result:
+                if not owns(shard, row.clinic_id):
+                    continue
+                event = _vevent(row)
+                parts.append(event)
+                size += len(event)
+                if size >= _FLUSH:
+                    yield "".join(parts).encode()
+                    parts, size = [], 0
+    parts.append("END:VCALENDAR\r\n")
+    yield "".join(parts).encode()
+
+
+async def _feed(kind: str, ident: str, request: Request, start: Optional[str],
+                end: Optional[str]) -> Response:
+    where, calname, clinic_ids = _feed_filter(kind, ident)
+    try:
+        if start:
+            where.append(Appointment.date >= str(date.fromisoformat(start)))
+        if end:
+            where.append(Appointment.date <= str(date.fromisoformat(end)))
+    except ValueError:
+        raise HTTPException(400, "start and end must be YYYY-MM-DD")
+
+    async def newest(db: AsyncSession) -> Optional[datetime]:
+        return (await db.execute(select(func.max(Appointment.updated_at)).where(*where))).scalar()
+
+    latest = max((t for t in await scatter(newest, clinic_ids) if t is not None), default=None)
+    headers = {"Cache-Control": "private, max-age=300"}
+    if latest is not None:
+        latest = latest.replace(microsecond=0, tzinfo=timezone.utc)
+        headers["Last-Modified"] = format_datetime(latest, usegmt=True)
+        since = request.headers.get("if-modified-since")
+        if since:
+            try:
+                if latest <= parsedate_to_datetime(since):
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+    filename = f"{kind}-{ident.replace(':', '-')}.ics"
+    headers["Content-Disposition"] = f'inline; filename="{filename}"'
+    return StreamingResponse(_events(where, calname, shards_for(clinic_ids)), media_type="text/calendar; charset=utf-8",
+                             headers=headers)
+
+
+@router.get("/doctor/{doctor_id}.ics")
+async def doctor_calendar(
+    doctor_id: str,
+    request: Request,
+    start: Optional[str] = Query(None, description="YYYY-MM-DD, default: no lower bound"),
+    end:   Optional[str] = Query(None, description="YYYY-MM-DD, default: no upper bound"),
+):
+    return await _feed("doctor", doctor_id, request, start, end)
+
+
+@router.get("/room/{room_key}.ics")
+async def room_calendar(
+    room_key: str,
+    request: Request,
+    start: Optional[str] = Query(None, description="YYYY-MM-DD, default: no lower bound"),
+    end:   Optional[str] = Query(None, description="YYYY-MM-DD, default: no upper bound"),
+):
+    return await _feed("room", room_key, request, start, end)
+
+
+@router.get("/clinic/{clinic_id}.ics")
+async def clinic_calendar(
+    clinic_id: str,
+    request: Request,
+    start: Optional[str] = Query(None, description="YYYY-MM-DD, default: no lower bound"),
+    end:   Optional[str] = Query(None, description="YYYY-MM-DD, default: no upper bound"),
+):
+    return await _feed("clinic", clinic_id, request, start, end)
@@ -1,19 +1,27 @@
-"""routers/chat.py — AI chat with Claude, session persistence in Cloud SQL"""
+"""routers/chat.py — AI chat via a pluggable LLM backend, session persistence in Cloud SQL"""
 
+import hashlib
 import json
 import os
 import re
 from datetime import date
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
-import google.generativeai as genai
-
 from app.database import get_db
-from app.models import Appointment, ChatSession, ChatMessage
+from app.models import Appointment
+from app.chat_store import save_turn, write_buffer
+from app.llm import get_llm, LLMNotConfigured
+from app.cache import TTLCache
+from app.metrics import record_llm, registry
+from app.booking import book_sharded, BookingConflict
+from app.idempotency import idempotent
+from app.shards import SHARDED, scatter
+from app.invalidation import bus, keys_for
+from app.schedule_hub import hub
 from app.schemas import (
     ChatRequest, ChatResponse, ConfirmBookingRequest,
     BookingRequest, AppointmentOut,
@@ -22,12 +30,11 @@ from app.data_model import (
     CLINICS, DOCTORS, PROCEDURES, DAY_NAMES,
     get_clinic, get_doctor, get_procedure, find_room_for_procedure,
 )
+from app.routers.appointments import model_to_out
 from app.routers.slots import _doctor_slots, _has_conflict, mins_to_time, time_to_mins
 
 router = APIRouter()
 
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
-
 
 # ── System prompt ─────────────────────────────────────────────
 
@@ -128,66 +135,102 @@ def strip_booking(text: str) -> str:
     return re.sub(r'\[BOOKING_REQUEST\].*?\[/BOOKING_REQUEST\]', '', text, flags=re.DOTALL).strip()
 
 
-# ── Chat endpoint ─────────────────────────────────────────────
+# ── Response cache ────────────────────────────────────────────
 
-@router.post("", response_model=ChatResponse)
-async def chat(body: ChatRequest, db: AsyncSession = Depends(get_db)):
-    if not GOOGLE_API_KEY:
-        raise HTTPException(503, "GOOGLE_API_KEY not configured")
+# Bump whenever build_system_prompt changes so cached replies are not reused
+PROMPT_VERSION = "1"
 
-    # Ensure session exists in DB
-    session = await db.get(ChatSession, body.session_id)
-    if not session:
-        session = ChatSession(id=body.session_id)
-        db.add(session)
-        await db.commit()
+response_cache = TTLCache(
+    maxsize=int(os.getenv("CHAT_CACHE_MAX", "1000")),
+    ttl=float(os.getenv("CHAT_CACHE_TTL_S", "3600")),
+)
 
-    # Fetch a brief snapshot of recent booked appointments for context
-    from sqlalchemy import select as sa_select
-    rows = await db.execute(
-        sa_select(Appointment)
-        .where(Appointment.status == "confirmed")
-        .order_by(Appointment.date)
-        .limit(20)
-    )
-    booked_summary = [
-        {"date": a.date, "time": a.start_time, "procedure": a.procedure_id,
-         "clinic": a.clinic_id, "doctor": a.primary_doctor_id}
-        for a in rows.scalars().all()
-    ]
+registry.register_collector(lambda: [
+    ("chat_response_cache_hits_total", "counter", "Chat replies served from cache", {}, response_cache.hits),
+    ("chat_response_cache_misses_total", "counter", "Chat replies that went to the LLM", {}, response_cache.misses),
+    ("chat_response_cache_entries", "gauge", "Cached chat replies", {}, len(response_cache)),
+])
 
-    # Save user message
-    last_msg = body.messages[-1] if body.messages else None
-    if last_msg and last_msg.role == "user" and last_msg.content != "Hello":
-        db.add(ChatMessage(session_id=body.session_id, role="user", content=last_msg.content))
-        await db.commit()
 
-    # Call Gemini
-    genai.configure(api_key=GOOGLE_API_KEY)
-    
-    # Format messages for Gemini
+def response_cache_key(messages: list[dict], booked_summary: list) -> str:
+    """
+    Hash of everything the prompt is built from: prompt version, today's date,
+    the booked-appointment snapshot and the history with whitespace collapsed.
+    Case is kept — "may" and "May" can mean different things to the model.
+    """
+    normalized = [(m["role"], " ".join(m["content"].split())) for m in messages]
+    raw = json.dumps([PROMPT_VERSION, str(date.today()), booked_summary, normalized],
+                     separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+# ── Chat endpoint ─────────────────────────────────────────────
+
+@router.post("", response_model=ChatResponse)
+async def chat(body: ChatRequest, db: AsyncSession = Depends(get_db)):
     api_messages = []
     for m in body.messages:
         stripped_content = strip_booking(m.content)
         if stripped_content:
             api_messages.append({
-                "role": "user" if m.role == "user" else "model",
-                "parts": [stripped_content]
+                "role": "user" if m.role == "user" else "assistant",
+                "content": stripped_content,
             })
 
-    model = genai.GenerativeModel(
-        model_name="gemini-3-flash-preview",
-        system_instruction=build_system_prompt(booked_summary)
-    )
-    
-    response = model.generate_content(
-        api_messages
+    # Fetch a brief snapshot of recent booked appointments for context
+    query = (
+        select(
+            Appointment.date, Appointment.start_time, Appointment.procedure_id,
+            Appointment.clinic_id, Appointment.primary_doctor_id,
+        )
+        .where(Appointment.status == "confirmed")
+        .order_by(Appointment.date, Appointment.start_time, Appointment.id)
+        .limit(20)
     )
-    ai_text = response.text
+    if SHARDED:
+        async def recent(shard_db: AsyncSession) -> list:
+            return list((await shard_db.execute(query)).all())
+        parts = await scatter(recent)
+        rows = sorted((r for p in parts for r in p), key=lambda r: (r.date, r.start_time))[:20]
+    else:
+        rows = (await db.execute(query)).all()
+    booked_summary = [
+        {"date": r.date, "time": r.start_time, "procedure": r.procedure_id,
+         "clinic": r.clinic_id, "doctor": r.primary_doctor_id}
+        for r in rows
+    ]
 
-    # Save assistant response
-    db.add(ChatMessage(session_id=body.session_id, role="assistant", content=ai_text))
-    await db.commit()
+    # Openings ("Hello") and exact repeats are answered from memory while the
+    # booked snapshot in the prompt is unchanged
+    cache_key = response_cache_key(api_messages, booked_summary)
+    ai_text = response_cache.get(cache_key)
+
+    if ai_text is None:
+        # Hand the connection back to the pool while we wait on the model
+        await db.close()
+
+        # Call the configured LLM backend
+        try:
+            llm = get_llm()
+            reply = await llm.generate(build_system_prompt(booked_summary), api_messages)
+        except LLMNotConfigured as e:
+            raise HTTPException(503, str(e))
+        record_llm(llm.name, reply.latency_ms, reply.prompt_tokens, reply.output_tokens)
+        ai_text = reply.text
+        # Booking blocks depend on live availability — never replay them
+        if "[BOOKING_REQUEST]" not in ai_text:
+            response_cache.set(cache_key, ai_text)
+
+    # Persist the whole turn (session, user message, reply) once the model has answered
+    last_msg = body.messages[-1] if body.messages else None
+    turn = []
+    if last_msg and last_msg.role == "user" and last_msg.content != "Hello":
+        turn.append(("user", last_msg.content))
+    turn.append(("assistant", ai_text))
+    if write_buffer.enabled:
+        write_buffer.enqueue(body.session_id, turn)
+    else:
+        await save_turn(db, body.session_id, turn)
 
     booking = parse_booking(ai_text)
     booking_obj = BookingRequest(**booking) if booking else None
@@ -202,8 +245,16 @@ async def chat(body: ChatRequest, db: AsyncSession = Depends(get_db)):
 # ── Confirm booking endpoint ──────────────────────────────────
 
 @router.post("/confirm", response_model=list[AppointmentOut], status_code=201)
-async def confirm_booking(body: ConfirmBookingRequest, db: AsyncSession = Depends(get_db)):
-    created = []
+async def confirm_booking(
+    body: ConfirmBookingRequest,
+    idempotency_key: Optional[str] = Header(None, max_length=128),
+):
+    """A retry carrying the same Idempotency-Key gets the original response back (see app.idempotency)."""
+    return await idempotent("chat.confirm", idempotency_key, body, lambda: _confirm_booking(body))
+
+
+async def _confirm_booking(body: ConfirmBookingRequest) -> list[AppointmentOut]:
+    items = []
     for appt_req in body.booking_request.appointments:
         proc = get_procedure(appt_req.procedure_id)
         if not proc:
@@ -212,7 +263,7 @@ async def confirm_booking(body: ConfirmBookingRequest, db: AsyncSession = Depend
         if not room:
             raise HTTPException(400, f"Clinic {appt_req.clinic_id} cannot handle {appt_req.procedure_id}")
 
-        appt = Appointment(
+        items.append(dict(
             procedure_id=appt_req.procedure_id,
             patient_name=body.booking_request.patient_name,
             patient_phone=body.booking_request.patient_phone,
@@ -225,14 +276,14 @@ async def confirm_booking(body: ConfirmBookingRequest, db: AsyncSession = Depend
             primary_doctor_id=appt_req.primary_doctor_id,
             notes=appt_req.notes,
             status="confirmed",
-        )
-        db.add(appt)
-        created.append(appt)
+        ))
 
-    await db.commit()
-    for a in created:
-        await db.refresh(a)
+    # All-or-nothing: clash-check every visit, then one multi-row INSERT ... RETURNING per shard
+    try:
+        created = await book_sharded(items)
+    except BookingConflict as e:
+        raise HTTPException(409, e.detail)
+    await bus.publish(keys_for(created))
+    hub.publish(created)
 
-    # Return as AppointmentOut
-    from app.routers.appointments import model_to_out
     return [model_to_out(a) for a in created]
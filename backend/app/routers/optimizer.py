@@ -0,0 +1,24 @@
+"""routers/optimizer.py — Schedule compaction plans (see app.schedule_optimizer)"""
+
+from datetime import date, timedelta
+
+from fastapi import APIRouter, HTTPException
+
+from app.data_model import get_clinic
+from app.schemas import CompactionPlan, CompactionRequest
+from app.schedule_optimizer import optimize
+
+router = APIRouter()
+
+
+@router.post("/compaction", response_model=CompactionPlan)
+async def compaction_plan(body: CompactionRequest):
+    """Propose moves that turn stranded free minutes into bookable blocks.  Read-only."""
+    try:
+        first = date.fromisoformat(body.start) if body.start else date.today() + timedelta(days=1)
+    except ValueError:
+        raise HTTPException(400, f"Invalid start date: {body.start}")
+    if body.clinic_id and not get_clinic(body.clinic_id):
+        raise HTTPException(404, f"Unknown clinic: {body.clinic_id}")
+    clinic_ids = [body.clinic_id] if body.clinic_id else None
+    return await optimize(first, body.days, clinic_ids, body.max_moves)
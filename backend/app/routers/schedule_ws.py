@@ -0,0 +1,91 @@
+"""
+routers/schedule_ws.py — /ws/schedule live schedule channel
+
+Client → server:
+  {"action": "subscribe",   "clinic_id": "downtown" | null, "start": "YYYY-MM-DD", "end": "YYYY-MM-DD"}
+  {"action": "unsubscribe", "clinic_id": ..., "start": ..., "end": ...}   (omit all three to clear)
+
+Server → client messages are described in app.schedule_hub.  A client loads
+its windows once over REST, then applies diffs instead of polling.  Only
+text frames are accepted; every reply goes through the connection's pump, so
+the socket has a single writer.
+"""
+
+import asyncio
+import json
+from datetime import date
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from app.schedule_hub import MAX_PENDING, Connection, Window, hub
+
+router = APIRouter()
+
+MAX_WINDOWS = 16
+MAX_DAYS    = 366
+
+
+def _window(msg: dict) -> Window:
+    start, end = date.fromisoformat(msg["start"]), date.fromisoformat(msg["end"])
+    if end < start or (end - start).days >= MAX_DAYS:
+        raise ValueError(f"date range must be 1–{MAX_DAYS} days")
+    return Window(msg.get("clinic_id") or None, str(start), str(end))
+
+
+@router.websocket("/ws/schedule")
+async def schedule_socket(websocket: WebSocket):
+    await websocket.accept()
+    conn = Connection(websocket)
+    hub.add(conn)
+    pump = asyncio.create_task(conn.pump())
+    close_code = None
+    try:
+        while True:
+            receive = asyncio.ensure_future(websocket.receive())
+            done, _ = await asyncio.wait({receive, pump}, return_when=asyncio.FIRST_COMPLETED)
+            if pump in done:
+                # Send failed or timed out: the client is gone or too slow
+                receive.cancel()
+                break
+            frame = receive.result()
+            if frame["type"] == "websocket.disconnect":
+                break
+            if len(conn.replies) >= MAX_PENDING:
+                close_code = 1008             # sending faster than it reads its replies
+                break
+            try:
+                if frame.get("text") is None:
+                    raise ValueError("binary frames are not supported")
+                msg = json.loads(frame["text"])
+                action = msg.get("action") if isinstance(msg, dict) else None
+                if action == "subscribe":
+                    if len(conn.windows) >= MAX_WINDOWS:
+                        raise ValueError(f"at most {MAX_WINDOWS} subscriptions per connection")
+                    conn.windows.add(_window(msg))
+                elif action == "unsubscribe":
+                    if "start" in msg:
+                        conn.windows.discard(_window(msg))
+                    else:
+                        conn.windows.clear()
+                else:
+                    raise ValueError(f"unknown action: {action!r}")
+            except (KeyError, ValueError) as e:
+                conn.reply({"type": "error", "detail": str(e)})
+                continue
+            conn.reply({
+                "type": "subscribed",
+                "subscriptions": [vars(w) for w in sorted(conn.windows, key=lambda w: (w.start, w.clinic_id or ""))],
+            })
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.remove(conn)
+        pump.cancel()
+        await asyncio.gather(pump, return_exceptions=True)    # never close mid-send
+        if not pump.cancelled() and pump.exception() is not None:
+            close_code = 1013                 # try again later
+        if close_code is not None:
+            try:
+                await websocket.close(code=close_code)
+            except RuntimeError:
+                pass
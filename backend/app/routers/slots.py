@@ -1,18 +1,15 @@
-"""routers/slots.py — Real-time slot finder"""
+"""routers/slots.py — Slot finder over the materialized free_slots table"""
 
+import heapq
 import json
 from datetime import date, timedelta
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from fastapi import APIRouter, Query
 
-from app.database import get_db
-from app.models import Appointment
 from app.schemas import SlotOut
 from app.data_model import (
-    CLINICS, DOCTORS, PROCEDURES,
+    CLINICS, DOCTORS,
     get_procedure, find_room_for_procedure,
 )
 
@@ -59,103 +56,134 @@ def _has_conflict(start_m: int, dur: int, clinic_id: str, room_id: str,
     return False
 
 
+# ── Ranked search ─────────────────────────────────────────────
+
+RANK_CHUNK_DAYS = 7
+
+
+def _leftovers(start: int, starts: set[int]) -> tuple[int, int]:
+    """
+    Free minutes left directly before and after a booking at `start`.  For
+    one team and room, start - 15 is a valid start exactly when the slot
+    before is free, and start + 15 when the slot after the booking is.
+    """
+    before = after = 0
+    while start - before - 15 in starts:
+        before += 15
+    while start + after + 15 in starts:
+        after += 15
+    return before, after
+
+
+async def _ranked(proc: dict, clinic_ids: list[str], preferred_clinic_id: Optional[str],
+                  preferred_time: Optional[str], days_ahead: int, k: int,
+                  w_earliest: float, w_clinic: float, w_time: float, w_gap: float) -> list[SlotOut]:
+    """
+    Best k starts over the whole horizon by weighted cost (lower is better):
+
+      w_earliest · days from today (fractional, so earlier in the day wins ties)
+      w_clinic   · 1 when not the preferred clinic
+      w_time     · hours away from preferred_time
+      w_gap      · hours of leftover gap before/after that is too short for
+                   another booking of this procedure
+
+    Every term is non-negative, so w_earliest · day_offset (+ the clinic
+    penalty) bounds a whole clinic-day from below.  Days are read in chunks
+    in date order into a bounded max-heap of k, and a chunk or clinic-day is
+    skipped once its bound cannot beat the current k-th best.
+    """
+    from app.free_slots import free_starts, teams_for
+
+    today = date.today()
+    pref_m = time_to_mins(preferred_time) if preferred_time else None
+    dur = proc["duration"]
+    clinic_order = {c["id"]: i for i, c in enumerate(CLINICS)}
+    team_order = {json.dumps(t): i for i, t in enumerate(teams_for(proc))}
+    heap: list[tuple] = []       # (-cost, -day, -start, -clinic, -team, row, start) — worst on top
+
+    for offset in range(0, days_ahead, RANK_CHUNK_DAYS):
+        if len(heap) >= k and w_earliest * offset >= -heap[0][0]:
+            break
+        rows = await free_starts(proc["id"], clinic_ids, today + timedelta(days=offset),
+                                 min(RANK_CHUNK_DAYS, days_ahead - offset))
+        groups: dict[tuple, tuple[dict, set[int]]] = {}
+        for r in rows:
+            groups.setdefault((r["date"], r["clinic_id"], r["doctor_ids"]), (r, set()))[1].add(
+                time_to_mins(r["start_time"]))
+        for (ds, cid, _), (row, starts) in sorted(groups.items()):
+            day_off = (date.fromisoformat(ds) - today).days
+            base = w_earliest * day_off + (w_clinic if preferred_clinic_id and cid != preferred_clinic_id else 0)
+            if len(heap) >= k and base >= -heap[0][0]:
+                continue
+            for start in starts:
+                gap = sum(g for g in _leftovers(start, starts) if 0 < g < dur)
+                cost = (base + w_earliest * start / 1440
+                        + (w_time * abs(start - pref_m) / 60 if pref_m is not None else 0)
+                        + w_gap * gap / 60)
+                entry = (-cost, -day_off, -start, -clinic_order[cid], -team_order[row["doctor_ids"]], row, start)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+
+    best = sorted(heap, reverse=True)
+    return [
+        SlotOut(
+            procedure_id=proc["id"], clinic_id=row["clinic_id"], room_id=row["room_id"],
+            date=row["date"], start_time=mins_to_time(start), duration_mins=row["duration_mins"],
+            doctor_ids=json.loads(row["doctor_ids"]), primary_doctor_id=row["primary_doctor_id"],
+            score=round(-neg_cost, 4),
+        )
+        for neg_cost, *_, row, start in best
+    ]
+
+
 @router.get("", response_model=List[SlotOut])
 async def find_slots(
     procedure_id:        str           = Query(...),
     preferred_clinic_id: Optional[str] = Query(None),
     days_ahead:          int           = Query(14, ge=1, le=60),
     max_results:         int           = Query(8,  ge=1, le=30),
-    db: AsyncSession = Depends(get_db),
+    mode:                Literal["first", "ranked"] = Query("first"),
+    preferred_time:      Optional[str] = Query(None, pattern=r"^\d{2}:\d{2}$", description="HH:MM, ranked mode"),
+    w_earliest:          float         = Query(1.0, ge=0, description="cost per day of waiting"),
+    w_clinic:            float         = Query(2.0, ge=0, description="cost of not the preferred clinic"),
+    w_time:              float         = Query(0.5, ge=0, description="cost per hour from preferred_time"),
+    w_gap:               float         = Query(1.0, ge=0, description="cost per hour of stranded gap"),
 ):
+    """
+    mode=first  : earliest start per doctor (or surgeon + anesthetist pair)
+                  per clinic per day; preferred_clinic_id filters.
+    mode=ranked : the k cheapest starts over the horizon by the weighted
+                  cost in _ranked(); preferred_clinic_id is a preference.
+    Both read the materialized free_slots table (see app.free_slots).
+    """
+    from app.free_slots import first_free
+
     proc = get_procedure(procedure_id)
     if not proc:
         return []
 
-    dur          = proc["duration"]
-    slots_needed = (dur + 14) // 15
-    today        = date.today()
-    end_day      = today + timedelta(days=days_ahead)
-
-    # Fetch all booked slots from DB in range
-    rows = await db.execute(
-        select(Appointment)
-        .where(
-            Appointment.date >= str(today),
-            Appointment.date <= str(end_day),
-            Appointment.status != "cancelled",
+    ranked = mode == "ranked"
+    clinics = [c for c in CLINICS
+               if (ranked or not preferred_clinic_id or c["id"] == preferred_clinic_id)
+               and find_room_for_procedure(c["id"], procedure_id)]
+    if not clinics:
+        return []
+    if ranked:
+        return await _ranked(proc, [c["id"] for c in clinics], preferred_clinic_id, preferred_time,
+                             days_ahead, max_results, w_earliest, w_clinic, w_time, w_gap)
+    rows = await first_free(procedure_id, [c["id"] for c in clinics], date.today(), days_ahead)
+
+    clinic_order = {c["id"]: i for i, c in enumerate(CLINICS)}
+    doctor_order = {d["id"]: i for i, d in enumerate(DOCTORS)}
+    rows.sort(key=lambda r: (r["date"], clinic_order[r["clinic_id"]],
+                             [doctor_order.get(d, 0) for d in json.loads(r["doctor_ids"])]))
+    return [
+        SlotOut(
+            procedure_id=procedure_id, clinic_id=r["clinic_id"], room_id=r["room_id"],
+            date=r["date"], start_time=r["start_time"], duration_mins=r["duration_mins"],
+            doctor_ids=json.loads(r["doctor_ids"]), primary_doctor_id=r["primary_doctor_id"],
         )
-    )
-    booked_appts = [
-        {
-            "date":         a.date,
-            "clinic_id":    a.clinic_id,
-            "room_id":      a.room_id,
-            "start_time":   a.start_time,
-            "duration_mins": a.duration_mins,
-            "doctor_ids":   a.doctor_ids,
-        }
-        for a in rows.scalars().all()
+        for r in rows[:max_results]
     ]
-
-    clinics = [c for c in CLINICS if not preferred_clinic_id or c["id"] == preferred_clinic_id]
-    results: list[SlotOut] = []
-
-    # day.weekday(): 0=Mon … 6=Sun; our avail uses 1=Mon … 5=Fri, 6=Sat, 0=Sun
-    _dow_map = {0: 1, 1: 2, 2: 3, 3: 4, 4: 5, 5: 6, 6: 0}
-
-    for day_off in range(days_ahead):
-        if len(results) >= max_results * 2:
-            break
-        check = today + timedelta(days=day_off)
-        ds    = str(check)
-        our_dow = _dow_map[check.weekday()]
-        day_booked = [b for b in booked_appts if b["date"] == ds]
-
-        for clinic in clinics:
-            room = find_room_for_procedure(clinic["id"], procedure_id)
-            if not room:
-                continue
-
-            if proc.get("requires_anesthetist"):
-                surgeons     = [d for d in DOCTORS if "oral_surgery"   in d["specializations"]]
-                anesthetists = [d for d in DOCTORS if "anesthesiology" in d["specializations"]]
-                for surg in surgeons:
-                    s_set = _doctor_slots(surg, clinic["id"], our_dow)
-                    for anes in anesthetists:
-                        a_set = _doctor_slots(anes, clinic["id"], our_dow)
-                        overlap = s_set & a_set
-                        for sm in sorted(overlap):
-                            if not all((sm + i*15) in overlap for i in range(slots_needed)):
-                                continue
-                            if _has_conflict(sm, dur, clinic["id"], room["id"],
-                                             [surg["id"], anes["id"]], day_booked):
-                                continue
-                            results.append(SlotOut(
-                                procedure_id=procedure_id, clinic_id=clinic["id"],
-                                room_id=room["id"], date=ds, start_time=mins_to_time(sm),
-                                duration_mins=dur, doctor_ids=[surg["id"], anes["id"]],
-                                primary_doctor_id=surg["id"],
-                            ))
-                            if len(results) >= max_results:
-                                return results
-                            break
-            else:
-                primary_spec = proc["required_specs"][0]
-                match_docs   = [d for d in DOCTORS if primary_spec in d["specializations"]]
-                for doctor in match_docs:
-                    d_slots = _doctor_slots(doctor, clinic["id"], our_dow)
-                    for sm in sorted(d_slots):
-                        if not all((sm + i*15) in d_slots for i in range(slots_needed)):
-                            continue
-                        if _has_conflict(sm, dur, clinic["id"], room["id"],
-                                         [doctor["id"]], day_booked):
-                            continue
-                        results.append(SlotOut(
-                            procedure_id=procedure_id, clinic_id=clinic["id"],
-                            room_id=room["id"], date=ds, start_time=mins_to_time(sm),
-                            duration_mins=dur, doctor_ids=[doctor["id"]],
-                            primary_doctor_id=doctor["id"],
-                        ))
-                        break  # one slot per doctor per day
-
-    return results[:max_results]
@@ -0,0 +1,50 @@
+"""routers/waitlist.py — Patients waiting for an earlier slot"""
+
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.database import get_db
+from app.models import WaitlistEntry
+from app.schemas import WaitlistCreate, WaitlistOut
+from app.data_model import get_procedure
+
+router = APIRouter()
+
+
+@router.get("", response_model=List[WaitlistOut])
+async def list_waitlist(
+    status: str = Query("waiting"),
+    db: AsyncSession = Depends(get_db),
+):
+    result = await db.execute(
+        select(WaitlistEntry)
+        .where(WaitlistEntry.status == status)
+        .order_by(WaitlistEntry.created_at)
+    )
+    return result.scalars().all()
+
+
+@router.post("", response_model=WaitlistOut, status_code=201)
+async def join_waitlist(body: WaitlistCreate, db: AsyncSession = Depends(get_db)):
+    if not get_procedure(body.procedure_id):
+        raise HTTPException(400, f"Unknown procedure: {body.procedure_id}")
+    if body.latest_date < body.earliest_date:
+        raise HTTPException(400, "latest_date is before earliest_date")
+    entry = WaitlistEntry(**body.model_dump())
+    db.add(entry)
+    await db.commit()
+    await db.refresh(entry)
+    return entry
+
+
+@router.delete("/{entry_id}")
+async def leave_waitlist(entry_id: str, db: AsyncSession = Depends(get_db)):
+    entry = await db.get(WaitlistEntry, entry_id)
+    if not entry:
+        raise HTTPException(404, "Waitlist entry not found")
+    entry.status = "removed"
+    await db.commit()
+    return {"ok": True}
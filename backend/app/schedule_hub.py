@@ -0,0 +1,173 @@
+"""
+schedule_hub.py — Fan-out of schedule changes to WebSocket subscribers
+
+Front-desk dashboards subscribe over /ws/schedule to (clinic, date range)
+windows.  Appointment writes call hub.publish(rows) after commit; the hub
+turns each row into a compact diff and queues it for every connection whose
+windows contain it.  Nothing is read from the database per viewer.
+
+Each connection has one sender task, the only writer to its socket (replies
+to the client's own messages are queued to it too), and a pending map keyed
+by appointment id, so several writes to the same appointment before the socket drains
+coalesce into one entry.  If a client falls SCHEDULE_WS_MAX_PENDING diffs
+behind, its pending diffs are replaced by a single "resync" message (refetch
+your windows); a send that blocks for SCHEDULE_WS_SEND_TIMEOUT_S closes the
+connection.
+
+Writes made by other workers arrive through the invalidation bus as bare
+(clinic_id, date) keys and are forwarded as "invalidate" messages, which the
+client answers by refetching those days (or polling /api/appointments/changes).
+
+Messages (server → client):
+  {"type": "subscribed",  "subscriptions": [...]}
+  {"type": "error",       "detail": "..."}
+  {"type": "diff",        "upserts": [appointment...], "removed": [id...]}
+  {"type": "invalidate",  "keys": [[clinic_id, date]...]}
+  {"type": "resync"}
+
+Environment variables:
+  SCHEDULE_WS_MAX_PENDING    : queued diffs per connection before resync (default: 500)
+  SCHEDULE_WS_SEND_TIMEOUT_S : slow-consumer cutoff                      (default: 10)
+  SCHEDULE_WS_COALESCE_MS    : wait this long to batch a burst of writes  (default: 50)
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from app.invalidation import Key, bus
+from app.metrics import registry
+
+log = logging.getLogger(__name__)
+
+MAX_PENDING  = int(os.getenv("SCHEDULE_WS_MAX_PENDING", "500"))
+SEND_TIMEOUT = float(os.getenv("SCHEDULE_WS_SEND_TIMEOUT_S", "10"))
+COALESCE_S   = int(os.getenv("SCHEDULE_WS_COALESCE_MS", "50")) / 1000
+
+_DIFF_FIELDS = ("id", "procedure_id", "patient_name", "clinic_id", "room_id", "date",
+                "start_time", "duration_mins", "primary_doctor_id", "status")
+
+MESSAGES = registry.counter("schedule_ws_messages_total", "Messages pushed to schedule subscribers", ("type",))
+
+
+@dataclass(frozen=True)
+class Window:
+    clinic_id : Optional[str]       # None = every clinic
+    start     : str                 # YYYY-MM-DD, inclusive
+    end       : str
+
+    def contains(self, clinic_id: str, day: str) -> bool:
+        return (self.clinic_id is None or self.clinic_id == clinic_id) and self.start <= day <= self.end
+
+
+def compact(appt) -> dict:
+    """The fields a dashboard needs to place an appointment on the grid."""
+    d = {f: getattr(appt, f) for f in _DIFF_FIELDS}
+    d["doctor_ids"] = json.loads(appt.doctor_ids) if isinstance(appt.doctor_ids, str) else appt.doctor_ids
+    return d
+
+
+class Connection:
+    def __init__(self, websocket):
+        self.ws = websocket
+        self.windows: set[Window] = set()
+        self.pending: dict[str, Optional[dict]] = {}     # id → diff (None = removed)
+        self.replies: deque[dict] = deque()               # acks and errors, sent in order
+        self.invalid: set[Key] = set()
+        self.resync = False
+        self.wake = asyncio.Event()
+
+    def wants(self, clinic_id: str, day: str) -> bool:
+        return any(w.contains(clinic_id, day) for w in self.windows)
+
+    def queue(self, appt_id: str, diff: Optional[dict]) -> None:
+        if self.resync:
+            return
+        self.pending[appt_id] = diff
+        if len(self.pending) > MAX_PENDING:
+            # Too far behind: a full refetch is cheaper than replaying every diff
+            self.force_resync()
+        self.wake.set()
+
+    def reply(self, message: dict) -> None:
+        self.replies.append(message)
+        self.wake.set()
+
+    def invalidate(self, keys: Iterable[Key]) -> None:
+        keys = list(keys)
+        if keys and not self.resync:
+            self.invalid.update(keys)
+            self.wake.set()
+
+    def force_resync(self) -> None:
+        self.pending.clear()
+        self.invalid.clear()
+        self.resync = True
+        self.wake.set()
+
+    async def send(self, message: dict) -> None:
+        await asyncio.wait_for(self.ws.send_json(message), SEND_TIMEOUT)
+        MESSAGES.labels(message["type"]).value += 1
+
+    async def pump(self) -> None:
+        """Drain coalesced diffs to the socket until it closes."""
+        while True:
+            await self.wake.wait()
+            if not self.replies:
+                await asyncio.sleep(COALESCE_S)
+            self.wake.clear()
+            while self.replies:
+                await self.send(self.replies.popleft())
+            if self.resync:
+                self.resync = False
+                await self.send({"type": "resync"})
+                continue
+            pending, self.pending = self.pending, {}
+            invalid, self.invalid = self.invalid, set()
+            if pending:
+                await self.send({
+                    "type": "diff",
+                    "upserts": [d for d in pending.values() if d is not None],
+                    "removed": [i for i, d in pending.items() if d is None],
+                })
+            if invalid:
+                await self.send({"type": "invalidate", "keys": sorted(invalid)})
+
+
+class ScheduleHub:
+    def __init__(self):
+        self.connections: set[Connection] = set()
+
+    def add(self, conn: Connection) -> None:
+        self.connections.add(conn)
+
+    def remove(self, conn: Connection) -> None:
+        self.connections.discard(conn)
+
+    def publish(self, appts: Iterable) -> None:
+        """Queue diffs for committed Appointment rows.  Cancelled rows are removals."""
+        if not self.connections:
+            return
+        for appt in appts:
+            diff = None if appt.status == "cancelled" else compact(appt)
+            for conn in self.connections:
+                if conn.wants(appt.clinic_id, appt.date):
+                    conn.queue(appt.id, diff)
+
+    def _remote(self, keys: Optional[list[Key]]) -> None:
+        for conn in self.connections:
+            if keys is None:
+                conn.force_resync()
+            else:
+                conn.invalidate(k for k in keys if conn.wants(*k))
+
+
+hub = ScheduleHub()
+bus.subscribe(hub._remote, remote_only=True)
+registry.register_collector(lambda: [
+    ("schedule_ws_connections", "gauge", "Open schedule WebSocket connections", {}, len(hub.connections)),
+])
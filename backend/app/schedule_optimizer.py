@@ -0,0 +1,321 @@
+"""
+schedule_optimizer.py — Offline compaction of fragmented clinic-days
+
+Cancellations and ad-hoc bookings leave short holes in a day: a room that is
+free while the only doctor who could use it is busy elsewhere, or 15 minutes
+between two fillings in the endo suite.  For each clinic-day this job
+proposes a small set of moves (new room and/or start time, same doctors,
+same day) that turns such stranded minutes back into bookable time.  Nothing
+is written; the plan is for the front desk to review and apply.
+
+A free room-minute is "bookable" when some procedure the room can host fits
+over it: the room is free for the whole duration and a qualified team —
+one doctor with the procedure's specialization, or a surgeon + anesthetist
+pair for IV sedation — is rostered and free for it.  Everything else in the
+room's staffed hours is "stranded".  The search is greedy best-improvement
+over single moves (each appointment moves at most once), preferring moves
+that strand the fewest minutes, then leave the fewest free fragments, then
+travel the shortest distance; it stops when no move helps or at max_moves.
+
+Days are independent, so they are solved in a process pool; the event loop
+only loads the books and collects results.  Workers start from a forkserver
+(spawn where that is unavailable), never a fork of the API process with its
+event loop, DB pools and LISTEN connection.
+
+Environment variables:
+  SCHEDULE_OPTIMIZER_WORKERS : pool size; 0 solves in-process (default: CPU count)
+
+  python -m app.schedule_optimizer --start 2026-11-02 --days 7 [--clinic downtown]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import Optional
+
+from sqlalchemy import select
+
+from app.models import Appointment
+from app.data_model import CLINICS, DOCTORS, PROCEDURES, get_clinic, get_procedure
+from app.routers.slots import _doctor_slots, mins_to_time, time_to_mins
+from app.shards import owns, scatter, shards_for
+
+STEP = 15
+WORKERS = int(os.getenv("SCHEDULE_OPTIMIZER_WORKERS", str(os.cpu_count() or 1)))
+MOVABLE = ("confirmed",)
+
+
+# ── Day model (runs in pool workers; plain dicts in, plain dicts out) ──
+
+def _bits(start_m: int, dur: int) -> int:
+    """Bitmask of the 15-minute slots an interval touches."""
+    lo, hi = start_m // STEP, -(-(start_m + dur) // STEP)
+    return ((1 << (hi - lo)) - 1) << lo
+
+
+def _runs(mask: int, n: int) -> int:
+    """Slots at which `n` consecutive set slots begin."""
+    run = mask
+    for k in range(1, n):
+        run &= mask >> k
+    return run
+
+
+def _cover(starts: int, n: int) -> int:
+    """Slots covered by an `n`-slot interval beginning at any of `starts`."""
+    covered = 0
+    for k in range(n):
+        covered |= starts << k
+    return covered
+
+
+def _teams(proc: dict, rostered: dict[str, int]) -> list[tuple[str, ...]]:
+    """Doctor combinations that may perform `proc` (anesthetist pairing included)."""
+    docs = [d for d in DOCTORS if d["id"] in rostered]
+    if proc.get("requires_anesthetist"):
+        surgeons = [d["id"] for d in docs if "oral_surgery" in d["specializations"]]
+        anes = [d["id"] for d in docs if "anesthesiology" in d["specializations"]]
+        return [(s, a) for s in surgeons for a in anes]
+    return [(d["id"],) for d in docs if proc["required_specs"][0] in d["specializations"]]
+
+
+class Day:
+    def __init__(self, clinic_id: str, day: str, appts: list[dict]):
+        clinic = get_clinic(clinic_id)
+        our_dow = (date.fromisoformat(day).weekday() + 1) % 7
+        self.rooms = {r["id"]: set(r["capabilities"]) for r in clinic["rooms"]}
+        self.roster: dict[str, int] = {}
+        for doc in DOCTORS:
+            slots = _doctor_slots(doc, clinic_id, our_dow)
+            if slots:
+                self.roster[doc["id"]] = sum(1 << (s // STEP) for s in slots)
+        # Procedures each room can host, with the teams rostered for them
+        self.hosted: dict[str, list[tuple[int, list[tuple[str, ...]]]]] = {}
+        self.staffed: dict[str, int] = {}
+        for room_id, caps in self.rooms.items():
+            options, staffed = [], 0
+            for proc in PROCEDURES:
+                if not set(proc["required_capabilities"]) <= caps:
+                    continue
+                teams = _teams(proc, self.roster)
+                if teams:
+                    options.append((-(-proc["duration"] // STEP), teams))
+                    for team in teams:
+                        staffed |= self._team_roster(team)
+            self.hosted[room_id] = options
+            self.staffed[room_id] = staffed
+        self.appts = {a["id"]: a for a in appts}
+        self.room_busy = {r: 0 for r in self.rooms}
+        self.doc_busy: dict[str, int] = {}
+        for a in appts:
+            self._place(a, a["room_id"], time_to_mins(a["start_time"]), +1)
+
+    def _team_roster(self, team: tuple[str, ...]) -> int:
+        mask = -1
+        for doc_id in team:
+            mask &= self.roster.get(doc_id, 0)
+        return mask
+
+    def _place(self, a: dict, room_id: str, start_m: int, sign: int) -> None:
+        bits = _bits(start_m, a["duration_mins"])
+        if sign > 0:
+            self.room_busy[room_id] = self.room_busy.get(room_id, 0) | bits
+            for doc_id in a["doctor_ids"]:
+                self.doc_busy[doc_id] = self.doc_busy.get(doc_id, 0) | bits
+        else:
+            self.room_busy[room_id] &= ~bits
+            for doc_id in a["doctor_ids"]:
+                self.doc_busy[doc_id] &= ~bits
+
+    def score(self) -> tuple[int, int]:
+        """(stranded minutes, free fragments) over every room's staffed hours."""
+        stranded = fragments = 0
+        for room_id, staffed in self.staffed.items():
+            free = staffed & ~self.room_busy.get(room_id, 0)
+            if not free:
+                continue
+            bookable = 0
+            for n, teams in self.hosted[room_id]:
+                for team in teams:
+                    avail = free & self._team_roster(team)
+                    for doc_id in team:
+                        avail &= ~self.doc_busy.get(doc_id, 0)
+                    bookable |= _cover(_runs(avail, n), n)
+            stranded += bin(free & ~bookable).count("1") * STEP
+            fragments += bin(free & ~(free << 1)).count("1")
+        return stranded, fragments
+
+    def candidates(self, a: dict):
+        """(room_id, start_m) placements for `a` with its own doctors, excluding where it is now."""
+        proc = get_procedure(a["procedure_id"])
+        needed = set(proc["required_capabilities"]) if proc else set()
+        n = -(-a["duration_mins"] // STEP)
+        docs_free = -1
+        for doc_id in a["doctor_ids"]:
+            docs_free &= self.roster.get(doc_id, 0) & ~self.doc_busy.get(doc_id, 0)
+        if docs_free <= 0:
+            return
+        current = (a["room_id"], time_to_mins(a["start_time"]))
+        for room_id, caps in self.rooms.items():
+            if not needed <= caps:
+                continue
+            starts = _runs(docs_free & ~self.room_busy.get(room_id, 0), n)
+            while starts:
+                low = starts & -starts
+                start_m = (low.bit_length() - 1) * STEP
+                starts ^= low
+                if (room_id, start_m) != current:
+                    yield room_id, start_m
+
+
+def optimize_day(clinic_id: str, day: str, appts: list[dict], max_moves: int) -> dict:
+    """Greedy move plan for one clinic-day; `appts` are the live bookings as plain dicts."""
+    model = Day(clinic_id, day, appts)
+    before = model.score()
+    best = before
+    moves: list[dict] = []
+    moved: set[str] = set()
+    while len(moves) < max_moves:
+        pick = None
+        for a in model.appts.values():
+            if a["id"] in moved or a["status"] not in MOVABLE:
+                continue
+            origin = time_to_mins(a["start_time"])
+            model._place(a, a["room_id"], origin, -1)
+            for room_id, start_m in model.candidates(a):
+                model._place(a, room_id, start_m, +1)
+                score = model.score()
+                model._place(a, room_id, start_m, -1)
+                if score[0] >= best[0]:
+                    continue
+                key = (score, abs(start_m - origin), room_id != a["room_id"])
+                if pick is None or key < pick[0]:
+                    pick = (key, a, room_id, start_m)
+            model._place(a, a["room_id"], origin, +1)
+        if pick is None:
+            break
+        (score, _, _), a, room_id, start_m = pick
+        model._place(a, a["room_id"], time_to_mins(a["start_time"]), -1)
+        model._place(a, room_id, start_m, +1)
+        moves.append({
+            "appointment_id": a["id"], "procedure_id": a["procedure_id"],
+            "patient_name": a["patient_name"], "doctor_ids": a["doctor_ids"],
+            "from_room": a["room_id"], "from_time": a["start_time"],
+            "to_room": room_id, "to_time": mins_to_time(start_m),
+        })
+        a["room_id"], a["start_time"] = room_id, mins_to_time(start_m)
+        moved.add(a["id"])
+        best = score
+    free = sum(bin(s & ~model.room_busy.get(r, 0)).count("1") for r, s in model.staffed.items()) * STEP
+    return {
+        "clinic_id": clinic_id, "date": day, "moves": moves, "free_mins": free,
+        "stranded_before": before[0], "stranded_after": best[0],
+        "recovered_mins": before[0] - best[0],
+    }
+
+
+def _solve(args: tuple) -> dict:
+    return optimize_day(*args)
+
+
+# ── Driver ────────────────────────────────────────────────────
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _executor() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if WORKERS > 0 and _pool is None:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        ctx = multiprocessing.get_context(method)
+        if method == "forkserver":
+            ctx.set_forkserver_preload([__name__])
+        _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=ctx)
+    return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def load_books(first: date, days: int, clinic_ids: list[str]) -> dict[tuple[str, str], list[dict]]:
+    """Live bookings per (clinic_id, date) as plain dicts for the pool."""
+    query = select(
+        Appointment.id, Appointment.procedure_id, Appointment.patient_name, Appointment.clinic_id,
+        Appointment.room_id, Appointment.date, Appointment.start_time, Appointment.duration_mins,
+        Appointment.doctor_ids, Appointment.status,
+    ).where(
+        Appointment.date >= str(first),
+        Appointment.date <= str(first + timedelta(days=days - 1)),
+        Appointment.clinic_id.in_(clinic_ids),
+        Appointment.status.notin_(("cancelled", "completed")),
+    )
+
+    async def fetch(db) -> list[dict]:
+        return [dict(r) for r in (await db.execute(query)).mappings()]
+
+    books: dict[tuple[str, str], list[dict]] = {}
+    for shard, part in zip(shards_for(clinic_ids), await scatter(fetch, clinic_ids)):
+        for r in part:
+            if owns(shard, r["clinic_id"]):
+                r["doctor_ids"] = json.loads(r["doctor_ids"])
+                books.setdefault((r["clinic_id"], r["date"]), []).append(r)
+    return books
+
+
+async def optimize(first: date, days: int, clinic_ids: Optional[list[str]] = None,
+                   max_moves: int = 10) -> dict:
+    """Move plans for every clinic-day in range, solved across the process pool."""
+    clinic_ids = clinic_ids or [c["id"] for c in CLINICS]
+    books = await load_books(first, days, clinic_ids)
+    jobs = [(cid, day, appts, max_moves) for (cid, day), appts in sorted(books.items())
+            if any(a["status"] in MOVABLE for a in appts)]
+    pool = _executor()
+    if pool is None:
+        results = [_solve(job) for job in jobs]
+    else:
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(loop.run_in_executor(pool, _solve, job) for job in jobs))
+    return {
+        "days": [r for r in results if r["moves"]],
+        "moves": sum(len(r["moves"]) for r in results),
+        "recovered_mins": sum(r["recovered_mins"] for r in results),
+        "days_checked": len(results),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Propose moves that consolidate fragmented free time")
+    parser.add_argument("--start", default=str(date.today() + timedelta(days=1)), help="YYYY-MM-DD")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--clinic", action="append", help="repeatable; default: every clinic")
+    parser.add_argument("--max-moves", type=int, default=10, help="per clinic-day")
+    args = parser.parse_args()
+
+    async def run():
+        from app.shards import all_engines
+        plan = await optimize(date.fromisoformat(args.start), args.days, args.clinic, args.max_moves)
+        for day in plan["days"]:
+            print(f"{day['date']} {day['clinic_id']}: recovers {day['recovered_mins']} of "
+                  f"{day['stranded_before']} stranded min")
+            for m in day["moves"]:
+                print(f"  {m['appointment_id']:<36} {m['procedure_id']:<22} "
+                      f"{m['from_room']} {m['from_time']} → {m['to_room']} {m['to_time']}")
+        print(f"{plan['moves']} moves over {plan['days_checked']} clinic-days, "
+              f"{plan['recovered_mins']} min recovered")
+        shutdown()
+        for e in all_engines():
+            await e.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
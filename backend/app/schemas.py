@@ -4,7 +4,7 @@ schemas.py — Pydantic v2 request/response schemas
 
 from __future__ import annotations
 from datetime import datetime
-from typing import Optional, List
+from typing import Literal, Optional, List
 from pydantic import BaseModel, Field
 
 
@@ -24,6 +24,19 @@ class AppointmentCreate(BaseModel):
     status            : str = "confirmed"
 
 
+class RecurrenceRule(BaseModel):
+    freq     : Literal["daily", "weekly", "monthly"]
+    interval : int = Field(1, ge=1, le=52)
+    count    : Optional[int] = Field(None, ge=1, le=366)
+    until    : Optional[str] = None           # YYYY-MM-DD, inclusive
+
+
+class AppointmentSeriesCreate(AppointmentCreate):
+    recurrence        : RecurrenceRule        # first occurrence is `date`
+    on_conflict       : Literal["fail", "skip", "shift"] = "fail"
+    shift_window_mins : int = Field(120, ge=15, le=720)
+
+
 class AppointmentStatusUpdate(BaseModel):
     status: str  # confirmed | completed | cancelled
 
@@ -48,6 +61,66 @@ class AppointmentOut(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class ColumnarDicts(BaseModel):
+    clinic_id    : List[str]
+    procedure_id : List[str]
+    doctor_id    : List[str]
+
+
+class AppointmentColumns(BaseModel):
+    """One array per AppointmentOut field; *_id columns hold indexes into ColumnarDicts."""
+    id                : List[str]
+    procedure_id      : List[int]
+    patient_name      : List[str]
+    patient_phone     : List[Optional[str]]
+    patient_email     : List[Optional[str]]
+    clinic_id         : List[int]
+    room_id           : List[str]
+    date              : List[str]
+    start_time        : List[str]
+    duration_mins     : List[int]
+    doctor_ids        : List[List[int]]
+    primary_doctor_id : List[int]
+    notes             : List[Optional[str]]
+    status            : List[str]
+    created_at        : List[Optional[datetime]]
+
+
+class ColumnarAppointments(BaseModel):
+    count   : int
+    dicts   : ColumnarDicts
+    columns : AppointmentColumns
+
+
+class SeriesAdjustment(BaseModel):
+    index      : int                          # occurrence number in the rule
+    date       : str
+    requested  : str
+    start_time : Optional[str]                # None when skipped
+    action     : str                          # shifted | skipped
+
+
+class AppointmentSeriesOut(BaseModel):
+    appointments : List[AppointmentOut]
+    adjusted     : List[SeriesAdjustment]
+
+
+class AppointmentChange(AppointmentOut):
+    change     : str                          # created | updated | cancelled
+    updated_at : Optional[datetime]
+
+
+class AppointmentChanges(BaseModel):
+    changes  : List[AppointmentChange]
+    cursor   : str                            # pass back as ?since=
+    has_more : bool
+
+
+class AppointmentSearchOut(BaseModel):
+    results  : List[AppointmentOut]
+    has_more : bool                           # next page: offset + limit
+
+
 class AppointmentStats(BaseModel):
     total     : int
     today     : int
@@ -67,6 +140,86 @@ class SlotOut(BaseModel):
     duration_mins     : int
     doctor_ids        : List[str]
     primary_doctor_id : str
+    score             : Optional[float] = None  # mode=ranked only; lower is better
+
+
+# ── Waitlist ─────────────────────────────────────────────────
+
+class WaitlistCreate(BaseModel):
+    procedure_id        : str
+    patient_name        : str
+    patient_phone       : Optional[str] = None
+    patient_email       : Optional[str] = None
+    preferred_clinic_id : Optional[str] = None
+    earliest_date       : str                   # YYYY-MM-DD
+    latest_date         : str                   # YYYY-MM-DD
+    earliest_time       : str = "00:00"         # HH:MM
+    latest_time         : str = "23:59"         # HH:MM, latest acceptable start
+    notes               : Optional[str] = None
+
+
+class WaitlistOut(BaseModel):
+    id                  : str
+    procedure_id        : str
+    patient_name        : str
+    patient_phone       : Optional[str]
+    patient_email       : Optional[str]
+    preferred_clinic_id : Optional[str]
+    earliest_date       : str
+    latest_date         : str
+    earliest_time       : str
+    latest_time         : str
+    notes               : Optional[str]
+    status              : str
+    appointment_id      : Optional[str]
+    created_at          : Optional[datetime]
+
+    model_config = {"from_attributes": True}
+
+
+# ── Schedule optimizer ───────────────────────────────────────
+
+class CompactionRequest(BaseModel):
+    start     : Optional[str] = None          # YYYY-MM-DD, default tomorrow
+    days      : int = Field(7, ge=1, le=60)
+    clinic_id : Optional[str] = None          # default: every clinic
+    max_moves : int = Field(10, ge=1, le=50)  # per clinic-day
+
+
+class CompactionMove(BaseModel):
+    appointment_id : str
+    procedure_id   : str
+    patient_name   : str
+    doctor_ids     : List[str]
+    from_room      : str
+    from_time      : str
+    to_room        : str
+    to_time        : str
+
+
+class CompactionDay(BaseModel):
+    clinic_id       : str
+    date            : str
+    moves           : List[CompactionMove]
+    free_mins       : int                     # free staffed room-minutes after the moves
+    stranded_before : int                     # free minutes no procedure can use
+    stranded_after  : int
+    recovered_mins  : int
+
+
+class CompactionPlan(BaseModel):
+    days           : List[CompactionDay]      # only days with moves
+    moves          : int
+    recovered_mins : int
+    days_checked   : int
+
+
+# ── Analytics export ─────────────────────────────────────────
+
+class ExportQueued(BaseModel):
+    status     : str                          # "queued" or "already_queued"
+    format     : str
+    watermarks : dict                         # {shard: horizon iso} the job resumes from
 
 
 # ── Chat ─────────────────────────────────────────────────────
@@ -0,0 +1,230 @@
+"""
+shards.py — Per-clinic database sharding
+
+Appointments live on the shard that owns their clinic; everything else
+(chat history, waitlist, schema bookkeeping for the main database) stays on
+the default shard, which is the engine from app.database.  With no shard
+configuration there is exactly one shard and nothing changes.
+
+  shard_for(clinic_id)       → Shard (name, engine, sessionmaker)
+  session_for(clinic_id)     → AsyncSession on the clinic's shard
+  scatter(fn, clinic_ids)    → run fn(db) on every shard owning those clinics, concurrently
+  owns(shard, clinic_id)     → whether a row read from `shard` is authoritative
+
+Reads that fan out drop rows a shard does not own, so a clinic half-way
+through a move is never counted twice.
+
+Environment variables (JSON objects):
+  DB_SHARDS : {"name": "<SQLAlchemy async URL>" | "schema:<pg schema>", ...}
+              a "schema:" shard reuses the main database with that search_path
+  SHARD_MAP : {"clinic_id": "shard name", ...}; unmapped clinics use "default"
+
+Rebalancing (copy a clinic to another shard, then purge the source):
+
+  python -m app.shards status
+  python -m app.shards move downtown east           # bulk copy; re-runnable
+  # set SHARD_MAP so downtown → east and redeploy, then
+  python -m app.shards move downtown east --finish  # copy stragglers, delete from source
+
+The copy is an idempotent upsert in (updated_at, id) order, so running it
+again only moves rows changed since the previous pass; --finish rescans
+everything before deleting.  A copy only replaces a target row with an
+older updated_at, so writes the target took after the switch survive.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Iterable, Optional, TypeVar
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from app.database import DATABASE_URL, AsyncSessionLocal, engine
+
+DEFAULT = "default"
+T = TypeVar("T")
+
+
+@dataclass
+class Shard:
+    name    : str
+    engine  : AsyncEngine
+    session : async_sessionmaker
+    schema  : Optional[str] = None      # Postgres schema for "schema:" shards
+
+
+def _make_shard(name: str, spec: str) -> Shard:
+    if spec.startswith("schema:"):
+        schema = spec[len("schema:"):]
+        eng = create_async_engine(DATABASE_URL, pool_size=5, max_overflow=2,
+                                  # public stays on the path for extensions (pg_trgm)
+                                  connect_args={"server_settings": {"search_path": f"{schema},public"}})
+    else:
+        schema = None
+        kwargs = {} if spec.startswith("sqlite") else {"pool_size": 5, "max_overflow": 2}
+        eng = create_async_engine(spec, **kwargs)
+    return Shard(name, eng, async_sessionmaker(eng, expire_on_commit=False, class_=AsyncSession), schema)
+
+
+SHARDS: dict[str, Shard] = {DEFAULT: Shard(DEFAULT, engine, AsyncSessionLocal)}
+for _name, _spec in json.loads(os.getenv("DB_SHARDS", "{}")).items():
+    SHARDS[_name] = _make_shard(_name, _spec)
+
+CLINIC_SHARD: dict[str, str] = json.loads(os.getenv("SHARD_MAP", "{}"))
+for _cid, _name in CLINIC_SHARD.items():
+    if _name not in SHARDS:
+        raise ValueError(f"SHARD_MAP sends {_cid} to unknown shard {_name!r}")
+
+SHARDED = len(SHARDS) > 1
+
+
+def shard_for(clinic_id: Optional[str]) -> Shard:
+    return SHARDS[CLINIC_SHARD.get(clinic_id, DEFAULT)]
+
+
+def owns(shard: Shard, clinic_id: Optional[str]) -> bool:
+    """False for stray rows, e.g. copies left on either side while a clinic is being moved."""
+    return shard_for(clinic_id) is shard
+
+
+def session_for(clinic_id: Optional[str]) -> AsyncSession:
+    """A new session on the clinic's shard; use as `async with session_for(cid) as db`."""
+    return shard_for(clinic_id).session()
+
+
+def shards_for(clinic_ids: Optional[Iterable[str]] = None) -> list[Shard]:
+    """Shards owning any of `clinic_ids` (all shards when None)."""
+    if clinic_ids is None:
+        return list(SHARDS.values())
+    names = {CLINIC_SHARD.get(c, DEFAULT) for c in clinic_ids}
+    return [s for s in SHARDS.values() if s.name in names]
+
+
+async def scatter(fn: Callable[[AsyncSession], Awaitable[T]],
+                  clinic_ids: Optional[Iterable[str]] = None) -> list[T]:
+    """fn(db) on each shard concurrently, one session per shard; results line up with shards_for(clinic_ids)."""
+    async def run(shard: Shard) -> T:
+        async with shard.session() as db:
+            return await fn(db)
+
+    targets = shards_for(clinic_ids)
+    if len(targets) == 1:
+        return [await run(targets[0])]
+    return list(await asyncio.gather(*(run(s) for s in targets)))
+
+
+def all_engines() -> list[AsyncEngine]:
+    return [s.engine for s in SHARDS.values()]
+
+
+# ── Rebalancing ───────────────────────────────────────────────
+
+_BATCH = 5000
+
+
+async def _counts() -> dict[str, dict[str, int]]:
+    from app.models import Appointment
+
+    async def count(db: AsyncSession):
+        rows = await db.execute(select(Appointment.clinic_id, func.count()).group_by(Appointment.clinic_id))
+        return dict(rows.all())
+
+    return {s.name: c for s, c in zip(SHARDS.values(), await scatter(count))}
+
+
+async def move_clinic(clinic_id: str, target: str, finish: bool = False) -> int:
+    """Upsert a clinic's appointments into `target`; with finish, delete them from other shards."""
+    from app.models import Appointment
+    if target not in SHARDS:
+        raise SystemExit(f"unknown shard {target!r}; known: {', '.join(SHARDS)}")
+    table = Appointment.__table__
+    dest = SHARDS[target]
+    copied = 0
+    resume = None
+    if not finish:
+        # Rows only ever move forward in (updated_at, id), so resume after the newest copy
+        async with dest.session() as dst:
+            newest = (await dst.execute(
+                select(table.c.updated_at, table.c.id).where(table.c.clinic_id == clinic_id)
+                .order_by(table.c.updated_at.desc(), table.c.id.desc()).limit(1))).first()
+            resume = tuple(newest) if newest else None
+    for source in SHARDS.values():
+        if source.name == target:
+            continue
+        after = resume
+        while True:
+            async with source.session() as src:
+                query = select(table).where(table.c.clinic_id == clinic_id)
+                if after is not None:
+                    query = query.where((table.c.updated_at > after[0]) |
+                                        ((table.c.updated_at == after[0]) & (table.c.id > after[1])))
+                rows = [dict(r) for r in (await src.execute(
+                    query.order_by(table.c.updated_at, table.c.id).limit(_BATCH))).mappings()]
+            if not rows:
+                break
+            async with dest.session() as dst:
+                if dest.engine.dialect.name == "postgresql":
+                    from sqlalchemy.dialects.postgresql import insert as upsert
+                else:
+                    from sqlalchemy.dialects.sqlite import insert as upsert
+                stmt = upsert(table)
+                # Never overwrite a newer copy: after the SHARD_MAP switch the
+                # target takes writes while --finish rescans the stale source
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.id],
+                    set_={c.name: stmt.excluded[c.name] for c in table.columns if c.name != "id"},
+                    where=stmt.excluded.updated_at > table.c.updated_at,
+                )
+                await dst.execute(stmt, rows)
+                await dst.commit()
+            copied += len(rows)
+            after = (rows[-1]["updated_at"], rows[-1]["id"])
+            print(f"\r  {source.name} → {target}: {copied:,} rows", end="", flush=True)
+        if finish:
+            async with source.session() as src:
+                await src.execute(delete(table).where(table.c.clinic_id == clinic_id))
+                await src.commit()
+    print()
+    return copied
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect and rebalance clinic shards")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("status", help="clinic → shard map and row counts")
+    mv = sub.add_parser("move", help="copy a clinic's appointments to another shard")
+    mv.add_argument("clinic_id")
+    mv.add_argument("shard")
+    mv.add_argument("--finish", action="store_true",
+                    help="after SHARD_MAP points at the target: copy stragglers and purge the source")
+    args = parser.parse_args()
+
+    async def run():
+        from app.migrations import migrate
+        await migrate()
+        if args.cmd == "status":
+            for shard, counts in (await _counts()).items():
+                print(f"{shard}:")
+                for cid, n in sorted(counts.items()):
+                    owner = CLINIC_SHARD.get(cid, DEFAULT)
+                    note = "" if owner == shard else f"   (stray — owned by {owner})"
+                    print(f"  {cid:<20} {n:>10,}{note}")
+        else:
+            if args.finish and CLINIC_SHARD.get(args.clinic_id, DEFAULT) != args.shard:
+                raise SystemExit(f"SHARD_MAP must route {args.clinic_id} to {args.shard} before --finish")
+            n = await move_clinic(args.clinic_id, args.shard, args.finish)
+            print(f"copied {n:,} rows of {args.clinic_id} to {args.shard}")
+            if not args.finish:
+                print(f"next: route {args.clinic_id} to {args.shard} in SHARD_MAP, redeploy, "
+                      f"then rerun with --finish")
+        for e in all_engines():
+            await e.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+startup_profile.py — Import-time and startup report for cold starts
+
+Each measurement runs in a fresh interpreter so module caches do not hide
+import cost.  Reports the import time of app.main, its heaviest imports, the
+cost of the (now deferred) LLM SDK import and lifespan startup per mode.
+
+  python -m app.startup_profile
+  python -m app.startup_profile --modes prod dev --top 15
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+_LLM_SDK = "google.generativeai"
+
+
+def _importtime(module: str) -> list[tuple[str, int]]:
+    """[(module, cumulative µs)] from `python -X importtime -c 'import module'`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=os.environ.copy(),
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(cumulative)))
+    return rows
+
+
+def _measure_startup(mode: str) -> dict:
+    code = (
+        "import asyncio, json, sys, time\n"
+        "t0 = time.perf_counter()\n"
+        "from app.main import app\n"
+        "t1 = time.perf_counter()\n"
+        "async def run():\n"
+        "    async with app.router.lifespan_context(app):\n"
+        "        return time.perf_counter()\n"
+        "t2 = asyncio.run(run())\n"
+        f"print(json.dumps({{'import_ms': (t1 - t0) * 1000, 'lifespan_ms': (t2 - t1) * 1000,"
+        f" 'llm_sdk_loaded': {_LLM_SDK!r} in sys.modules}}))\n"
+    )
+    env = {**os.environ, "STARTUP_MODE": mode}
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr else "failed"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Profile app import and startup time")
+    parser.add_argument("--modes", nargs="+", default=["prod", "dev"])
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    rows = _importtime("app.main")
+    total = next((us for name, us in rows if name == "app.main"), 0)
+    print(f"import app.main: {total / 1000:.1f} ms")
+    print(f"  {_LLM_SDK} imported at startup: {any(n == _LLM_SDK for n, _ in rows)}")
+    sdk = [us for name, us in _importtime(_LLM_SDK) if name == _LLM_SDK]
+    if sdk:
+        print(f"  deferred {_LLM_SDK} import (paid on first chat call): {sdk[0] / 1000:.1f} ms")
+    print(f"\nheaviest imports (cumulative):")
+    for name, us in sorted(rows, key=lambda r: -r[1])[1: args.top + 1]:
+        print(f"  {us / 1000:>8.1f} ms  {name}")
+
+    print("\nstartup by STARTUP_MODE (fresh interpreter each):")
+    for mode in args.modes:
+        r = _measure_startup(mode)
+        if "error" in r:
+            print(f"  {mode:<5} failed: {r['error']}")
+        else:
+            print(f"  {mode:<5} import {r['import_ms']:>7.1f} ms   lifespan {r['lifespan_ms']:>7.1f} ms"
+                  f"   llm sdk loaded: {r['llm_sdk_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+waitlist.py — Offer freed slots to waiting patients
+
+When an appointment is cancelled, the cancellation queues a "waitlist.fill"
+job (app.jobs) and fill_freed_slot() looks for the oldest
+waiting request whose procedure fits the freed (clinic, room, doctors,
+interval) and whose date/time window contains the whole procedure.  Slots
+that already started are not offered.  The lookup goes through
+ix_waitlist_match (procedure_id, status, earliest_date, latest_date), so only
+entries for procedures that fit on that date are read.  The winner gets a
+"held" appointment at the freed start time — booked through
+app.booking so the hold is conflict-checked — and the entry moves to
+"offered".  The front desk confirms the hold with the usual status PATCH;
+cancelling a hold puts its entry back to "waiting" and offers the interval
+to the next candidate.
+Waitlist entries live on the default shard; when the freed clinic is on
+another shard the hold commits there first and the entry follows.
+"""
+
+import json
+import logging
+from datetime import date, datetime
+
+from sqlalchemy import select, update, and_, or_
+
+from app.database import AsyncSessionLocal
+from app.models import WaitlistEntry
+from app.data_model import PROCEDURES, get_clinic, get_doctor, get_procedure
+from app.booking import book_appointments, BookingConflict
+from app.jobs import register
+from app.invalidation import bus, keys_for
+from app.schedule_hub import hub
+from app.shards import DEFAULT, shard_for
+from app.routers.slots import mins_to_time, time_to_mins
+
+log = logging.getLogger(__name__)
+
+
+def _doctors_for(proc: dict, doctor_ids: list[str]) -> list[str] | None:
+    """Doctor ids from the freed slot that can perform `proc`, primary first; None if they can't."""
+    docs = [get_doctor(d) for d in doctor_ids]
+    docs = [d for d in docs if d]
+    if proc.get("requires_anesthetist"):
+        surgeon = next((d for d in docs if "oral_surgery" in d["specializations"]), None)
+        anes    = next((d for d in docs if "anesthesiology" in d["specializations"]), None)
+        return [surgeon["id"], anes["id"]] if surgeon and anes else None
+    primary = next((d for d in docs if proc["required_specs"][0] in d["specializations"]), None)
+    return [primary["id"]] if primary else None
+
+
+def fitting_procedures(freed: dict) -> dict[str, list[str]]:
+    """{procedure_id: doctor_ids} for procedures that fit the freed room, doctors and length."""
+    clinic = get_clinic(freed["clinic_id"])
+    room = next((r for r in clinic["rooms"] if r["id"] == freed["room_id"]), None) if clinic else None
+    if not room:
+        return {}
+    fits = {}
+    for proc in PROCEDURES:
+        if proc["duration"] > freed["duration_mins"]:
+            continue
+        if not all(c in room["capabilities"] for c in proc["required_capabilities"]):
+            continue
+        doctors = _doctors_for(proc, freed["doctor_ids"])
+        if doctors:
+            fits[proc["id"]] = doctors
+    return fits
+
+
+async def _release_hold(appointment_id: str | None) -> str | None:
+    """Put the entry holding a cancelled appointment back to waiting; returns its id."""
+    if not appointment_id:
+        return None
+    async with AsyncSessionLocal() as db:
+        entry_id = await db.scalar(
+            update(WaitlistEntry)
+            .where(WaitlistEntry.appointment_id == appointment_id, WaitlistEntry.status == "offered")
+            .values(status="waiting", appointment_id=None, updated_at=datetime.utcnow())
+            .returning(WaitlistEntry.id)
+        )
+        await db.commit()
+    if entry_id:
+        log.info("waitlist %s hold %s cancelled, back to waiting", entry_id, appointment_id)
+    return entry_id
+
+
+async def fill_freed_slot(freed: dict) -> str | None:
+    """
+    Hold the freed interval for the best waiting candidate.  `freed` carries
+    clinic_id, room_id, date, start_time, duration_mins, doctor_ids (list)
+    and held_appointment_id when a waitlist hold was cancelled.  Returns the waitlist entry id that
+    was offered, if any.
+    """
+    released = await _release_hold(freed.get("held_appointment_id"))
+    now = datetime.now()
+    if (freed["date"], freed["start_time"]) <= (str(now.date()), now.strftime("%H:%M")):
+        return None
+    fits = fitting_procedures(freed)
+    if not fits:
+        return None
+
+    # The whole procedure must end inside the entry's time window
+    start = time_to_mins(freed["start_time"])
+    by_end: dict[str, list[str]] = {}
+    for proc_id in fits:
+        by_end.setdefault(mins_to_time(start + get_procedure(proc_id)["duration"]), []).append(proc_id)
+    fits_window = or_(*(and_(WaitlistEntry.procedure_id.in_(procs), WaitlistEntry.latest_time >= end)
+                        for end, procs in by_end.items()))
+
+    async with AsyncSessionLocal() as db:
+        query = (
+            select(WaitlistEntry)
+            .where(
+                WaitlistEntry.procedure_id.in_(list(fits)),
+                WaitlistEntry.status == "waiting",
+                WaitlistEntry.earliest_date <= freed["date"],
+                WaitlistEntry.latest_date >= freed["date"],
+                WaitlistEntry.earliest_time <= freed["start_time"],
+                fits_window,
+                or_(WaitlistEntry.preferred_clinic_id.is_(None),
+                    WaitlistEntry.preferred_clinic_id == freed["clinic_id"]),
+            )
+            .order_by(WaitlistEntry.created_at)
+            .limit(1)
+        )
+        if released:
+            # The patient who just gave this interval up is not offered it again
+            query = query.where(WaitlistEntry.id != released)
+        if db.bind.dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+        entry = (await db.execute(query)).scalars().first()
+        if not entry:
+            return None
+
+        proc = get_procedure(entry.procedure_id)
+        doctors = fits[entry.procedure_id]
+        entry.status = "offered"
+        item = dict(
+            procedure_id=entry.procedure_id,
+            patient_name=entry.patient_name,
+            patient_phone=entry.patient_phone,
+            patient_email=entry.patient_email,
+            clinic_id=freed["clinic_id"],
+            room_id=freed["room_id"],
+            date=freed["date"],
+            start_time=freed["start_time"],
+            duration_mins=proc["duration"],
+            doctor_ids=json.dumps(doctors),
+            primary_doctor_id=doctors[0],
+            notes=f"Waitlist hold ({entry.id})" + (f" — {entry.notes}" if entry.notes else ""),
+            status="held",
+        )
+        shard = shard_for(freed["clinic_id"])
+        try:
+            if shard.name == DEFAULT:
+                held = await book_appointments(db, [item], before_commit=lambda created: setattr(
+                    entry, "appointment_id", created[0].id))
+            else:
+                async with shard.session() as appt_db:
+                    held = await book_appointments(appt_db, [item])
+                entry.appointment_id = held[0].id
+                await db.commit()
+        except BookingConflict:
+            # Someone re-booked the interval first; the entry stays waiting
+            return None
+
+    await bus.publish(keys_for(held))
+    hub.publish(held)
+    log.info("waitlist %s offered %s %s %s", entry.id, freed["clinic_id"], freed["date"], freed["start_time"])
+    return entry.id
+
+
+register("waitlist.fill", fill_freed_slot)